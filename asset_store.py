@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+
+"""asset_store.py:
+A content-addressed store for static files of posts and pages.
+
+Every file is stored once, named after its content hash only, keeping its extension for the MIME type:
+    figures/photo.jpg -> <asset dir>/3f2a9c0d1e4b5a67.jpg, served as /assets/3f2a9c0d1e4b5a67.jpg
+so identical files are stored and deployed once, whatever their names in posts, and since the URL
+of a file changes whenever its content does, assets can be served with immutable, long-lived cache headers.
+
+URLs of static files in HTML fragments (/static/<root>/...) are rewritten to asset URLs.
+The manifest keeps, for every post and page, which static URLs were rewritten to which asset URLs;
+assets not referenced by any post or page are deleted.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import json
+import html
+import logging
+import posixpath
+import threading
+from urllib.parse import quote, unquote
+# this package
+from build_manifest import hash_file
+from static_sync import place_file
+
+lg = logging.getLogger(__name__)
+
+# bump this when the layout of the manifest or names of assets change
+ASSET_STORE_VERSION = 2
+# hex digits of the content hash used in asset names
+HASH_LENGTH = 16
+
+URL_ATTRIBUTE_PATTERN = re.compile(r'(\s(?:src|href|poster)=")([^"]*)(")', re.IGNORECASE)
+SRCSET_ATTRIBUTE_PATTERN = re.compile(r'(\ssrcset=")([^"]*)(")', re.IGNORECASE)
+
+
+def asset_name(path: str, digest: str) -> str:
+    extension = os.path.splitext(path)[1]
+    return f"{digest[:HASH_LENGTH]}{extension.lower()}"
+
+
+class AssetStore:
+    def __init__(self, output_directory: str, url_base: str, manifest_file: str, link: str = "copy") -> None:
+        """
+        output_directory: where assets are written, served at url_base
+        link: how files are placed in output_directory, see static_sync.place_file
+        """
+        self.output_directory = output_directory
+        self.url_base = url_base
+        self.manifest_file = manifest_file
+        self.link = link
+        # item key ("post:<path>", "page:<path>") -> {static URL: asset URL}
+        self.items: dict[str, dict[str, str]] = {}
+        # names of assets stored by this process, posts and pages are built concurrently,
+        # so an asset may be stored before the item referencing it is set
+        self.added: set[str] = set()
+        self.lock = threading.Lock()
+        # posts and pages stages save concurrently, one save at a time
+        self.save_lock = threading.Lock()
+        os.makedirs(output_directory, exist_ok=True)
+        if not os.path.exists(manifest_file):
+            return
+        try:
+            with open(manifest_file, 'rb') as f:
+                content = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            lg.warning(f"Cannot read asset manifest at {manifest_file}, ignoring it: {e}")
+            return
+        if content.get("version") == ASSET_STORE_VERSION and content.get("url_base") == url_base:
+            self.items = content["items"]
+
+    def settings(self) -> dict:
+        """
+        Settings affecting output, to be included in build fingerprints.
+        """
+        return {"version": ASSET_STORE_VERSION, "url_base": self.url_base}
+
+    def add(self, path: str) -> str:
+        """
+        Stores the file at path if its content is not stored yet, returns its asset URL.
+        """
+        name = asset_name(path, hash_file(path))
+        dst = os.path.join(self.output_directory, name)
+        # recorded before the file is placed, so a concurrent save() never deletes it
+        with self.lock:
+            self.added.add(name)
+        if not os.path.exists(dst):
+            # write under a temporary name, so a partially written asset is never served
+            temp_path = f"{dst}.{threading.get_ident()}.tmp"
+            place_file(path, temp_path, self.link)
+            os.replace(temp_path, dst)
+        return self.url_base + quote(name)
+
+    def rewrite(self, fragment: str, static_url_base: str, source_roots: list[str]) -> tuple[str, dict[str, str]]:
+        """
+        Rewrites URLs below static_url_base in src, href, poster and srcset attributes to asset URLs.
+        The file of a URL is looked up in source_roots in order, URLs without a file are kept.
+        Returns the rewritten fragment and the rewritten URLs.
+        """
+        mapping = {}
+
+        def resolve(url: str) -> str:
+            # keep #fragment and ?query of links
+            split = min([i for i in (url.find("#"), url.find("?")) if i >= 0], default=len(url))
+            path, suffix = unquote(url[:split]), url[split:]
+            if not path.startswith(static_url_base):
+                return url
+            rel_path = posixpath.normpath(path[len(static_url_base):])
+            if rel_path.startswith("../") or rel_path == "..":
+                return url
+            if path not in mapping:
+                for root in source_roots:
+                    file_path = os.path.join(root, *rel_path.split("/"))
+                    if os.path.isfile(file_path):
+                        mapping[path] = self.add(file_path)
+                        break
+                else:
+                    return url
+            return mapping[path] + suffix
+
+        def replace_url(match: re.Match) -> str:
+            url = html.unescape(match.group(2))
+            return match.group(1) + html.escape(resolve(url)) + match.group(3)
+
+        def replace_srcset(match: re.Match) -> str:
+            candidates = []
+            for candidate in html.unescape(match.group(2)).split(","):
+                parts = candidate.strip().rsplit(" ", 1)
+                url = parts[0]
+                # descriptor is the last space separated part, if it looks like 480w or 2x
+                if len(parts) == 2 and re.fullmatch(r"\d+(\.\d+)?[wx]", parts[1]):
+                    candidates.append(f"{resolve(url)} {parts[1]}")
+                else:
+                    candidates.append(resolve(candidate.strip()))
+            return match.group(1) + html.escape(", ".join(candidates)) + match.group(3)
+
+        fragment = URL_ATTRIBUTE_PATTERN.sub(replace_url, fragment)
+        fragment = SRCSET_ATTRIBUTE_PATTERN.sub(replace_srcset, fragment)
+        return fragment, mapping
+
+    def set_item(self, key: str, mapping: dict[str, str]) -> None:
+        with self.lock:
+            self.items[key] = mapping
+
+    def prune(self, prefix: str, keys: list[str]) -> None:
+        """
+        Forgets items with the given prefix that are not in keys.
+        """
+        keep = set(keys)
+        with self.lock:
+            for key in [k for k in self.items if k.startswith(prefix) and k not in keep]:
+                del self.items[key]
+
+    def save(self) -> None:
+        """
+        Writes the manifest and deletes assets not referenced by any item.
+        Assets stored by this process are kept, unreferenced ones are deleted by the next build.
+        Temporary files of assets being stored by other threads are never deleted.
+        """
+        with self.save_lock:
+            with self.lock:
+                # mappings of items are replaced, never modified, a shallow copy is a snapshot
+                content = {"version": ASSET_STORE_VERSION, "url_base": self.url_base, "items": dict(self.items)}
+                referenced = {unquote(url[len(self.url_base):])
+                              for mapping in self.items.values() for url in mapping.values()}
+            os.makedirs(os.path.dirname(self.manifest_file) or ".", exist_ok=True)
+            temp_file = self.manifest_file + ".tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(json.dumps(content, indent=1, ensure_ascii=False).encode('utf-8'))
+            os.replace(temp_file, self.manifest_file)
+            removed = 0
+            with self.lock:
+                keep = referenced | self.added
+            for name in os.listdir(self.output_directory):
+                if name not in keep and not name.endswith(".tmp"):
+                    os.remove(os.path.join(self.output_directory, name))
+                    removed += 1
+        lg.info(f"Asset manifest saved, {len(referenced)} assets referenced, {removed} unused assets removed.")
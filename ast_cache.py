@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""ast_cache.py:
+Caches pandoc JSON ASTs of markdown documents, keyed by hash of the markdown source
+and the pandoc version, so a document is parsed by pandoc only once as long as it does not change.
+Everything done after parsing (path rewriting, rendering to HTML) starts from the cached AST.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import time
+import json
+import hashlib
+import logging
+import threading
+
+lg = logging.getLogger(__name__)
+
+# entries not used for this many days are removed by prune()
+MAX_UNUSED_DAYS = 30
+
+
+class AstCache:
+    def __init__(self, cache_directory: str, pandoc_version: str) -> None:
+        self.cache_directory = cache_directory
+        self.pandoc_version = pandoc_version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def key(self, markdown: bytes) -> str:
+        h = hashlib.sha256()
+        h.update(self.pandoc_version.encode('utf-8') + b'\0')
+        h.update(markdown)
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_directory, key + ".json")
+
+    def get(self, key: str) -> dict | None:
+        """
+        Returns a fresh copy of the cached AST, callers may modify it.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                ast = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        # mtime tells prune() when the entry was last used
+        os.utime(path)
+        self.hits += 1
+        return ast
+
+    def put(self, key: str, ast: dict) -> None:
+        path = self._path(key)
+        # the same document may be parsed by the posts and pages stages, or by several builds at once
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(ast, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        os.replace(temp_path, path)
+
+    def prune(self, max_unused_days: float = MAX_UNUSED_DAYS) -> None:
+        deadline = time.time() - max_unused_days * 86400
+        removed = 0
+        for name in os.listdir(self.cache_directory):
+            path = os.path.join(self.cache_directory, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                # temporary file of a put() that just completed
+                pass
+        lg.info(f"pandoc AST cache: {self.hits} hits, {self.misses} misses, {removed} unused entries removed.")
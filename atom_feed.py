@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""atom_feed.py:
+Writes an Atom feed (RFC 4287) of the latest posts.
+
+The latest posts are selected with a heap bounded by the number of entries,
+instead of sorting all posts. The feed's updated time is taken from its newest entry,
+not from the time of the build, so the file is only rewritten when its content changes.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import heapq
+import logging
+from typing import Iterable
+from xml.sax.saxutils import escape, quoteattr
+# this package
+from posts_index import write_if_changed
+from sitemap_xml import w3c_datetime
+
+lg = logging.getLogger(__name__)
+
+
+def write_atom_feed(posts: Iterable[dict], feed_file: str, count: int,
+                    title: str, site_url: str, feed_url: str) -> bool:
+    """
+    posts: dicts with title, link (absolute), summary, author, published (unix timestamp)
+           and categories, consumed once
+    site_url, feed_url: URLs of the site and of the feed itself
+    Returns whether the feed file changed.
+    """
+    # ties are broken by link, so the selection does not depend on the order of posts
+    latest = heapq.nlargest(count, posts, key=lambda post: (post["published"], post["link"]))
+    updated = w3c_datetime(latest[0]["published"] if latest else 0)
+    parts = [
+        '<?xml version="1.0" encoding="utf-8"?>\n',
+        '<feed xmlns="http://www.w3.org/2005/Atom">\n',
+        f"<title>{escape(title)}</title>\n",
+        f"<link href={quoteattr(site_url)}/>\n",
+        f'<link rel="self" type="application/atom+xml" href={quoteattr(feed_url)}/>\n',
+        f"<id>{escape(site_url)}</id>\n",
+        f"<updated>{updated}</updated>\n",
+    ]
+    for post in latest:
+        published = w3c_datetime(post["published"])
+        parts += [
+            "<entry>\n",
+            f"<title>{escape(post['title'])}</title>\n",
+            f'<link rel="alternate" type="text/html" href={quoteattr(post["link"])}/>\n',
+            f"<id>{escape(post['link'])}</id>\n",
+            f"<published>{published}</published>\n",
+            f"<updated>{published}</updated>\n",
+            f"<author><name>{escape(post['author'])}</name></author>\n",
+            f"<summary>{escape(post['summary'])}</summary>\n",
+        ]
+        parts += [f"<category term={quoteattr(c)}/>\n" for c in post["categories"]]
+        parts.append("</entry>\n")
+    parts.append("</feed>\n")
+    changed = write_if_changed(feed_file, "".join(parts).encode('utf-8'))
+    lg.info(f"Atom feed with {len(latest)} entries written to {feed_file}, changed: {changed}")
+    return changed
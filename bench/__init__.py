@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+
+"""bench:
+Benchmark harness for the buildtools, see run_bench.py.
+"""
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+"""api_checks.py:
+Scenarios exercising the lablog API clients against FakeBackend, run by run_bench.py
+after the build scenarios:
+    async register  AsyncLablogAPI registers posts concurrently, the backend must never
+                    handle more than max_concurrency requests at the same time
+    async timeout   a request slower than its own timeout fails in about that time,
+                    while the same request with the default timeout succeeds
+    http cache      a second GET of posts is revalidated with If-None-Match, answered with
+                    304 Not Modified and served from cache, by LablogAPI and AsyncLablogAPI;
+                    a fresh response is used without a request, a stale one when the backend fails
+Every check returns its measurements, with "ok" telling whether the expectation held.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import importlib.util
+# this package
+from bench.fake_backend import FakeBackend
+
+lg = logging.getLogger("bench")
+
+# latency of the fake backend while checking, long enough for requests to overlap
+CHECK_LATENCY = 0.05
+
+
+async def check_async_register(backend: FakeBackend, config_path: str, posts: int = 40,
+                               max_concurrency: int = 4) -> dict:
+    from lablog_api_async import AsyncLablogAPI
+    backend.max_in_flight = 0
+    data_list = [{"title": f"Async bench post {i}", "link": f"/posts/async-{i}.html"} for i in range(posts)]
+    async with AsyncLablogAPI(config_path, max_concurrency=max_concurrency, timeout=30) as api:
+        start = time.perf_counter()
+        results = await api.register_posts(data_list)
+        seconds = time.perf_counter() - start
+    failed = [r for r in results if isinstance(r, Exception)]
+    return {
+        "posts": posts, "max_concurrency": max_concurrency, "seconds": round(seconds, 4),
+        "requests_per_second": round(posts / seconds, 2), "max_in_flight": backend.max_in_flight,
+        "failed": len(failed),
+        # all concurrency used, never more
+        "ok": not failed and backend.max_in_flight == max_concurrency,
+    }
+
+
+async def check_async_timeout(backend: FakeBackend, config_path: str, timeout: float = 0.1) -> dict:
+    from lablog_api_async import AsyncLablogAPI
+    latency = backend.latency
+    backend.latency = timeout * 3
+    try:
+        async with AsyncLablogAPI(config_path, timeout=30) as api:
+            start = time.perf_counter()
+            try:
+                await api.register_post({"title": "Async bench timeout"}, timeout=timeout)
+                timed_out = False
+            except asyncio.TimeoutError:
+                timed_out = True
+            seconds = time.perf_counter() - start
+            # the default timeout still applies to other requests
+            result = await api.register_post({"title": "Async bench default timeout"})
+    finally:
+        backend.latency = latency
+    return {
+        "timeout": timeout, "seconds": round(seconds, 4), "timed_out": timed_out,
+        "ok": timed_out and seconds < timeout * 2 and "post_id" in result,
+    }
+
+
+def _check_config(config_path: str, name: str, **build) -> str:
+    """
+    Writes a copy of the config at config_path with its own empty HTTP cache and the given build options,
+    returns its path. Clients write tokens back to their config, so the original is left alone.
+    """
+    with open(config_path, 'rb') as f:
+        config = json.loads(f.read().decode('utf-8'))
+    directory = os.path.join(os.path.dirname(config_path), "checks", name)
+    shutil.rmtree(directory, ignore_errors=True)
+    config["paths"]["http_cache_directory"] = os.path.join(directory, "http") + "/"
+    config["build"].update(build)
+    path = os.path.join(directory, "config.json")
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(json.dumps(config, indent=2).encode('utf-8'))
+    return path
+
+
+def check_http_cache(backend: FakeBackend, config_path: str) -> dict:
+    from lablog_api import LablogAPI
+    # every response is stale at once, so every get is revalidated
+    revalidating = _check_config(config_path, "http cache", api_cache_ttl=0)
+
+    def requests() -> tuple[int, int]:
+        return backend.requests.get("GET /posts", 0), backend.requests.get("304 /posts", 0)
+
+    api = LablogAPI(revalidating)
+    before = requests()
+    first = api.get_posts()
+    after_first = requests()
+    second = api.get_posts()
+    after_second = requests()
+    # the first get is a full response, the second a 304 served from cache
+    revalidated = after_first[0] - before[0] == 1 and after_first[1] == before[1] and \
+        after_second[0] - after_first[0] == 1 and after_second[1] - after_first[1] == 1 and second == first
+    # the same cache with a long ttl answers without any request
+    config = api.config.model_copy(deep=True)
+    config.build.api_cache_ttl = 300
+    fresh = LablogAPI(revalidating, config=config).get_posts() == first and requests() == after_second
+    backend.fail = True
+    try:
+        stale_if_error = api.get_posts() == first
+    finally:
+        backend.fail = False
+    result = {"posts": len(first), "revalidated": revalidated, "fresh": fresh, "stale_if_error": stale_if_error}
+    if importlib.util.find_spec("aiohttp") is not None:
+        result["async_revalidated"] = asyncio.run(_async_revalidated(backend, revalidating, first))
+    result["ok"] = all(result[k] for k in ("revalidated", "fresh", "stale_if_error")) and \
+        result.get("async_revalidated", True)
+    return result
+
+
+async def _async_revalidated(backend: FakeBackend, config_path: str, posts: list) -> bool:
+    """
+    Whether AsyncLablogAPI revalidates the response cached by LablogAPI and gets 304 Not Modified.
+    """
+    from lablog_api_async import AsyncLablogAPI
+    not_modified = backend.requests.get("304 /posts", 0)
+    async with AsyncLablogAPI(config_path) as api:
+        result = await api.get_posts()
+    return result == posts and backend.requests.get("304 /posts", 0) == not_modified + 1
+
+
+def run_api_checks(backend: FakeBackend, config_path: str) -> dict:
+    """
+    Runs all checks, returns their results by name.
+    """
+    lg.warning("Running check http cache")
+    checks = {"http cache": check_http_cache(backend, config_path)}
+    if importlib.util.find_spec("aiohttp") is None:
+        lg.warning("aiohttp is not installed, skipping checks of AsyncLablogAPI.")
+        return checks
+    latency = backend.latency
+    backend.latency = max(latency, CHECK_LATENCY)
+    try:
+        lg.warning("Running check async register")
+        checks["async register"] = asyncio.run(check_async_register(backend, config_path))
+        lg.warning("Running check async timeout")
+        checks["async timeout"] = asyncio.run(check_async_timeout(backend, config_path))
+    finally:
+        backend.latency = latency
+    return checks
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""corpus.py:
+Generates a synthetic posts/ and pages/ tree in the layout expected by the buildtools:
+    posts/<root>/post.md, meta.json, figures/*.jpg, src/*.c
+    pages/<root>/page.md, meta.json
+Content is generated from a fixed seed, so the same arguments always give the same corpus.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import random
+# third-party libs
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt "
+    "labore dolore magna aliqua enim minim veniam quis nostrud exercitation ullamco laboris "
+    "kernel pandoc build static frontend cache latency throughput memory thread process "
+    "博客 构建 测试 性能 缓存"
+).split()
+CATAGORIES = ["Programming", "Electronics", "Notes", "Miscellaneous", "Photography"]
+TAGS = ["python", "c", "linux", "fpga", "rf", "math", "tools", "web", "pcb", "audio",
+        "camera", "nginx", "vue", "rust", "lua", "pandoc"]
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _write_image(path: str, rng: random.Random, width: int, height: int) -> None:
+    if Image is None:
+        # not a valid JPEG, only useful when responsive images are disabled
+        with open(path, 'wb') as f:
+            f.write(rng.randbytes(width * height // 8))
+        return
+    image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    image.save(path, "JPEG", quality=85)
+
+
+def _markdown(rng: random.Random, title: str, size: int, images: list[str], sources: list[str]) -> str:
+    """
+    size: approximate number of words
+    """
+    parts = [f"# {title}", ""]
+    written = 0
+    section = 1
+    while written < size:
+        if written // 400 >= section:
+            section += 1
+            parts += [f"## Section {section}", ""]
+        words = rng.randint(40, 120)
+        parts += [_paragraph(rng, words), ""]
+        written += words
+        if rng.random() < 0.15:
+            parts += ["```python", "def f(x):", "    return x * 2", "```", ""]
+        if rng.random() < 0.1:
+            parts += ["$$", "e^{i\\pi} + 1 = 0", "$$", ""]
+    for image in images:
+        parts += [f"![{os.path.basename(image)}]({image})", ""]
+    for source in sources:
+        parts += [f"[{os.path.basename(source)}]({source})", ""]
+    return "\n".join(parts)
+
+
+def generate_corpus(root: str, posts: int, pages: int = 5, words: int = 800,
+                    images: int = 2, image_size: int = 1200, seed: int = 0) -> tuple[str, str]:
+    """
+    Writes posts and pages under root, returns paths of the posts and pages directories.
+    Existing files are overwritten.
+    words: approximate number of words per post
+    images: number of images per post, image_size is their width
+    """
+    rng = random.Random(seed)
+    posts_directory = os.path.join(root, "posts") + "/"
+    pages_directory = os.path.join(root, "pages") + "/"
+    for i in range(posts):
+        post_root = f"post-{i:05d}"
+        post_path = os.path.join(posts_directory, post_root)
+        os.makedirs(os.path.join(post_path, "figures"), exist_ok=True)
+        os.makedirs(os.path.join(post_path, "src"), exist_ok=True)
+        image_files = [f"figures/figure-{j}.jpg" for j in range(images)]
+        for image_file in image_files:
+            _write_image(os.path.join(post_path, image_file), rng, image_size, image_size * 2 // 3)
+        source_files = ["src/main.c"]
+        with open(os.path.join(post_path, "src", "main.c"), 'wb') as f:
+            f.write(b"int main(void) { return 0; }\n")
+        title = f"Post {i}: " + " ".join(rng.choice(WORDS) for _ in range(4))
+        with open(os.path.join(post_path, "post.md"), 'wb') as f:
+            f.write(_markdown(rng, title, rng.randint(words // 2, words * 3 // 2),
+                              image_files, source_files).encode('utf-8'))
+        meta = {
+            "title": title,
+            "author": "Bench",
+            "email": "bench@example.com",
+            "abstract": _paragraph(rng, 30),
+            "root": post_root,
+            # one post per day, newest last
+            "timestamp": 1600000000 + i * 86400,
+            "catagory": rng.choice(CATAGORIES),
+            "tags": rng.sample(TAGS, rng.randint(1, 4)),
+        }
+        with open(os.path.join(post_path, "meta.json"), 'wb') as f:
+            f.write(json.dumps(meta, indent=2).encode('utf-8'))
+    for i in range(pages):
+        page_root = f"page-{i:03d}"
+        page_path = os.path.join(pages_directory, page_root)
+        os.makedirs(page_path, exist_ok=True)
+        with open(os.path.join(page_path, "page.md"), 'wb') as f:
+            f.write(_markdown(rng, f"Page {i}", words, [], []).encode('utf-8'))
+        with open(os.path.join(page_path, "meta.json"), 'wb') as f:
+            f.write(json.dumps({"title": f"Page {i}", "root": page_root}, indent=2).encode('utf-8'))
+    return posts_directory, pages_directory
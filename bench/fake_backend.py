@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""fake_backend.py:
+A local stand-in for the lablog backend, implementing the endpoints used by LablogAPI:
+    POST /token     returns a JWT valid for a day
+    GET  /posts     returns all registered posts, with ETag and Last-Modified,
+                    304 Not Modified for a matching If-None-Match or If-Modified-Since
+    POST /posts     registers a post, assigns post_id if it has none
+An artificial latency can be added to every request to approximate a remote server,
+and GET requests can be made to fail with 503, to test fallbacks to cached responses.
+The highest number of requests handled at the same time is recorded, to check concurrency limits of clients,
+and 304 responses are counted as "304 <path>", to check revalidation of cached responses.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import sys
+import json
+import time
+import uuid
+import hashlib
+import threading
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+# third-party libs
+import jwt
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeBackend"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, content, headers: dict | None = None) -> None:
+        data = json.dumps(content).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_modified(self, headers: dict) -> bool:
+        if "If-None-Match" in self.headers:
+            return self.headers["If-None-Match"] == headers["ETag"]
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = parsedate_to_datetime(self.headers["If-Modified-Since"]).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(self.server.modified) <= since
+        return False
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        with self.server.handling():
+            self._get()
+
+    def do_POST(self):
+        with self.server.handling():
+            self._post()
+
+    def _get(self):
+        time.sleep(self.server.latency)
+        self.server.count("GET " + self.path)
+        if self.server.fail:
+            self.send_error(503)
+            return
+        if self.path.rstrip("/").endswith("/posts"):
+            with self.server.lock:
+                posts = list(self.server.posts.values())
+                headers = {"ETag": '"' + hashlib.sha256(json.dumps(posts).encode('utf-8')).hexdigest()[:16] + '"',
+                           "Last-Modified": formatdate(self.server.modified, usegmt=True)}
+            if self._not_modified(headers):
+                self.server.count("304 " + self.path)
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+            self._reply(posts, headers)
+            return
+        self.send_error(404)
+
+    def _post(self):
+        time.sleep(self.server.latency)
+        self.server.count("POST " + self.path)
+        body = self._body()
+        if self.path.rstrip("/").endswith("/token"):
+            token = jwt.encode({"sub": "bench", "exp": int(time.time()) + 86400}, "bench", algorithm="HS256")
+            self._reply({"access_token": token, "token_type": "bearer"})
+            return
+        if self.path.rstrip("/").endswith("/posts"):
+            post = json.loads(body.decode('utf-8'))
+            post.setdefault("post_id", uuid.uuid4().hex)
+            with self.server.lock:
+                self.server.posts[post["post_id"]] = post
+                self.server.modified = time.time()
+            self._reply(post)
+            return
+        self.send_error(404)
+
+
+class FakeBackend(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.0) -> None:
+        """
+        port: 0 picks a free port
+        latency: seconds added to every request
+        """
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        # GET requests fail with 503 while this is set
+        self.fail = False
+        self.lock = threading.Lock()
+        self.posts: dict[str, dict] = {}
+        # time posts last changed
+        self.modified = time.time()
+        self.requests: dict[str, int] = {}
+        # number of requests being handled, and its maximum since start
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def count(self, request: str) -> None:
+        with self.lock:
+            self.requests[request] = self.requests.get(request, 0) + 1
+
+    @contextmanager
+    def handling(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def handle_error(self, request, client_address) -> None:
+        # clients that time out close their connection before the reply
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name="fake-backend", daemon=True).start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""run_bench.py:
+Runs LablogBuilder end to end on a synthetic corpus, against a local fake backend,
+without npm build and deploy, and reports time and throughput of every build stage.
+
+Scenarios, run one after another on the same work directory:
+    cold    nothing built yet, every post and page is built and registered
+    noop    nothing changed, measures the cost of deciding that nothing needs to be built
+    edit    one post changed
+followed by checks of the API clients against the fake backend, see api_checks.py.
+
+Usage, from the repository root:
+    $ python3 -m bench.run_bench --posts 1000 --workers 4
+    $ python3 -m bench.run_bench --posts 1000 --workers 4 --save-baseline
+    $ python3 -m bench.run_bench --posts 1000 --workers 4 --baseline bench/baseline.json
+Exits with status 1 if any check fails or any stage is slower than the baseline by more than --tolerance.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+# this package
+from bench.corpus import generate_corpus
+from bench.fake_backend import FakeBackend
+from bench.api_checks import run_api_checks
+
+lg = logging.getLogger("bench")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_FILE = os.path.join(ROOT, "config.default.json")
+DEFAULT_BASELINE_FILE = os.path.join(ROOT, "bench", "baseline.json")
+# stages faster than this are not compared with baseline, their timings are mostly noise
+MIN_COMPARED_SECONDS = 0.05
+
+
+def write_bench_config(work_directory: str, backend_port: int, args) -> str:
+    """
+    Writes a config.json for the corpus in work_directory, returns its path.
+    """
+    with open(DEFAULT_CONFIG_FILE, 'rb') as f:
+        config = json.loads(f.read().decode('utf-8'))
+    config["api"]["restful"] = {"protocol": "http://", "host": "127.0.0.1",
+                                "port": backend_port, "endpoint": "/"}
+    config["api"]["authentication"].update(
+        {"username": "bench", "password": "bench", "access_token": ""})
+    frontend = os.path.join(work_directory, "frontend") + "/"
+    paths = config["paths"]
+    outputs = {
+        "temporary_files_directory": os.path.join(work_directory, "temp") + "/",
+        "post_template_file": os.path.join(ROOT, "post_template.html"),
+        "posts_input_directory": os.path.join(work_directory, "posts") + "/",
+        "posts_output_directory": frontend + "posts/",
+        "page_template_file": os.path.join(ROOT, "page_template.html"),
+        "pages_input_directory": os.path.join(work_directory, "pages") + "/",
+        "pages_output_directory": frontend + "pages/",
+        "buffered_posts_json_file": frontend + "public/posts.json",
+        "posts_index_output_directory": frontend + "public/index/",
+        "search_index_output_directory": frontend + "public/search/",
+        "static_files_output_directory": frontend + "public/static/",
+        "asset_store_output_directory": frontend + "public/assets/",
+        "sitemap_output_file": frontend + "public/sitemap.txt",
+        "sitemap_xml_output_directory": frontend + "public/",
+        "feed_output_file": frontend + "public/feed.xml",
+        "npm_build_working_directory": frontend,
+        "frontend_dist_files": frontend + "public/*",
+        "remote_html_directory": os.path.join(work_directory, "deployed"),
+    }
+    for key, value in paths.items():
+        if key in outputs:
+            paths[key] = outputs[key]
+        elif value.startswith("./"):
+            # manifests, caches and the post database of the buildtools, never touch the developer's own,
+            # and a fresh work directory makes the cold scenario cold
+            paths[key] = os.path.join(work_directory, value[2:])
+        elif value.startswith("../"):
+            raise ValueError(f"paths.{key} is outside of the repository, add it to the benchmark outputs.")
+    config["build"].update({
+        "pandoc_executable": args.pandoc,
+        "pandoc_backend": args.pandoc_backend,
+        "workers": args.workers,
+        "run_npm_build": False,
+        "deploy_mode": "none",
+        "trace": True,
+        "search_index": args.search_index,
+        "related_posts": args.related_posts,
+        "responsive_images": args.responsive_images,
+        "precompress": args.precompress,
+    })
+    for directory in ("temp", "frontend"):
+        os.makedirs(os.path.join(work_directory, directory), exist_ok=True)
+    config_path = os.path.join(work_directory, "config.json")
+    with open(config_path, 'wb') as f:
+        f.write(json.dumps(config, indent=2).encode('utf-8'))
+    return config_path
+
+
+def run_scenario(name: str, config_path: str, items: int) -> dict:
+    from build import LablogBuilder
+    lg.warning(f"Running scenario {name}")
+    start = time.perf_counter()
+    lb = LablogBuilder(config_path)
+    graph = lb.create_build_graph("all")
+    try:
+        graph.run(list(graph.stages))
+    finally:
+        lb.close()
+    wall = time.perf_counter() - start
+    lb.report()
+    stages = {}
+    for stage, (count, total) in lb.tracer.stage_totals().items():
+        stages[stage] = {"count": count, "seconds": round(total, 4),
+                         "per_second": round(count / total, 2) if total > 0 else None}
+    return {"seconds": round(wall, 4), "items_per_second": round(items / wall, 2), "stages": stages}
+
+
+def run(args) -> dict:
+    work_directory = os.path.abspath(args.work_directory)
+    if os.path.exists(work_directory) and not args.keep:
+        shutil.rmtree(work_directory)
+    lg.warning(f"Generating corpus of {args.posts} posts and {args.pages} pages in {work_directory}")
+    posts_directory, _ = generate_corpus(
+        work_directory, args.posts, pages=args.pages, words=args.words,
+        images=args.images, image_size=args.image_size, seed=args.seed)
+    backend = FakeBackend(latency=args.latency / 1000)
+    backend.start()
+    try:
+        config_path = write_bench_config(work_directory, backend.port, args)
+        items = args.posts + args.pages
+        scenarios = {}
+        scenarios["cold"] = run_scenario("cold", config_path, items)
+        scenarios["noop"] = run_scenario("noop", config_path, items)
+        edited = os.path.join(posts_directory, f"post-{args.posts // 2:05d}", "post.md")
+        with open(edited, 'ab') as f:
+            f.write(b"\nEdited by benchmark.\n")
+        scenarios["edit"] = run_scenario("edit", config_path, items)
+        checks = run_api_checks(backend, config_path)
+    finally:
+        backend.stop()
+    return {
+        "corpus": {"posts": args.posts, "pages": args.pages, "words": args.words,
+                   "images": args.images, "image_size": args.image_size, "seed": args.seed},
+        "settings": {"workers": args.workers, "pandoc_backend": args.pandoc_backend,
+                     "latency_ms": args.latency, "search_index": args.search_index,
+                     "related_posts": args.related_posts, "responsive_images": args.responsive_images,
+                     "precompress": args.precompress},
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "backend_requests": backend.requests,
+        "scenarios": scenarios,
+        "checks": checks,
+    }
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Returns descriptions of timings that are slower than baseline by more than tolerance.
+    """
+    if baseline.get("corpus") != results["corpus"] or baseline.get("settings") != results["settings"]:
+        lg.warning("Baseline was recorded with a different corpus or settings, timings are not comparable.")
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(scenario)
+        if base is None:
+            continue
+        timings = [("total", current["seconds"], base["seconds"])]
+        for stage, timing in current["stages"].items():
+            if stage in base["stages"]:
+                timings.append((stage, timing["seconds"], base["stages"][stage]["seconds"]))
+        for stage, seconds, base_seconds in timings:
+            if seconds - base_seconds > MIN_COMPARED_SECONDS and seconds > base_seconds * (1 + tolerance):
+                regressions.append(f"{scenario}/{stage}: {seconds:.2f}s, baseline {base_seconds:.2f}s "
+                                   f"(+{(seconds / max(base_seconds, 1e-9) - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_report(results: dict) -> None:
+    for scenario, result in results["scenarios"].items():
+        print(f"\n{scenario}: {result['seconds']:.2f}s, {result['items_per_second']:.1f} items/s")
+        print(f"  {'stage':<16} {'spans':>6} {'seconds':>9} {'per second':>11}")
+        for stage, timing in result["stages"].items():
+            per_second = "" if timing["per_second"] is None else f"{timing['per_second']:.1f}"
+            print(f"  {stage:<16} {timing['count']:>6} {timing['seconds']:>9.2f} {per_second:>11}")
+    print(f"\nbackend requests: {json.dumps(results['backend_requests'])}")
+    for check, result in results["checks"].items():
+        details = ", ".join(f"{k}: {v}" for k, v in result.items() if k != "ok")
+        print(f"check {check}: {'ok' if result['ok'] else 'FAILED'} ({details})")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark lablog buildtools on a synthetic corpus.")
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--words", type=int, default=800, help="approximate words per post")
+    parser.add_argument("--images", type=int, default=2, help="images per post")
+    parser.add_argument("--image-size", type=int, default=1200, help="width of images in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--pandoc", default=shutil.which("pandoc") or "pandoc")
+    parser.add_argument("--pandoc-backend", default="subprocess", choices=["subprocess", "server", "ast"])
+    parser.add_argument("--latency", type=float, default=0, help="fake backend latency in ms")
+    parser.add_argument("--search-index", action="store_true")
+    parser.add_argument("--related-posts", action="store_true")
+    parser.add_argument("--responsive-images", action="store_true")
+    parser.add_argument("--precompress", action="store_true")
+    parser.add_argument("--work-directory", default=os.path.join(ROOT, "bench", "work"))
+    parser.add_argument("--keep", action="store_true", help="do not delete work directory first")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench", "results.json"))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, 0.2 is 20%%")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    from build import setup_logging
+    setup_logging(args.log_level)
+
+    results = run(args)
+    print_report(results)
+    with open(args.output, 'wb') as f:
+        f.write(json.dumps(results, indent=2).encode('utf-8'))
+    failed_checks = [check for check, result in results["checks"].items() if not result["ok"]]
+    for check in failed_checks:
+        lg.error(f"Check failed: {check}")
+    if failed_checks:
+        return 1
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        lg.warning(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        lg.warning(f"No baseline at {args.baseline}, run with --save-baseline to record one.")
+        return 0
+    with open(args.baseline, 'rb') as f:
+        baseline = json.loads(f.read().decode('utf-8'))
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        lg.error(f"Regression: {regression}")
+    if not regressions:
+        lg.warning("No regressions against baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
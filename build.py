@@ -1,38 +1,86 @@
 import subprocess
 import json
+import html
 import os
+import sys
 import shutil
+import argparse
+import threading
 from datetime import datetime
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 # This package
-from lablog_api import LablogAPI
 from data_model import PostMetadata, PageMetadata
-from config import load_config_from_file, BuildConfig
+from config import load_config_from_file, BuildConfig, BuildOptionsConfig, CONFIG_PATH
 from logging_formatter import BuildtoolsLogFormatter
+from tracing import Tracer
+from build_manifest import BuildManifest, compute_fingerprint, get_pandoc_version, stat_directory
+from build_graph import BuildGraph
+from pandoc_backend import create_pandoc_backend
+from static_sync import sync_directories
+from template_engine import CompiledTemplate, load_template, TEMPLATE_ENGINE_VERSION
+from posts_index import write_posts_index, reconcile_with_backend, write_if_changed
+from sitemap_xml import write_sitemap
+from atom_feed import write_atom_feed
+from search_index import SearchIndex
+from post_db import PostDatabase
+from asset_store import AssetStore
+from related_posts import RelatedPosts, post_terms
+from related_posts import is_available as related_posts_available
+from html_postprocess import HtmlPostProcessor
+from image_pipeline import ImagePipeline, annotate_images, DERIVATIVES_DIRECTORY
+from image_pipeline import is_available as image_pipeline_available
+# modules needing network or optional packages are imported where they are used,
+# so that local-only builds start fast and work offline
+if TYPE_CHECKING:
+    from lablog_api import LablogAPI
 
-# configure root logger to output all logs to stdout
-lg = logging.getLogger()
-lg.setLevel(logging.DEBUG)
-ch = logging.StreamHandler()
-ch.setLevel(logging.DEBUG)
-ch.setFormatter(BuildtoolsLogFormatter())
-lg.addHandler(ch)
 # configure logger for this module.
 lg = logging.getLogger(__name__)
 
+POST_FILTER_FILE = './post_filter.lua'
+PAGE_FILTER_FILE = './page_filter.lua'
+
+# placeholders available in post_template_file and their escaping, see template_engine.py
+POST_TEMPLATE_FIELDS = {
+    "BLOG_POST_TITLE": "html",
+    "BLOG_POST_AUTHOR": "html",
+    "AUTHOR_EMAIL": "html",
+    "BLOG_POST_DATE_MACHINE_READABLE": "html",
+    "BLOG_POST_DATE_STRING": "html",
+    "BLOG_POST_CONTENT": "raw",
+    "BLOG_POST_TAGS_STRING": "html",
+    "BLOG_POST_CATAGORY": "html",
+    "SHARE_POST_PRESET": "url",
+    "BLOG_POST_ID": "html",
+    "COMMENTS_LOCATION": "html",
+    "BLOG_POST_RELATED": "raw",
+}
+# placeholders available in page_template_file and their escaping
+PAGE_TEMPLATE_FIELDS = {
+    "BLOG_PAGE_TITLE": "html",
+    "BLOG_PAGE_CONTENT": "raw",
+}
+
 
 class LablogPostBuilder:
-    def __init__(self, post_path: str, config: BuildConfig) -> None:
+    def __init__(self, post_path: str, config: BuildConfig, post_meta: PostMetadata | None = None) -> None:
+        """
+        post_meta: metadata of the post if already known, otherwise it is loaded from meta.json
+        """
         self.pcfg = config.paths
         self.post_path = post_path
         self.temp_dir = self.pcfg.temporary_files_directory
         # load metadata
-        lg.info(f"Loading metadata for post at {post_path}")
-        file_in = f"{post_path}/meta.json"
-        with open(file_in, 'rb') as f:
-            post_meta = f.read().decode('utf-8')
-            post_meta = json.loads(post_meta)
-        self.post_meta = PostMetadata(**post_meta)
+        if post_meta is None:
+            lg.info(f"Loading metadata for post at {post_path}")
+            file_in = f"{post_path}/meta.json"
+            with open(file_in, 'rb') as f:
+                post_meta = f.read().decode('utf-8')
+                post_meta = json.loads(post_meta)
+            post_meta = PostMetadata(**post_meta)
+        self.post_meta = post_meta
         # Convert date data to HTML standards
         if self.post_meta.datetime is not None:
             post_time = datetime.strptime(
@@ -54,48 +102,91 @@ class LablogPostBuilder:
         self.perm_link = self.pcfg.posts_web_root_location + \
             self.post_meta.root + ".html"
         self.share_post_preset = self.perm_link
+        # every post has its own temporary file, so posts can be built in parallel
+        self.temp_file = f"{self.temp_dir}post_{self.post_meta.root}.html"
+        # HTML fragment converted from markdown, set by pandoc_convert_post_to_html or in a batch
+        self.post_content: str | None = None
+        # (title, link) of related posts, set by LablogBuilder.update_related_posts
+        self.related: list[tuple[str, str]] = []
 
-    def pandoc_convert_post_to_html(self):
-        file_in = f"{self.post_path}/post.md"
-        file_out: str = self.temp_dir + "post_content.html"
-        args = ['./bin/pandoc.exe', file_in,
-                '--lua-filter', './post_filter.lua',
-                '-M', f'image-base-path=/static/{self.post_meta.root}/',
-                '-M', f'link-base-path=/static/{self.post_meta.root}/',
-                '-o', file_out]
-        pandoc_result = subprocess.run(args, capture_output=True)
-        lg.info("PANDOC OUTPUT: ")
-        lg.info(pandoc_result.stdout.decode())
-        lg.info("END OF PANDOC OUTPUT")
-
-    def insert_html_into_template(self, post_template: str, output_directory: str):
-        # Read HTML containing content of the post
-        lg.info("Reading HTML fragment from temporary file")
-        file_in = self.temp_dir + "post_content.html"
-        with open(file_in, 'rb') as f:
-            post_content = f.read().decode('utf-8')
+    def compute_fingerprint(self, pandoc_version: str, output_settings: dict) -> str:
+        directories_in = [d for d in next(os.walk(self.post_path))[1]]
+        return compute_fingerprint(
+            files=[f"{self.post_path}/post.md", f"{self.post_path}/meta.json",
+                   self.pcfg.post_template_file, POST_FILTER_FILE],
+            root=self.post_path,
+            directories=directories_in,
+            extra={
+                "pandoc": pandoc_version,
+                "template_engine": TEMPLATE_ENGINE_VERSION,
+                "posts_web_root_location": self.pcfg.posts_web_root_location,
+                "comment_API_base_location": self.pcfg.comment_API_base_location,
+                "settings": output_settings,
+            })
+
+    def output_files(self, output_directory: str) -> list[str]:
+        outputs = [output_directory + self.post_meta.root + ".html"]
+        if len(next(os.walk(self.post_path))[1]) > 0:
+            outputs.append(
+                f"{self.pcfg.static_files_output_directory}{self.post_meta.root}/")
+        return outputs
+
+    def pandoc_job(self) -> dict:
+        # arguments of pandoc backend convert()
+        return dict(
+            file_in=f"{self.post_path}/post.md",
+            filter_file=POST_FILTER_FILE,
+            image_base_path=f'/static/{self.post_meta.root}/',
+            link_base_path=f'/static/{self.post_meta.root}/',
+            temp_file=self.temp_file)
 
-        # Fill the template using python's templating system
-        filled_result = post_template.format(
+    def pandoc_convert_post_to_html(self, backend):
+        self.post_content = backend.convert(**self.pandoc_job())
+
+    def process_images(self, pipeline: ImagePipeline, sizes: str):
+        # select all directories in post folder
+        directories_in = [d for d in next(os.walk(self.post_path))[1]]
+        directory_out = f"{self.pcfg.static_files_output_directory}{self.post_meta.root}/"
+        images = pipeline.process(
+            self.post_path, directories_in, directory_out, f"/static/{self.post_meta.root}/")
+        self.post_content = annotate_images(self.post_content, images, sizes)
+
+    def store_assets(self, store: AssetStore) -> dict[str, str]:
+        # static files are looked up in the post folder, and generated ones (image variants) in output
+        self.post_content, mapping = store.rewrite(
+            self.post_content, f"/static/{self.post_meta.root}/",
+            [self.post_path, f"{self.pcfg.static_files_output_directory}{self.post_meta.root}"])
+        return mapping
+
+    def insert_html_into_template(self, post_template: CompiledTemplate, output_directory: str):
+        # Fill the template compiled from post_template_file
+        values = dict(
             BLOG_POST_TITLE=self.post_meta.title,
             BLOG_POST_AUTHOR=self.post_meta.author,
             AUTHOR_EMAIL=self.post_meta.email,
             BLOG_POST_DATE_MACHINE_READABLE=self.post_date_machine_readable,
             BLOG_POST_DATE_STRING=self.post_date_str,
-            BLOG_POST_CONTENT=post_content,
+            BLOG_POST_CONTENT=self.post_content,
             BLOG_POST_TAGS_STRING=", ".join(self.post_meta.tags),
             BLOG_POST_CATAGORY=self.post_meta.catagory,
             SHARE_POST_PRESET=self.share_post_preset,
             BLOG_POST_ID=self.post_meta.post_id,
-            COMMENTS_LOCATION=self.pcfg.comment_API_base_location + self.post_meta.post_id
+            COMMENTS_LOCATION=self.pcfg.comment_API_base_location + self.post_meta.post_id,
+            BLOG_POST_RELATED=self.related_html(),
         )
 
         file_out = output_directory + self.post_meta.root + ".html"
         lg.info(f"Writing templated HTML source to {file_out}")
-        with open(file_out, 'wb') as f:
-            f.write(filled_result.encode('utf-8'))
+        post_template.render_to_file(values, file_out)
+
+    def related_html(self) -> str:
+        if not self.related:
+            return ""
+        items = "".join(f'<li><a href="{html.escape(link)}">{html.escape(title)}</a></li>'
+                        for title, link in self.related)
+        return f'<nav class="related-posts"><h2>Related posts</h2><ul>{items}</ul></nav>'
 
-    def register_post_at_backend(self, api: LablogAPI) -> str:
+    def registration_payload(self) -> dict:
         data = dict()
         data["title"] = self.post_meta.title
         data["abstract"] = self.post_meta.abstract
@@ -106,7 +197,28 @@ class LablogPostBuilder:
         data["tags"] = self.post_meta.tags
         if self.post_meta.post_id:
             data["post_id"] = self.post_meta.post_id
-        post_id = api.register_post(data=data)["post_id"]
+        return data
+
+    def feed_entry(self) -> dict:
+        return {
+            "title": self.post_meta.title,
+            "link": self.perm_link,
+            "summary": self.post_meta.abstract,
+            "author": self.post_meta.author,
+            "published": self.post_time.timestamp(),
+            "categories": [self.post_meta.catagory] + self.post_meta.tags,
+        }
+
+    def index_entry(self) -> dict:
+        """
+        Information about this post in buffered posts json, same as registered at backend.
+        """
+        entry = self.registration_payload()
+        entry["post_id"] = self.post_meta.post_id
+        return entry
+
+    def apply_registration_result(self, result: dict) -> str:
+        post_id = result["post_id"]
         if not self.post_meta.post_id:
             # Manually created post meta file does not contain its uid,
             # because this info is only available from backend.
@@ -117,15 +229,30 @@ class LablogPostBuilder:
                     indent=2).encode('utf-8'))
         return post_id
 
-    def copy_static_files(self):
+    def register_post_at_backend(self, api: "LablogAPI") -> str:
+        return self.apply_registration_result(
+            api.register_post(data=self.registration_payload()))
+
+    def copy_static_files(self, options: BuildOptionsConfig):
         # select all directories in post folder
         directories_in = [d for d in next(os.walk(self.post_path))[1]]
+        directory_out = f"{self.pcfg.static_files_output_directory}{self.post_meta.root}/"
         if len(directories_in) == 0:
             lg.info("No static files found, skipping.")
+            if options.static_files_sync and os.path.exists(directory_out):
+                lg.info(f"Deleting static files that are gone from {directory_out}")
+                shutil.rmtree(directory_out)
             return
         lg.info(f"Copying static files from: {directories_in}")
-        directory_out = f"{self.pcfg.static_files_output_directory}{self.post_meta.root}/"
         lg.info(f"COPY TO: {directory_out}")
+        if options.static_files_sync:
+            stats = sync_directories(
+                self.post_path, directories_in, directory_out,
+                compare=options.static_files_compare, link=options.static_files_link,
+                preserve=(DERIVATIVES_DIRECTORY,) if options.responsive_images else ())
+            lg.info(f"Static files synced, {stats.copied} copied, "
+                    f"{stats.unchanged} unchanged, {stats.deleted} deleted")
+            return
         if os.path.exists(directory_out):
             lg.warning(
                 f"Directory {directory_out} already exists, deleting it before copying.")
@@ -153,47 +280,89 @@ class LablogPageBuilder:
         # Create perm link to insert into sitemap
         self.perm_link = self.pcfg.pages_web_root_location + \
             self.page_meta.root + ".html"
+        self.temp_file = f"{self.temp_dir}page_{self.page_meta.root}.html"
+        # HTML fragment converted from markdown, set by pandoc_convert_page_to_html or in a batch
+        self.page_content: str | None = None
 
-    def pandoc_convert_page_to_html(self):
-        file_in = f"{self.page_path}/page.md"
-        file_out: str = self.temp_dir + "page_content.html"
-        args = ['./bin/pandoc.exe', file_in,
-                '--lua-filter', './page_filter.lua',
-                '-M', f'image-base-path=/static/{self.page_meta.root}/',
-                '-M', f'link-base-path=/static/{self.page_meta.root}/',
-                '-o', file_out]
-        pandoc_result = subprocess.run(args, capture_output=True)
-        lg.info("PANDOC OUTPUT: ")
-        lg.info(pandoc_result.stdout.decode())
-        lg.info("END OF PANDOC OUTPUT")
-
-    def insert_html_into_template(self, page_template: str, output_directory: str):
-        # Read HTML containing content of the page
-        lg.info("Reading HTML fragment from temporary file")
-        file_in = self.temp_dir + "page_content.html"
-        with open(file_in, 'rb') as f:
-            page_content = f.read().decode('utf-8')
+    def compute_fingerprint(self, pandoc_version: str, output_settings: dict) -> str:
+        directories_in = [d for d in next(os.walk(self.page_path))[1]]
+        return compute_fingerprint(
+            files=[f"{self.page_path}/page.md", f"{self.page_path}/meta.json",
+                   self.pcfg.page_template_file, PAGE_FILTER_FILE],
+            root=self.page_path,
+            directories=directories_in,
+            extra={
+                "pandoc": pandoc_version,
+                "template_engine": TEMPLATE_ENGINE_VERSION,
+                "pages_web_root_location": self.pcfg.pages_web_root_location,
+                "settings": output_settings,
+            })
+
+    def output_files(self, output_directory: str) -> list[str]:
+        outputs = [output_directory + self.page_meta.root + ".html"]
+        if len(next(os.walk(self.page_path))[1]) > 0:
+            outputs.append(
+                f"{self.pcfg.static_files_output_directory}{self.page_meta.root}/")
+        return outputs
+
+    def pandoc_job(self) -> dict:
+        # arguments of pandoc backend convert()
+        return dict(
+            file_in=f"{self.page_path}/page.md",
+            filter_file=PAGE_FILTER_FILE,
+            image_base_path=f'/static/{self.page_meta.root}/',
+            link_base_path=f'/static/{self.page_meta.root}/',
+            temp_file=self.temp_file)
+
+    def pandoc_convert_page_to_html(self, backend):
+        self.page_content = backend.convert(**self.pandoc_job())
+
+    def process_images(self, pipeline: ImagePipeline, sizes: str):
+        # select all directories in page folder
+        directories_in = [d for d in next(os.walk(self.page_path))[1]]
+        directory_out = f"{self.pcfg.static_files_output_directory}{self.page_meta.root}/"
+        images = pipeline.process(
+            self.page_path, directories_in, directory_out, f"/static/{self.page_meta.root}/")
+        self.page_content = annotate_images(self.page_content, images, sizes)
+
+    def store_assets(self, store: AssetStore) -> dict[str, str]:
+        # static files are looked up in the page folder, and generated ones (image variants) in output
+        self.page_content, mapping = store.rewrite(
+            self.page_content, f"/static/{self.page_meta.root}/",
+            [self.page_path, f"{self.pcfg.static_files_output_directory}{self.page_meta.root}"])
+        return mapping
 
-        # Fill the template using python's templating system
-        filled_result = page_template.format(
+    def insert_html_into_template(self, page_template: CompiledTemplate, output_directory: str):
+        # Fill the template compiled from page_template_file
+        values = dict(
             BLOG_PAGE_TITLE=self.page_meta.title,
-            BLOG_PAGE_CONTENT=page_content,
+            BLOG_PAGE_CONTENT=self.page_content,
         )
 
         file_out = output_directory + self.page_meta.root + ".html"
         lg.info(f"Writing templated HTML source to {file_out}")
-        with open(file_out, 'wb') as f:
-            f.write(filled_result.encode('utf-8'))
+        page_template.render_to_file(values, file_out)
 
-    def copy_static_files(self):
+    def copy_static_files(self, options: BuildOptionsConfig):
         # select all directories in page folder
         directories_in = [d for d in next(os.walk(self.page_path))[1]]
+        directory_out = f"{self.pcfg.static_files_output_directory}{self.page_meta.root}/"
         if len(directories_in) == 0:
             lg.info("No static files found, skipping.")
+            if options.static_files_sync and os.path.exists(directory_out):
+                lg.info(f"Deleting static files that are gone from {directory_out}")
+                shutil.rmtree(directory_out)
             return
         lg.info(f"Copying static files from: {directories_in}")
-        directory_out = f"{self.pcfg.static_files_output_directory}{self.page_meta.root}/"
         lg.info(f"COPY TO: {directory_out}")
+        if options.static_files_sync:
+            stats = sync_directories(
+                self.page_path, directories_in, directory_out,
+                compare=options.static_files_compare, link=options.static_files_link,
+                preserve=(DERIVATIVES_DIRECTORY,) if options.responsive_images else ())
+            lg.info(f"Static files synced, {stats.copied} copied, "
+                    f"{stats.unchanged} unchanged, {stats.deleted} deleted")
+            return
         if os.path.exists(directory_out):
             lg.warning(
                 f"Directory {directory_out} already exists, deleting it before copying.")
@@ -207,96 +376,720 @@ class LablogPageBuilder:
 
 
 class LablogBuilder:
-    def __init__(self) -> None:
-        self.sitemap_links = []
-        lg.info("Loading buildtools config from config.json")
-        self.config = load_config_from_file()
+    def __init__(self, config_path: str = CONFIG_PATH) -> None:
+        # builders of all posts, built or not, used to generate posts index and sitemap
+        self.post_builders: list[LablogPostBuilder] = []
+        # perm links of all pages by page path, used to generate sitemap
+        self.page_links: dict[str, str] = {}
+        self.tracer = Tracer()
+        lg.info(f"Loading buildtools config from {config_path}")
+        self.config = load_config_from_file(config_path)
         lg.info("Config loaded.")
         self.pcfg = self.config.paths
-        lg.info("Connecting to Lablog API")
-        self.api = LablogAPI()
-        lg.info("API Connected")
+        self.bcfg = self.config.build
+        self.tracer.enabled = self.bcfg.trace
+        self.manifest = BuildManifest(self.pcfg.build_manifest_file)
+        self.search_index = SearchIndex(
+            self.pcfg.search_index_cache_file) if self.bcfg.search_index else None
+        self.image_pipeline = None
+        if self.bcfg.responsive_images and not image_pipeline_available():
+            lg.error("Responsive images are enabled but Pillow is not installed, skipping them.")
+        elif self.bcfg.responsive_images:
+            self.image_pipeline = ImagePipeline(
+                self.pcfg.image_cache_directory, self.bcfg.responsive_image_widths,
+                quality=self.bcfg.responsive_image_quality, workers=self.bcfg.image_workers,
+                link=self.bcfg.static_files_link)
+        self.asset_store = AssetStore(
+            self.pcfg.asset_store_output_directory, self.bcfg.asset_store_url_base,
+            self.pcfg.asset_manifest_file, link=self.bcfg.static_files_link) if self.bcfg.asset_store else None
+        # settings that change the output of every post and page, part of their fingerprints
+        self.output_settings = {
+            "images": self.image_pipeline.settings() if self.image_pipeline is not None else None,
+            "assets": self.asset_store.settings() if self.asset_store is not None else None,
+        }
+        self.post_db = PostDatabase(self.pcfg.post_database_file) if self.bcfg.post_database else None
+        self.related_posts = None
+        if self.bcfg.related_posts and not related_posts_available():
+            lg.error("Related posts are enabled but numpy is not installed, skipping them.")
+        elif self.bcfg.related_posts:
+            self.related_posts = RelatedPosts(
+                self.pcfg.related_posts_cache_file, count=self.bcfg.related_posts_count,
+                max_terms=self.bcfg.related_posts_max_terms)
+        self.html_postprocessor = HtmlPostProcessor(
+            self.pcfg.html_postprocess_state_file, minify=self.bcfg.html_minify,
+            lazy_images=self.bcfg.html_lazy_images, eager_images=self.bcfg.html_eager_images,
+            preload=self.bcfg.html_preload,
+            workers=self.bcfg.html_postprocess_workers) if self.bcfg.html_postprocess else None
+        self.config_path = config_path
+        self._api = None
+        self._api_lock = threading.Lock()
+        # a fresh checkout has no output directories yet
+        for directory in (self.pcfg.temporary_files_directory, self.pcfg.posts_output_directory,
+                          self.pcfg.pages_output_directory):
+            os.makedirs(directory, exist_ok=True)
+        self.pandoc = create_pandoc_backend(
+            self.bcfg.pandoc_backend, self.bcfg.pandoc_executable,
+            server_url=self.bcfg.pandoc_server_url,
+            ast_cache_directory=self.pcfg.pandoc_ast_cache_directory, workers=self.bcfg.workers)
+
+    @property
+    def api(self) -> "LablogAPI":
+        """
+        Lablog API client, connected and authenticated when first used.
+        """
+        with self._api_lock:
+            if self._api is None:
+                from lablog_api import LablogAPI
+                lg.info("Connecting to Lablog API")
+                with self.tracer.span("api connect"):
+                    self._api = LablogAPI(self.config_path, config=self.config)
+                lg.info("API Connected")
+            return self._api
+
+    def is_up_to_date(self, manifest_key: str, fingerprint: str) -> bool:
+        if not self.bcfg.incremental or self.bcfg.force_rebuild:
+            return False
+        return self.manifest.is_up_to_date(manifest_key, fingerprint)
+
+    def run_items(self, build_item, items: list) -> list:
+        """
+        Calls build_item on every item, using a thread pool if more than one worker is configured.
+        Results are returned in the same order as items, regardless of completion order.
+        Threads are sufficient here since the heavy lifting is done by pandoc subprocesses.
+        """
+        if self.bcfg.workers <= 1:
+            return [build_item(item) for item in items]
+        # spans of items are nested in the span of their stage, not separate on builder threads
+        build_item = self.tracer.wrap(build_item)
+        with ThreadPoolExecutor(max_workers=self.bcfg.workers, thread_name_prefix="builder") as executor:
+            return list(executor.map(build_item, items))
+
+    def create_post_builder(self, post_path: str) -> LablogPostBuilder:
+        """
+        Creates the builder of a post, taking its metadata from post database if meta.json did not change.
+        """
+        with self.tracer.span("metadata", post_path):
+            if self.post_db is None:
+                return LablogPostBuilder(post_path=post_path, config=self.config)
+            post_meta = self.post_db.cached_metadata(post_path)
+            pb = LablogPostBuilder(post_path=post_path, config=self.config, post_meta=post_meta)
+            if post_meta is None:
+                self.post_db.update_metadata(post_path, pb.post_meta)
+            return pb
+
+    def post_output_settings(self, pb: LablogPostBuilder) -> dict:
+        # related posts are rendered into the post, it is built again when they change
+        if self.related_posts is None:
+            return self.output_settings
+        return dict(self.output_settings, related=pb.related)
+
+    def is_post_stale(self, pb: LablogPostBuilder, pandoc_version: str) -> bool:
+        """
+        Whether a loaded post needs to be built.
+        """
+        manifest_key = "post:" + pb.post_path
+        with self.tracer.span("fingerprint", pb.post_path):
+            fingerprint = pb.compute_fingerprint(pandoc_version, self.post_output_settings(pb))
+        if self.is_up_to_date(manifest_key, fingerprint):
+            if self.search_index is None or self.search_index.has_document(manifest_key, fingerprint):
+                lg.info(f"Post at {pb.post_path} is up to date, skipping.")
+                return False
+            lg.info(f"Post at {pb.post_path} is not in search index yet, building it again.")
+        return True
+
+    def update_related_posts(self, post_builders: list[LablogPostBuilder]) -> set[str]:
+        """
+        Updates related posts of all posts, returns paths of posts whose related posts changed.
+        """
+        if self.related_posts is None:
+            return set()
+
+        def stamp(pb: LablogPostBuilder) -> list[int]:
+            meta, markdown = os.stat(f"{pb.post_path}/meta.json"), os.stat(f"{pb.post_path}/post.md")
+            return [meta.st_mtime_ns, meta.st_size, markdown.st_mtime_ns, markdown.st_size]
+
+        def terms(pb: LablogPostBuilder) -> dict[str, int]:
+            with open(f"{pb.post_path}/post.md", 'rb') as f:
+                markdown = f.read().decode('utf-8')
+            return post_terms(pb.post_meta.title, pb.post_meta.abstract, pb.post_meta.tags,
+                              pb.post_meta.catagory, markdown)
+
+        with self.tracer.span("related posts"):
+            changed = self.related_posts.update(
+                {pb.post_path: (stamp(pb), lambda pb=pb: terms(pb)) for pb in post_builders})
+            self.related_posts.save()
+        builders = {pb.post_path: pb for pb in post_builders}
+        for pb in post_builders:
+            pb.related = [(builders[k].post_meta.title, builders[k].index_entry()["link"])
+                          for k in self.related_posts.related_keys(pb.post_path)]
+        lg.info(f"Related posts of {len(changed)} posts changed.")
+        return changed
+
+    def convert_batch(self, builders: list) -> None:
+        """
+        Converts markdown of all given post or page builders at once, if the pandoc backend
+        converts in batches. Otherwise every item is converted when it is built.
+        """
+        if not self.pandoc.batched or len(builders) == 0:
+            return
+        with self.tracer.span("pandoc batch"):
+            contents = self.pandoc.convert_many([pb.pandoc_job() for pb in builders])
+        for pb, content in zip(builders, contents):
+            if isinstance(pb, LablogPostBuilder):
+                pb.post_content = content
+            else:
+                pb.page_content = content
+
+    def register_posts(self, post_builders: list[LablogPostBuilder]) -> None:
+        """
+        Registers posts at remote server backend in one batch, so that connections are reused
+        and round trips overlap. post_id of every registered post is saved as soon as it is known,
+        failures are raised together after all posts were tried.
+        """
+        if self.post_db is not None:
+            pending = []
+            for pb in post_builders:
+                known_post_id = self.post_db.known_post_id(pb.post_path)
+                if not pb.post_meta.post_id and known_post_id:
+                    # meta.json was rewritten without post_id, restore it instead of registering a new post
+                    lg.info(f"Restoring post_id {known_post_id} of post at {pb.post_path}")
+                    pb.apply_registration_result({"post_id": known_post_id})
+                if self.post_db.needs_registration(pb.post_path, pb.registration_payload()):
+                    pending.append(pb)
+                else:
+                    lg.info(f"Post at {pb.post_path} is registered with the same information, skipping.")
+            post_builders = pending
+        if len(post_builders) == 0:
+            return
+        lg.info(f"Registering {len(post_builders)} posts at remote server backend...")
+        failed = []
+        try:
+            with self.tracer.span("register"):
+                results = self.api.register_posts(
+                    [pb.registration_payload() for pb in post_builders],
+                    max_concurrency=self.bcfg.api_concurrency)
+                for i, result in results:
+                    pb = post_builders[i]
+                    try:
+                        if isinstance(result, Exception):
+                            raise result
+                        pb.apply_registration_result(result)
+                    except Exception as e:
+                        lg.error(f"Cannot register post at {pb.post_path}: {e!r}")
+                        failed.append(pb.post_path)
+                        continue
+                    if self.post_db is not None:
+                        self.post_db.record_registration(
+                            pb.post_path, pb.post_meta.post_id, pb.registration_payload())
+        finally:
+            if self.post_db is not None:
+                self.post_db.commit()
+        if failed:
+            raise RuntimeError(f"Registering {len(failed)} of {len(post_builders)} posts failed: "
+                               + ", ".join(sorted(failed)))
+        lg.info("Registering OK")
+
+    def build_post(self, pb: LablogPostBuilder, pandoc_version: str) -> None:
+        """
+        Builds a single post, which must have been registered already.
+        """
+        lg.warning(f"Building post from {pb.post_path}")
+        if pb.post_content is None:
+            lg.info("Calling pandoc to convert post MD to HTML fragment")
+            with self.tracer.span("pandoc", pb.post_path):
+                pb.pandoc_convert_post_to_html(self.pandoc)
+        lg.info("Conversion done, copying static files to output")
+        with self.tracer.span("static copy", pb.post_path):
+            if self.asset_store is None:
+                pb.copy_static_files(self.bcfg)
+            else:
+                # static files are served from asset store, only generated files stay in static output
+                sync_directories(pb.post_path, [], f"{self.pcfg.static_files_output_directory}{pb.post_meta.root}/",
+                                 preserve=(DERIVATIVES_DIRECTORY,))
+        if self.image_pipeline is not None:
+            lg.info("Generating responsive image variants")
+            with self.tracer.span("images", pb.post_path):
+                pb.process_images(self.image_pipeline, self.bcfg.responsive_image_sizes)
+        if self.asset_store is not None:
+            lg.info("Moving static files to asset store")
+            with self.tracer.span("assets", pb.post_path):
+                self.asset_store.set_item("post:" + pb.post_path, pb.store_assets(self.asset_store))
+        lg.info("Constructing HTML source from template")
+        with self.tracer.span("template", pb.post_path):
+            pb.insert_html_into_template(
+                post_template=self.post_template,
+                output_directory=self.pcfg.posts_output_directory)
+        # meta.json may have been updated with post_id during registration,
+        # so fingerprint is calculated again after the build.
+        fingerprint = pb.compute_fingerprint(pandoc_version, self.post_output_settings(pb))
+        if self.search_index is not None:
+            lg.info("Adding post to search index")
+            entry = pb.index_entry()
+            with self.tracer.span("search terms", pb.post_path):
+                self.search_index.update_document(
+                    "post:" + pb.post_path, fingerprint, title=entry["title"], link=entry["link"],
+                    abstract=entry["abstract"], tags=entry["tags"], html=pb.post_content)
+        outputs = pb.output_files(self.pcfg.posts_output_directory)
+        # recorded in memory only, the manifest is saved once per stage
+        self.manifest.update("post:" + pb.post_path, fingerprint, outputs)
+        if self.post_db is not None:
+            self.post_db.record_build(pb.post_path, fingerprint, outputs)
 
     def build_posts(self):
         lg.warning("Start to build all posts...")
 
         # Load template
         lg.info(f"Loading template file from {self.pcfg.post_template_file}")
-        with open(self.pcfg.post_template_file, 'rb') as f:
-            self.post_template = f.read().decode('utf-8')
+        self.post_template = load_template(
+            self.pcfg.post_template_file, POST_TEMPLATE_FIELDS, required=("BLOG_POST_CONTENT",))
 
         lg.info(f"Scanning for posts from {self.pcfg.posts_input_directory}")
-        self.page_paths = [self.pcfg.posts_input_directory +
-                           d for d in next(os.walk(self.pcfg.posts_input_directory))[1]]
+        # sorted, so that sitemap is the same across builds
+        post_paths = sorted(self.pcfg.posts_input_directory +
+                            d for d in next(os.walk(self.pcfg.posts_input_directory))[1])
         lg.debug("Posts found: ")
-        for post_path in self.page_paths:
+        for post_path in post_paths:
             lg.debug(post_path)
 
-        for post_path in self.page_paths:
-            lg.warning(f"Building post from {post_path}")
-            pb = LablogPostBuilder(post_path=post_path, config=self.config)
-            lg.info("Calling pandoc to convert post MD to HTML fragment")
-            pb.pandoc_convert_post_to_html()
-            lg.info(
-                "Conversion done, registering the post at remote server backend...")
-            pb.register_post_at_backend(self.api)
-            lg.info("Registering OK, constructing HTML source from template")
-            pb.insert_html_into_template(
-                post_template=self.post_template,
-                output_directory=self.pcfg.posts_output_directory)
-            lg.info("HTML source built, copying static files to output")
-            pb.copy_static_files()
-            self.sitemap_links.append(pb.perm_link)
+        pandoc_version = get_pandoc_version(self.bcfg.pandoc_executable)
+        with self.tracer.span("load posts"):
+            post_builders = self.run_items(self.create_post_builder, post_paths)
+            # related posts are part of fingerprints
+            self.update_related_posts(post_builders)
+            stale = self.run_items(lambda pb: self.is_post_stale(pb, pandoc_version), post_builders)
+        # registration comes first, since post_id is needed by the template
+        stale_posts = [pb for pb, s in zip(post_builders, stale) if s]
+        self.register_posts(stale_posts)
+        self.convert_batch(stale_posts)
+        self.manifest.prune("post:", ["post:" + p for p in post_paths])
+        try:
+            with self.tracer.span("build posts"):
+                self.run_items(lambda pb: self.build_post(pb, pandoc_version), stale_posts)
+        finally:
+            # saved even if a post fails, so posts built so far are not built again
+            self.manifest.save()
+        self.post_builders = post_builders
+        self.postprocess_html(self.pcfg.posts_output_directory)
 
+        if self.search_index is not None:
+            self.search_index.prune(["post:" + p for p in post_paths])
+            self.search_index.save()
+        if self.post_db is not None:
+            self.post_db.prune(post_paths)
+        if self.asset_store is not None:
+            self.asset_store.prune("post:", ["post:" + p for p in post_paths])
+            self.asset_store.save()
         lg.warning("All posts built.")
 
+    def load_page(self, page_path: str, pandoc_version: str) -> tuple[LablogPageBuilder, bool]:
+        """
+        Loads metadata of a single page, returns its builder and whether it needs to be built.
+        """
+        with self.tracer.span("metadata", page_path):
+            pb = LablogPageBuilder(page_path=page_path, config=self.config)
+        manifest_key = "page:" + page_path
+        with self.tracer.span("fingerprint", page_path):
+            fingerprint = pb.compute_fingerprint(pandoc_version, self.output_settings)
+        if self.is_up_to_date(manifest_key, fingerprint):
+            lg.info(f"Page at {page_path} is up to date, skipping.")
+            return pb, False
+        return pb, True
+
+    def build_page(self, pb: LablogPageBuilder, pandoc_version: str) -> None:
+        """
+        Builds a single page.
+        """
+        manifest_key = "page:" + pb.page_path
+        lg.warning(f"Building page from {pb.page_path}")
+        if pb.page_content is None:
+            lg.info("Calling pandoc to convert page MD to HTML fragment")
+            with self.tracer.span("pandoc", pb.page_path):
+                pb.pandoc_convert_page_to_html(self.pandoc)
+        lg.info("Conversion done, copying static files to output")
+        with self.tracer.span("static copy", pb.page_path):
+            if self.asset_store is None:
+                pb.copy_static_files(self.bcfg)
+            else:
+                # static files are served from asset store, only generated files stay in static output
+                sync_directories(pb.page_path, [], f"{self.pcfg.static_files_output_directory}{pb.page_meta.root}/",
+                                 preserve=(DERIVATIVES_DIRECTORY,))
+        if self.image_pipeline is not None:
+            lg.info("Generating responsive image variants")
+            with self.tracer.span("images", pb.page_path):
+                pb.process_images(self.image_pipeline, self.bcfg.responsive_image_sizes)
+        if self.asset_store is not None:
+            lg.info("Moving static files to asset store")
+            with self.tracer.span("assets", pb.page_path):
+                self.asset_store.set_item("page:" + pb.page_path, pb.store_assets(self.asset_store))
+        lg.info("Constructing HTML source from template")
+        with self.tracer.span("template", pb.page_path):
+            pb.insert_html_into_template(
+                page_template=self.page_template,
+                output_directory=self.pcfg.pages_output_directory)
+        # recorded in memory only, the manifest is saved once per stage
+        self.manifest.update(
+            manifest_key, pb.compute_fingerprint(pandoc_version, self.output_settings),
+            pb.output_files(self.pcfg.pages_output_directory))
+
     def build_pages(self):
         lg.warning("Start to build all pages...")
 
         # Load template
         lg.info(f"Loading template file from {self.pcfg.page_template_file}")
-        with open(self.pcfg.page_template_file, 'rb') as f:
-            self.page_template = f.read().decode('utf-8')
+        self.page_template = load_template(
+            self.pcfg.page_template_file, PAGE_TEMPLATE_FIELDS, required=("BLOG_PAGE_CONTENT",))
 
         lg.info(f"Scanning for pages from {self.pcfg.pages_input_directory}")
-        self.page_paths = [self.pcfg.pages_input_directory +
-                           d for d in next(os.walk(self.pcfg.pages_input_directory))[1]]
-        lg.debug("Posts found: ")
-        for page_path in self.page_paths:
+        page_paths = sorted(self.pcfg.pages_input_directory +
+                            d for d in next(os.walk(self.pcfg.pages_input_directory))[1])
+        lg.debug("Pages found: ")
+        for page_path in page_paths:
             lg.debug(page_path)
 
-        for page_path in self.page_paths:
-            lg.warning(f"Building page from {page_path}")
-            pb = LablogPageBuilder(page_path=page_path, config=self.config)
-            lg.info("Calling pandoc to convert page MD to HTML fragment")
-            pb.pandoc_convert_page_to_html()
-            lg.info("Conversion done, constructing HTML source from template")
-            pb.insert_html_into_template(
-                page_template=self.page_template,
-                output_directory=self.pcfg.pages_output_directory)
-            lg.info("HTML source built, copying static files to output")
-            pb.copy_static_files()
-            self.sitemap_links.append(pb.perm_link)
+        pandoc_version = get_pandoc_version(self.bcfg.pandoc_executable)
+        loaded = self.run_items(
+            lambda page_path: self.load_page(page_path, pandoc_version), page_paths)
+        stale_pages = [pb for pb, stale in loaded if stale]
+        self.convert_batch(stale_pages)
+        self.manifest.prune("page:", ["page:" + p for p in page_paths])
+        try:
+            with self.tracer.span("build pages"):
+                self.run_items(lambda pb: self.build_page(pb, pandoc_version), stale_pages)
+        finally:
+            # saved even if a page fails, so pages built so far are not built again
+            self.manifest.save()
+        self.page_links = {pb.page_path: pb.perm_link for pb, _ in loaded}
+        self.postprocess_html(self.pcfg.pages_output_directory)
 
+        if self.asset_store is not None:
+            self.asset_store.prune("page:", ["page:" + p for p in page_paths])
+            self.asset_store.save()
         lg.warning("All pages built.")
 
-    def build_frontend(self):
+    def postprocess_html(self, output_directory: str):
+        """
+        Post-processes HTML files in output_directory written since the last post-processing.
+        """
+        if self.html_postprocessor is None:
+            return
+        with self.tracer.span("postprocess"):
+            self.html_postprocessor.process_directories([output_directory])
+
+    def load_items(self):
+        """
+        Loads metadata of all posts and pages without building them,
+        for generating frontend data from previous build results.
+        """
+        self.load_posts()
+        self.load_pages()
+
+    def load_posts(self):
+        post_paths = sorted(self.pcfg.posts_input_directory +
+                            d for d in next(os.walk(self.pcfg.posts_input_directory))[1])
+        self.post_builders = self.run_items(self.create_post_builder, post_paths)
+
+    def load_pages(self):
+        page_paths = sorted(self.pcfg.pages_input_directory +
+                            d for d in next(os.walk(self.pcfg.pages_input_directory))[1])
+        self.page_links = {page_path: LablogPageBuilder(page_path=page_path, config=self.config).perm_link
+                           for page_path in page_paths}
+
+    def rebuild_post(self, post_path: str) -> bool:
+        """
+        Builds, or forgets, a single post after its files changed, and posts whose related posts changed
+        with it. Returns whether output changed.
+        """
+        self.post_builders = [pb for pb in self.post_builders if pb.post_path != post_path]
+        gone = not os.path.exists(f"{post_path}/meta.json")
+        if gone:
+            lg.warning(f"Post at {post_path} is gone, removing it from indices.")
+            keys = ["post:" + pb.post_path for pb in self.post_builders]
+            self.manifest.prune("post:", keys)
+            self.manifest.save()
+            if self.search_index is not None:
+                self.search_index.prune(keys)
+                self.search_index.save()
+            if self.post_db is not None:
+                self.post_db.prune([pb.post_path for pb in self.post_builders])
+            if self.asset_store is not None:
+                self.asset_store.prune("post:", keys)
+                self.asset_store.save()
+        else:
+            self.post_builders.append(self.create_post_builder(post_path))
+            self.post_builders.sort(key=lambda b: b.post_path)
+        related_changed = self.update_related_posts(self.post_builders)
+        pandoc_version = get_pandoc_version(self.bcfg.pandoc_executable)
+        rebuilt = gone
+        for pb in self.post_builders:
+            if pb.post_path != post_path and pb.post_path not in related_changed:
+                continue
+            if self.is_post_stale(pb, pandoc_version):
+                self.register_posts([pb])
+                self.build_post(pb, pandoc_version)
+                rebuilt = True
+        if rebuilt:
+            self.manifest.save()
+        if rebuilt and self.search_index is not None:
+            self.search_index.save()
+        if self.post_db is not None:
+            self.post_db.commit()
+        if rebuilt and self.asset_store is not None:
+            self.asset_store.save()
+        return rebuilt
+
+    def rebuild_page(self, page_path: str) -> bool:
+        """
+        Builds, or forgets, a single page after its files changed. Returns whether output changed.
+        """
+        self.page_links.pop(page_path, None)
+        if not os.path.exists(f"{page_path}/meta.json"):
+            lg.warning(f"Page at {page_path} is gone, removing it from sitemap.")
+            self.manifest.prune("page:", ["page:" + p for p in self.page_links])
+            self.manifest.save()
+            if self.asset_store is not None:
+                self.asset_store.prune("page:", ["page:" + p for p in self.page_links])
+                self.asset_store.save()
+            return True
+        pandoc_version = get_pandoc_version(self.bcfg.pandoc_executable)
+        pb, stale = self.load_page(page_path, pandoc_version)
+        if stale:
+            self.build_page(pb, pandoc_version)
+            self.manifest.save()
+            if self.asset_store is not None:
+                self.asset_store.save()
+        self.page_links[page_path] = pb.perm_link
+        self.page_links = dict(sorted(self.page_links.items()))
+        return stale
+
+    def rebuild_changed(self, changed: set[str]) -> bool:
+        """
+        Rebuilds what is affected by changed paths: a single post or page for changes in its folder,
+        all posts or pages for changes of their template or filter. Returns whether output changed.
+        """
+        def item_path(input_directory: str, path: str):
+            # first path component below input_directory is the folder of the post or page
+            rel_path = os.path.relpath(path, input_directory)
+            if rel_path == "." or rel_path.startswith(".."):
+                return None
+            return input_directory + rel_path.split(os.sep)[0]
+
+        post_sources = {os.path.normpath(p) for p in (self.pcfg.post_template_file, POST_FILTER_FILE)}
+        page_sources = {os.path.normpath(p) for p in (self.pcfg.page_template_file, PAGE_FILTER_FILE)}
+        if changed & post_sources:
+            lg.warning("Post template or filter changed, rebuilding all posts.")
+            self.build_posts()
+            rebuilt = True
+        else:
+            post_paths = {item_path(self.pcfg.posts_input_directory, p) for p in changed} - {None}
+            rebuilt = any([self.rebuild_post(p) for p in sorted(post_paths)])
+        if changed & page_sources:
+            lg.warning("Page template or filter changed, rebuilding all pages.")
+            self.build_pages()
+            rebuilt = True
+        else:
+            page_paths = {item_path(self.pcfg.pages_input_directory, p) for p in changed} - {None}
+            rebuilt = any([self.rebuild_page(p) for p in sorted(page_paths)]) or rebuilt
+        if rebuilt:
+            self.postprocess_html(self.pcfg.posts_output_directory)
+            self.postprocess_html(self.pcfg.pages_output_directory)
+            self.write_frontend_data()
+        return rebuilt
+
+    def notify_preview(self):
+        if self.bcfg.preview_reload_url is None:
+            return
+        import requests
+        try:
+            requests.post(self.bcfg.preview_reload_url, timeout=2)
+        except requests.RequestException as e:
+            lg.warning(f"Cannot notify preview server at {self.bcfg.preview_reload_url}: {e}")
+
+    def watch(self):
+        """
+        Builds everything except frontend, then rebuilds what is affected by every change
+        until interrupted. Config, templates, API session and pandoc server stay loaded.
+        """
+        self.build_posts()
+        self.build_pages()
+        self.write_frontend_data()
+        from watcher import ChangeWatcher
+        watcher = ChangeWatcher([
+            self.pcfg.posts_input_directory, self.pcfg.pages_input_directory,
+            self.pcfg.post_template_file, self.pcfg.page_template_file,
+            POST_FILTER_FILE, PAGE_FILTER_FILE])
+        watcher.start()
+        lg.warning("Watching for changes, press Ctrl+C to stop.")
+        try:
+            while True:
+                changed = watcher.wait()
+                if not changed:
+                    continue
+                lg.debug(f"Changed: {', '.join(sorted(changed))}")
+                try:
+                    rebuilt = self.rebuild_changed(changed)
+                except Exception as e:
+                    # half written files are common while editing, keep watching
+                    lg.error(f"Rebuild failed: {e!r}")
+                    continue
+                if rebuilt:
+                    self.notify_preview()
+        except KeyboardInterrupt:
+            lg.warning("Stopped watching.")
+        finally:
+            watcher.stop()
+            self.close()
+
+    def close(self):
+        # stops pandoc server, if one was started
+        self.pandoc.close()
+        if self.post_db is not None:
+            self.post_db.commit()
+
+    def report(self):
+        """
+        Writes the build trace and logs a summary of where build time went.
+        """
+        if not self.bcfg.trace:
+            return
+        self.tracer.write_chrome_trace(self.pcfg.trace_output_file)
+        self.tracer.log_summary(self.bcfg.trace_summary_top)
+
+    def sitemap_urls(self):
+        """
+        Yields perm links of all posts and pages with their last modification time:
+        mtime of post HTML, which is only written when a post is rebuilt, so edits show up,
+        date of posts not built yet, mtime of page markdown.
+        """
+        for pb in self.post_builders:
+            try:
+                modified = os.path.getmtime(f"{self.pcfg.posts_output_directory}{pb.post_meta.root}.html")
+            except OSError:
+                modified = pb.post_time.timestamp()
+            yield pb.perm_link, modified
+        for page_path, perm_link in self.page_links.items():
+            try:
+                modified = os.path.getmtime(f"{page_path}/page.md")
+            except OSError:
+                modified = None
+            yield perm_link, modified
+
+    def write_frontend_data(self):
+        """
+        Writes files generated for the frontend from all posts and pages.
+        """
+        sitemap_links = [pb.perm_link for pb in self.post_builders] + list(self.page_links.values())
         lg.info(f"Writing sitemap.txt to {self.pcfg.sitemap_output_file}")
-        with open(self.pcfg.sitemap_output_file, 'wb') as f:
-            f.write('\n'.join(self.sitemap_links).encode('utf-8'))
+        with self.tracer.span("sitemap"):
+            # unchanged files keep their mtime, so npm build can be skipped
+            write_if_changed(self.pcfg.sitemap_output_file, '\n'.join(sitemap_links).encode('utf-8'))
+        if self.bcfg.sitemap_xml:
+            lg.info(f"Writing sitemap.xml to {self.pcfg.sitemap_xml_output_directory}")
+            with self.tracer.span("sitemap.xml"):
+                write_sitemap(self.sitemap_urls(), self.pcfg.sitemap_xml_output_directory,
+                              self.pcfg.site_web_root_location)
+        if self.bcfg.feed:
+            lg.info(f"Writing Atom feed to {self.pcfg.feed_output_file}")
+            with self.tracer.span("feed"):
+                write_atom_feed(
+                    (pb.feed_entry() for pb in self.post_builders), self.pcfg.feed_output_file,
+                    self.bcfg.feed_entries, title=self.bcfg.feed_title, site_url=self.pcfg.site_web_root_location,
+                    feed_url=self.pcfg.site_web_root_location + os.path.basename(self.pcfg.feed_output_file))
 
         lg.info(
             f"Writing buffered post information to {self.pcfg.buffered_posts_json_file}")
-        with open(self.pcfg.buffered_posts_json_file, 'wb') as f:
-            f.write(json.dumps(self.api.get_posts()).encode('utf-8'))
+        entries = [pb.index_entry() for pb in self.post_builders]
+        with self.tracer.span("posts.json"):
+            write_posts_index(
+                entries, self.pcfg.buffered_posts_json_file,
+                self.pcfg.posts_index_output_directory, self.bcfg.posts_index_page_size)
+        if self.bcfg.reconcile_posts_with_backend:
+            lg.info("Reconciling buffered post information with backend")
+            with self.tracer.span("reconcile"):
+                reconcile_with_backend(entries, self.api.get_posts())
+
+        if self.search_index is not None:
+            lg.info(f"Writing search index to {self.pcfg.search_index_output_directory}")
+            with self.tracer.span("search index"):
+                self.search_index.write(self.pcfg.search_index_output_directory)
+                # document numbers may have been assigned while writing
+                self.search_index.save()
+
+    def build_frontend(self):
+        self.write_frontend_data()
+        if not self.bcfg.run_npm_build:
+            lg.info("npm build is disabled, skipping it.")
+            return
+        self.npm_build()
 
+    def npm_build(self) -> bool:
         lg.info(
             f"Calling npm build in working dir {self.pcfg.npm_build_working_directory}")
-        npm_build_result = subprocess.run(
-            ['npm', 'run', 'build'], cwd=self.pcfg.npm_build_working_directory, shell=True)
-        print(npm_build_result)
+        with self.tracer.span("npm"):
+            npm_build_result = subprocess.run(
+                ['npm', 'run', 'build'], cwd=self.pcfg.npm_build_working_directory, shell=True)
+        lg.info(f"npm build finished with return code {npm_build_result.returncode}")
+        return npm_build_result.returncode == 0
+
+    def npm_build_fingerprint(self) -> str:
+        """
+        Fingerprint of npm build inputs: frontend sources and the generated HTML, posts.json,
+        indices and static files in npm_build_working_directory.
+        """
+        npm_directory = self.pcfg.npm_build_working_directory
+        return stat_directory(npm_directory, [
+            os.path.join(npm_directory, "node_modules"), os.path.join(npm_directory, ".git"),
+            # frontend_dist_files is a glob used by scp, e.g. "../frontend/dist/*"
+            self.pcfg.frontend_dist_files.rstrip("*")])
+
+    def precompress_frontend(self):
+        if not self.bcfg.precompress:
+            return
+        # frontend_dist_files is a glob used by scp, e.g. "../frontend/dist/*"
+        dist_directory = self.pcfg.frontend_dist_files.rstrip("*")
+        lg.warning(f"Precompressing frontend build results in {dist_directory}")
+        from precompress import precompress_directory
+        with self.tracer.span("precompress"):
+            precompress_directory(
+                dist_directory, self.pcfg.precompress_cache_directory,
+                use_brotli=self.bcfg.precompress_brotli, workers=self.bcfg.precompress_workers)
+
+    def create_build_graph(self, command: str) -> BuildGraph:
+        """
+        Returns the build stages needed by a build.py command, see main().
+        """
+        graph = BuildGraph(self.manifest, self.tracer,
+                           incremental=self.bcfg.incremental and not self.bcfg.force_rebuild)
+        if command in ("posts", "all"):
+            graph.add("posts", self.build_posts)
+        if command in ("pages", "all"):
+            graph.add("pages", self.build_pages)
+        if command == "frontend":
+            # frontend data from previous build results
+            graph.add("posts", self.load_posts)
+            graph.add("pages", self.load_pages)
+        if command in ("frontend", "all"):
+            graph.add("frontend data", self.write_frontend_data, after=["posts", "pages"])
+            last = "frontend data"
+            if self.bcfg.run_npm_build:
+                graph.add("npm build", self.npm_build, after=[last], fingerprint=self.npm_build_fingerprint,
+                          outputs=[self.pcfg.frontend_dist_files.rstrip("*")])
+                last = "npm build"
+            graph.add("precompress", self.precompress_frontend, after=[last])
+        if command in ("deploy", "all"):
+            graph.add("deploy", self.deploy, after=["precompress"] if command == "all" else [])
+        return graph
 
     def deploy(self):
+        with self.tracer.span("deploy"):
+            self._deploy()
+
+    def _deploy(self):
+        if self.bcfg.deploy_mode == "none":
+            lg.info("Deploy is disabled, skipping it.")
+            return
+        if self.bcfg.deploy_mode == "incremental":
+            self.deploy_incremental()
+            return
         lg.warning("Deploying build results to remote server")
         lg.warning("Copying files...")
         # Copy with scp
@@ -309,9 +1102,56 @@ class LablogBuilder:
                 '"chown -R www-data:www-data /var/www/html/"'],
             shell=True)
 
+    def deploy_incremental(self):
+        from incremental_deploy import IncrementalDeployer, create_deploy_target
+        lg.warning("Deploying changed build results to remote server")
+        deployer = IncrementalDeployer(
+            # frontend_dist_files is a glob used by scp, e.g. "../frontend/dist/*"
+            dist_directory=self.pcfg.frontend_dist_files.rstrip("*"),
+            target=create_deploy_target(self.pcfg.remote_html_directory),
+            manifest_path=self.pcfg.deploy_manifest_file,
+            keep_releases=self.bcfg.deploy_keep_releases,
+            owner=self.bcfg.deploy_owner)
+        deployer.deploy()
+
+
+def setup_logging(level: str) -> None:
+    # configure root logger to output all logs to stdout
+    root = logging.getLogger()
+    root.setLevel(level)
+    ch = logging.StreamHandler()
+    ch.setLevel(level)
+    ch.setFormatter(BuildtoolsLogFormatter())
+    root.addHandler(ch)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Build and deploy lablog.")
+    parser.add_argument(
+        "command", nargs="?", default="all",
+        choices=["posts", "pages", "frontend", "deploy", "all", "watch"],
+        help="posts and pages build HTML from markdown, "
+             "frontend writes sitemap, posts index and search index and runs npm build (and precompression), "
+             "deploy uploads frontend build results, "
+             "all does all of these, watch rebuilds posts and pages whenever they change")
+    parser.add_argument("--config", default=CONFIG_PATH, help="path to config.json")
+    parser.add_argument("--log-level", default="DEBUG",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+
+    lb = LablogBuilder(args.config)
+    if args.command == "watch":
+        lb.watch()
+        return 0
+    graph = lb.create_build_graph(args.command)
+    try:
+        results = graph.run(list(graph.stages))
+    finally:
+        lb.close()
+    lb.report()
+    return 1 if "failed" in results.values() else 0
+
 
-lb = LablogBuilder()
-lb.build_posts()
-lb.build_pages()
-lb.build_frontend()
-lb.deploy()
+if __name__ == "__main__":
+    sys.exit(main())
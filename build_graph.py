@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""build_graph.py:
+Runs build stages (posts, pages, frontend data, npm build, deploy, ...) as a dependency graph.
+
+Every stage declares the stages it runs after. A stage starts as soon as all of them finished,
+so independent stages, e.g. posts and pages, run at the same time.
+A stage may also declare how to fingerprint its inputs and which outputs it produces:
+it is then skipped when its fingerprint did not change since it last succeeded
+and its outputs still exist, the same way as posts and pages are skipped, see build_manifest.py.
+If a stage fails, stages depending on it are not run, other stages still are.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import logging
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+# this package
+from build_manifest import BuildManifest
+from tracing import Tracer
+
+lg = logging.getLogger(__name__)
+
+
+class Stage:
+    def __init__(self, name: str, run: Callable, after: list[str],
+                 fingerprint: Callable[[], str] | None, outputs: list[str]) -> None:
+        """
+        run: does the work of the stage, returning False means it failed without raising,
+             e.g. a subprocess exited with an error, so its fingerprint is not recorded
+        fingerprint: computes the fingerprint of stage inputs, called when all stages in after finished
+        """
+        self.name = name
+        self.run = run
+        self.after = after
+        self.fingerprint = fingerprint
+        self.outputs = outputs
+
+
+class BuildGraph:
+    def __init__(self, manifest: BuildManifest, tracer: Tracer, incremental: bool = True) -> None:
+        """
+        manifest: keeps stage fingerprints, under keys "stage:<name>"
+        incremental: skip stages whose fingerprint did not change
+        """
+        self.manifest = manifest
+        self.tracer = tracer
+        self.incremental = incremental
+        self.stages: dict[str, Stage] = {}
+
+    def add(self, name: str, run: Callable, after: list[str] | None = None,
+            fingerprint: Callable[[], str] | None = None, outputs: list[str] | None = None) -> None:
+        if name in self.stages:
+            raise ValueError(f"Build stage {name} is already defined")
+        self.stages[name] = Stage(name, run, list(after or []), fingerprint, list(outputs or []))
+
+    def _select(self, targets: list[str]) -> list[str]:
+        """
+        Returns targets and all stages they depend on, in an order where every stage comes after its
+        dependencies. Raises ValueError for unknown stages and dependency cycles.
+        """
+        order = []
+        state = {}
+
+        def visit(name: str, path: tuple[str, ...]):
+            if name not in self.stages:
+                raise ValueError(f"Unknown build stage {name}" + (f", required by {path[-1]}" if path else ""))
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Build stages depend on each other: {' -> '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dependency in self.stages[name].after:
+                visit(dependency, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for target in targets:
+            visit(target, ())
+        return order
+
+    def _run_stage(self, stage: Stage) -> str:
+        key = "stage:" + stage.name
+        fingerprint = None
+        if stage.fingerprint is not None:
+            with self.tracer.span("stage fingerprint", stage.name):
+                fingerprint = stage.fingerprint()
+            if self.incremental and self.manifest.is_up_to_date(key, fingerprint):
+                lg.warning(f"Inputs of stage {stage.name} did not change, skipping it.")
+                return "skipped"
+        lg.info(f"Running stage {stage.name}")
+        if stage.run() is False:
+            lg.error(f"Stage {stage.name} failed.")
+            return "failed"
+        if fingerprint is not None:
+            self.manifest.update(key, fingerprint, stage.outputs)
+            self.manifest.save()
+        return "done"
+
+    def run(self, targets: list[str]) -> dict[str, str]:
+        """
+        Runs targets and the stages they depend on. Returns the result of every stage:
+        "done", "skipped" (inputs unchanged), "failed", or "blocked" (a dependency failed).
+        Exceptions of stages are logged and the first one is raised again once no stage is running.
+        """
+        order = self._select(targets)
+        results: dict[str, str] = {}
+        errors = []
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(order)), thread_name_prefix="stage") as executor:
+            while len(results) < len(order):
+                for name in order:
+                    if name in results or name in running.values():
+                        continue
+                    after = [results.get(d) for d in self.stages[name].after]
+                    if any(r in ("failed", "blocked") for r in after):
+                        lg.error(f"Not running stage {name}, a stage it depends on failed.")
+                        results[name] = "blocked"
+                    elif all(r in ("done", "skipped") for r in after):
+                        running[executor.submit(self._run_stage, self.stages[name])] = name
+                if not running:
+                    # everything left is blocked
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        lg.exception(f"Stage {name} failed: {e}")
+                        results[name] = "failed"
+                        errors.append(e)
+        lg.info("Build stages: " + ", ".join(f"{name} {results[name]}" for name in order))
+        if errors:
+            raise errors[0]
+        return {name: results[name] for name in order}
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""build_manifest.py:
+This module fingerprints the inputs of every built item (post, page, etc.)
+and keeps the fingerprints in a persistent manifest between builds,
+so that items whose inputs did not change can be skipped.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import hashlib
+import logging
+import subprocess
+import threading
+from functools import lru_cache
+
+lg = logging.getLogger(__name__)
+
+# read files in chunks of this size when hashing
+HASH_CHUNK_SIZE = 1024 * 1024
+# bump this when the layout of the manifest file changes
+MANIFEST_VERSION = 1
+
+
+def hash_file(path: str) -> str:
+    """
+    Returns the hex sha256 digest of the content of the file at path.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def hash_directories(root: str, directories: list[str]) -> str:
+    """
+    Returns a digest covering relative paths and contents of all files
+    found (recursively) in the given subdirectories of root.
+    """
+    h = hashlib.sha256()
+    for directory in sorted(directories):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, directory)):
+            # os.walk order is filesystem dependent, make it stable
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+                h.update(rel_path.encode('utf-8') + b'\0')
+                h.update(hash_file(path).encode('ascii') + b'\0')
+    return h.hexdigest()
+
+
+def stat_directory(root: str, exclude: list[str]) -> str:
+    """
+    Returns a digest covering relative paths, sizes and mtimes of all files found (recursively)
+    in root, without reading them. Much cheaper than hash_directories for large trees,
+    but files rewritten with the same content change it, see posts_index.write_if_changed.
+    exclude: paths of files and directories not covered, e.g. node_modules
+    """
+    excluded = {os.path.normpath(p) for p in exclude}
+    h = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if os.path.normpath(os.path.join(dirpath, d)) not in excluded)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.normpath(path) in excluded:
+                continue
+            st = os.stat(path)
+            rel_path = os.path.relpath(path, root).replace(os.sep, '/')
+            h.update(f"{rel_path}\0{st.st_size}\0{st.st_mtime_ns}\0".encode('utf-8'))
+    return h.hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_pandoc_version(pandoc_executable: str) -> str:
+    """
+    Returns the first line of `pandoc --version`, or an empty string if
+    pandoc cannot be executed. The result is cached for the whole run.
+    """
+    try:
+        result = subprocess.run(
+            [pandoc_executable, '--version'], capture_output=True)
+    except OSError as e:
+        lg.error(f"Cannot execute pandoc at {pandoc_executable}: {e}")
+        return ""
+    return result.stdout.decode(errors='replace').split('\n', 1)[0].strip()
+
+
+def compute_fingerprint(files: list[str], root: str, directories: list[str], extra: dict) -> str:
+    """
+    Computes the fingerprint of a build item.
+    files: input files whose content affects the output (markdown, meta.json, template, filters)
+    root, directories: static subdirectories of the item that are copied to output
+    extra: any other settings affecting the output, must be JSON serializable
+    """
+    h = hashlib.sha256()
+    for path in files:
+        h.update(path.encode('utf-8') + b'\0')
+        h.update(hash_file(path).encode('ascii') + b'\0')
+    h.update(hash_directories(root, directories).encode('ascii') + b'\0')
+    h.update(json.dumps(extra, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+class BuildManifest:
+    """
+    Persistent mapping from build item keys to the fingerprint of their inputs
+    and the list of files they produced when they were last built.
+    """
+
+    def __init__(self, manifest_path: str) -> None:
+        self.manifest_path = manifest_path
+        self.entries: dict[str, dict] = {}
+        # items may be built in parallel, guards entries and the manifest file
+        self.lock = threading.Lock()
+        if not os.path.exists(manifest_path):
+            lg.info(f"No build manifest found at {manifest_path}, starting fresh.")
+            return
+        try:
+            with open(manifest_path, 'rb') as f:
+                content = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            lg.warning(f"Cannot read build manifest at {manifest_path}, ignoring it: {e}")
+            return
+        if content.get("version") != MANIFEST_VERSION:
+            lg.warning("Build manifest version mismatch, ignoring it.")
+            return
+        self.entries = content.get("entries", {})
+
+    def is_up_to_date(self, key: str, fingerprint: str) -> bool:
+        """
+        An item is up to date if its fingerprint did not change
+        and all outputs recorded for it still exist.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return False
+        return all(os.path.exists(p) for p in entry["outputs"])
+
+    def update(self, key: str, fingerprint: str, outputs: list[str]) -> None:
+        with self.lock:
+            self.entries[key] = {"fingerprint": fingerprint, "outputs": outputs}
+
+    def prune(self, prefix: str, keys: list[str]) -> None:
+        """
+        Forgets items whose key starts with prefix but are not in keys, e.g. deleted posts.
+        """
+        keep = set(keys)
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix) and k not in keep]:
+                del self.entries[key]
+
+    def save(self) -> None:
+        lg.info(f"Saving build manifest to {self.manifest_path}")
+        with self.lock:
+            content = {"version": MANIFEST_VERSION, "entries": self.entries}
+            temp_path = self.manifest_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(json.dumps(content, indent=2, sort_keys=True).encode('utf-8'))
+            os.replace(temp_path, self.manifest_path)
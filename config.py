@@ -12,8 +12,9 @@ __version__ = "20231115"
 # std libs
 import os
 import json
+from typing import Optional
 # third party libs
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # meta params and defaults
 CONFIG_PATH = os.path.join(os.path.dirname(__file__), './config.json')
@@ -65,10 +66,23 @@ class BuildPathConfig(BaseModel):
     static_files_output_directory: str
     # a sitemap.txt is generated, which contains links to all built posts.
     sitemap_output_file: str
+    # URL at which the root of the site is served, for links to sitemap files and the feed
+    site_web_root_location: str = "https://blog.zzi.io/"
+    # sitemap.xml and gzipped sitemap files are written here, it must be served at site_web_root_location
+    sitemap_xml_output_directory: str = "../frontend/public/"
+    # Atom feed of the latest posts, served at site_web_root_location
+    feed_output_file: str = "../frontend/public/feed.xml"
     # the typical situation is that user requests for all posts information,
     # for example when user accesses homepage.
     # thus this file can be buffered to reduce backend pressure. 
     buffered_posts_json_file: str
+    # posts json is also split into pages and per catagory/tag indices in this directory,
+    # so that the frontend only loads what it shows
+    posts_index_output_directory: str = "../frontend/public/index/"
+    # where to write the full-text search index loaded by the frontend
+    search_index_output_directory: str = "../frontend/public/search/"
+    # terms of every post are kept here between builds, so unchanged posts are not tokenized again
+    search_index_cache_file: str = "./cache/search_documents.json"
     # after generating html files, it still needs to be built with postcss, tailwind, etc.
     # this is the working directory where you typically run npm build
     npm_build_working_directory: str
@@ -78,11 +92,153 @@ class BuildPathConfig(BaseModel):
     remote_html_directory: str
     # link location embedded in the generated HTML file for creating and getting comments.
     comment_API_base_location: str
+    # fingerprints of built posts and pages are kept in this file between builds,
+    # do not put it in the temporary files directory.
+    build_manifest_file: str = "./build_manifest.json"
+    # hashes of files deployed to remote_html_directory, used by incremental deploy
+    deploy_manifest_file: str = "./deploy_manifest.json"
+    # resized variants of images are cached here by hash of the original image
+    image_cache_directory: str = "./cache/images/"
+    # static files are stored here under content hashed names when asset_store is enabled,
+    # it must be served at asset_store_url_base
+    asset_store_output_directory: str = "../frontend/public/assets/"
+    # which static files of every post and page were moved to asset store
+    asset_manifest_file: str = "./asset_manifest.json"
+    # pandoc JSON ASTs of markdown documents are cached here when pandoc_backend is "ast"
+    pandoc_ast_cache_directory: str = "./cache/ast/"
+    # responses of GET endpoints of the lablog API, see http_cache.py
+    http_cache_directory: str = "./cache/http/"
+    # TF-IDF vectors and related posts of all posts, see related_posts.py
+    related_posts_cache_file: str = "./cache/related_posts.json"
+    # SQLite database of post metadata and registration state, see post_db.py
+    post_database_file: str = "./cache/posts.sqlite3"
+    # build trace in Chrome trace format, see tracing.py
+    trace_output_file: str = "./build_trace.json"
+    # compressed versions of frontend files are cached here by hash of the original file
+    precompress_cache_directory: str = "./cache/precompressed/"
+    # mtime and size of HTML files post-processed by the last build, see html_postprocess.py
+    html_postprocess_state_file: str = "./cache/html_postprocess.json"
+
+
+class BuildOptionsConfig(BaseModel):
+    # skip posts and pages whose inputs did not change since last build
+    incremental: bool = True
+    # ignore the build manifest and rebuild everything, the manifest is still updated
+    force_rebuild: bool = False
+    # number of posts/pages built concurrently, 1 builds them one after another
+    workers: int = 1
+    # path to pandoc executable
+    pandoc_executable: str = "./bin/pandoc.exe"
+    # "subprocess" runs pandoc once per document with lua filters,
+    # "server" converts documents with a long-lived `pandoc server`, falling back to subprocess
+    # "ast" caches the JSON AST of every markdown document, rewrites paths in python
+    # and renders documents to HTML in batches, with pandoc server if available
+    pandoc_backend: str = "subprocess"
+    # URL of an already running pandoc server, e.g. "http://127.0.0.1:3030/",
+    # if not set, a server is started by the buildtools when pandoc_backend is "server" or "ast"
+    pandoc_server_url: Optional[str] = None
+    # keep post metadata and registration state in post_database_file,
+    # posts are then registered at backend only when their registered information changed
+    post_database: bool = True
+    # maximum number of requests sent to the lablog API at the same time
+    api_concurrency: int = 4
+    # total seconds a request to the lablog API may take
+    api_timeout: float = 30
+    # seconds a cached response of the lablog API is used without asking the backend
+    api_cache_ttl: float = 300
+    # seconds after going stale a cached response is still used if the backend fails
+    api_cache_stale_if_error: float = 604800
+    # copy only static files that changed and delete only those that are gone,
+    # instead of deleting and copying the whole static directory of every built post/page
+    static_files_sync: bool = True
+    # how changed static files are detected: "mtime" (size and mtime) or "hash" (size and content)
+    static_files_compare: str = "mtime"
+    # how static files are placed in output: "copy", "hardlink" or "reflink",
+    # links fall back to copying when source and output are on different filesystems
+    static_files_link: str = "copy"
+    # run `npm run build` in npm_build_working_directory after generating frontend data
+    run_npm_build: bool = True
+    # "scp" copies all of frontend_dist_files on every deploy,
+    # "incremental" uploads only changed files as a new release and switches to it atomically,
+    # remote_html_directory then becomes a symlink to the current release.
+    # remote_html_directory can be a local directory for testing.
+    # "none" skips deploy.
+    deploy_mode: str = "scp"
+    # number of releases kept on the remote server by incremental deploy
+    deploy_keep_releases: int = 3
+    # "user:group" owning deployed files, set with chown after extraction,
+    # which needs root on the target unless it is the deploying user. null keeps the deploying user.
+    deploy_owner: Optional[str] = "www-data:www-data"
+    # number of posts in each page of the posts index
+    posts_index_page_size: int = 20
+    # buffered posts json is generated from local post metadata,
+    # enable this to also fetch posts from backend and log any differences
+    reconcile_posts_with_backend: bool = False
+    # record build stage timings, write them to trace_output_file and log a summary
+    trace: bool = True
+    # number of slowest posts and pages listed in the summary
+    trace_summary_top: int = 10
+    # watch mode (build.py watch) posts to this URL after every rebuild, so a preview server can reload
+    preview_reload_url: Optional[str] = None
+    # write sitemap.xml with lastmod, sharded into gzipped sitemap files, see sitemap_xml.py
+    sitemap_xml: bool = True
+    # write an Atom feed of the latest posts
+    feed: bool = True
+    # number of posts in the feed
+    feed_entries: int = 20
+    # title of the feed
+    feed_title: str = "lablog"
+    # build a static full-text search index of posts for the frontend
+    search_index: bool = False
+    # render the most similar posts of every post into {BLOG_POST_RELATED} of post_template_file,
+    # requires numpy
+    related_posts: bool = False
+    # number of related posts of every post
+    related_posts_count: int = 5
+    # number of highest weighted terms of every post used for similarity
+    related_posts_max_terms: int = 64
+    # serve static files of posts and pages from a content-addressed asset store with
+    # hashed file names, instead of copying them to static_files_output_directory/<root>/
+    asset_store: bool = False
+    # URL of asset_store_output_directory
+    asset_store_url_base: str = "/assets/"
+    # generate resized WebP variants of images and add srcset/width/height to <img> tags,
+    # requires Pillow
+    responsive_images: bool = False
+    # widths of the generated variants, images are never upscaled
+    responsive_image_widths: list[int] = [480, 960, 1600]
+    # WebP quality of the generated variants
+    responsive_image_quality: int = 80
+    # sizes attribute of <img> tags, {width} is the width of the largest variant
+    responsive_image_sizes: str = "(max-width: {width}px) 100vw, {width}px"
+    # number of images processed at the same time, per post
+    image_workers: int = 4
+    # after npm build, write .gz (and .br) siblings of HTML, CSS, JS, JSON, etc. files
+    # for nginx gzip_static/brotli_static
+    precompress: bool = False
+    # also write .br files, requires the brotli package
+    precompress_brotli: bool = True
+    # number of files compressed at the same time
+    precompress_workers: int = 4
+    # post-process HTML files of posts and pages after they are written from templates:
+    # minify them, lazy load images and add preload hints
+    html_postprocess: bool = False
+    # remove comments and collapse whitespace, except in <pre>, <textarea>, <script> and <style>
+    html_minify: bool = True
+    # add loading="lazy" and decoding="async" to images after the first html_eager_images ones
+    html_lazy_images: bool = True
+    # number of images at the start of every document that are likely above the fold
+    html_eager_images: int = 1
+    # URLs of critical assets preloaded by every post and page, e.g. "/fonts/main.woff2"
+    html_preload: list[str] = []
+    # number of processes post-processing HTML files
+    html_postprocess_workers: int = 4
 
 
 class BuildConfig(BaseModel):
     api: APIConfig
     paths: BuildPathConfig
+    build: BuildOptionsConfig = Field(default_factory=BuildOptionsConfig)
 
 
 def load_config_from_file(config_path: str = CONFIG_PATH):
@@ -95,5 +251,3 @@ def dump_config_to_file(config: BuildConfig, config_path: str = CONFIG_PATH):
     with open(config_path, 'w+') as f:
         f.write(config.model_dump_json(indent=2))
 
-
-config = load_config_from_file()
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""html_postprocess.py:
+Post-processes HTML files written from templates, in place:
+    - minifies: comments are removed and runs of whitespace in text are collapsed,
+      except in <pre>, <textarea>, <script> and <style>
+    - adds loading="lazy" and decoding="async" to all but the first few <img> tags,
+      which are likely above the fold
+    - injects <link rel="preload"> hints for critical assets at the end of <head>
+
+Every file is processed in a single streaming pass: it is read in chunks, fed to an HTML tokenizer
+and written out token by token, so memory use does not depend on file size.
+Files are processed in a process pool, since tokenizing is CPU bound python code.
+Files not changed since they were last processed with the same settings are skipped.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import json
+import html
+import hashlib
+import logging
+import threading
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+
+lg = logging.getLogger(__name__)
+
+# bump this when output changes for the same input and settings
+HTML_POSTPROCESS_VERSION = 1
+READ_CHUNK_SIZE = 64 * 1024
+# whitespace is significant in these elements
+PRESERVE_WHITESPACE_TAGS = ("pre", "textarea", "script", "style")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+# preload destination by file extension
+PRELOAD_TYPES = {
+    ".css": "style", ".js": "script", ".mjs": "script",
+    ".woff": "font", ".woff2": "font", ".ttf": "font", ".otf": "font",
+    ".jpg": "image", ".jpeg": "image", ".png": "image", ".webp": "image", ".avif": "image", ".svg": "image",
+}
+
+
+def preload_tag(url: str) -> str:
+    extension = os.path.splitext(url.split("?", 1)[0].split("#", 1)[0])[1].lower()
+    destination = PRELOAD_TYPES.get(extension, "fetch")
+    # fonts and fetches are always requested in CORS mode, preloads must match
+    crossorigin = " crossorigin" if destination in ("font", "fetch") else ""
+    return f'<link rel="preload" href="{html.escape(url)}" as="{destination}"{crossorigin}>'
+
+
+class _StreamingProcessor(HTMLParser):
+    def __init__(self, write, settings: dict) -> None:
+        # character references are passed through untouched
+        super().__init__(convert_charrefs=False)
+        self.write = write
+        self.minify = settings["minify"]
+        self.lazy_images = settings["lazy_images"]
+        self.eager_images = settings["eager_images"]
+        self.preload = list(settings["preload"])
+        self.images = 0
+        self.preserve_depth = 0
+        self.in_head = False
+
+    def handle_starttag(self, tag, attrs):
+        text = self.get_starttag_text()
+        if tag == "head":
+            self.in_head = True
+        elif tag == "link" and self.in_head:
+            # hints already in the document, e.g. from processing it before
+            values = dict(attrs)
+            if values.get("rel") == "preload" and values.get("href") in self.preload:
+                self.preload.remove(values["href"])
+        elif tag == "img" and self.lazy_images:
+            self.images += 1
+            names = {name for name, _ in attrs}
+            if self.images > self.eager_images:
+                extra = ""
+                if "loading" not in names:
+                    extra += ' loading="lazy"'
+                if "decoding" not in names:
+                    extra += ' decoding="async"'
+                if extra:
+                    end = len(text) - 2 if text.endswith("/>") else len(text) - 1
+                    text = text[:end].rstrip() + extra + text[end:]
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth += 1
+        self.write(text)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in PRESERVE_WHITESPACE_TAGS:
+            self.preserve_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.in_head = False
+            for url in self.preload:
+                self.write(preload_tag(url))
+            self.preload = []
+        if tag in PRESERVE_WHITESPACE_TAGS and self.preserve_depth > 0:
+            self.preserve_depth -= 1
+        self.write(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.minify and self.preserve_depth == 0:
+            data = WHITESPACE_PATTERN.sub(lambda m: "\n" if "\n" in m.group(0) else " ", data)
+        self.write(data)
+
+    def handle_entityref(self, name):
+        self.write(f"&{name};")
+
+    def handle_charref(self, name):
+        self.write(f"&#{name};")
+
+    def handle_comment(self, data):
+        # conditional comments are kept, they are not really comments for old browsers
+        if not self.minify or data.startswith("[if") or data.startswith("<![endif"):
+            self.write(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.write(f"<!{decl}>")
+
+    def handle_pi(self, data):
+        self.write(f"<?{data}>")
+
+    def unknown_decl(self, data):
+        self.write(f"<![{data}]>")
+
+
+def process_file(path: str, settings: dict) -> tuple[int, int]:
+    """
+    Processes the HTML file at path in place, returns its sizes before and after.
+    """
+    temp_path = path + ".tmp"
+    size_in = os.path.getsize(path)
+    with open(path, 'r', encoding='utf-8', newline='') as f_in, \
+            open(temp_path, 'w', encoding='utf-8', newline='') as f_out:
+        parser = _StreamingProcessor(f_out.write, settings)
+        for chunk in iter(lambda: f_in.read(READ_CHUNK_SIZE), ''):
+            parser.feed(chunk)
+        parser.close()
+    os.replace(temp_path, path)
+    return size_in, os.path.getsize(path)
+
+
+class HtmlPostProcessor:
+    def __init__(self, state_file: str, minify: bool = True, lazy_images: bool = True,
+                 eager_images: int = 1, preload: list[str] | None = None, workers: int = 4) -> None:
+        """
+        state_file: remembers mtime and size of processed files, to skip them next time
+        eager_images: number of images at the start of a document that are not lazy loaded
+        preload: URLs of critical assets to preload from every document
+        """
+        self.state_file = state_file
+        self.settings = {"version": HTML_POSTPROCESS_VERSION, "minify": minify, "lazy_images": lazy_images,
+                         "eager_images": eager_images, "preload": list(preload or [])}
+        self.settings_digest = hashlib.sha256(json.dumps(self.settings, sort_keys=True).encode()).hexdigest()
+        self.workers = max(1, workers)
+        self.processed: dict[str, list[int]] = {}
+        # posts and pages may be post-processed at the same time, guards processed and the state file
+        self.lock = threading.Lock()
+        if not os.path.exists(state_file):
+            return
+        try:
+            with open(state_file, 'rb') as f:
+                content = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            lg.warning(f"Cannot read HTML post-processing state at {state_file}, ignoring it: {e}")
+            return
+        if content.get("settings") == self.settings_digest:
+            self.processed = content["files"]
+
+    def _is_processed(self, path: str) -> bool:
+        st = os.stat(path)
+        return self.processed.get(path) == [st.st_mtime_ns, st.st_size]
+
+    def process_directories(self, directories: list[str]) -> None:
+        paths = []
+        for directory in directories:
+            for dirpath, _, filenames in os.walk(directory):
+                paths += [os.path.join(dirpath, f) for f in filenames if f.endswith(".html")]
+        pending = [p for p in sorted(paths) if not self._is_processed(p)]
+        lg.info(f"Post-processing {len(pending)} HTML files, {len(paths) - len(pending)} unchanged")
+        if len(pending) == 0:
+            results = []
+        elif self.workers == 1 or len(pending) == 1:
+            results = [process_file(p, self.settings) for p in pending]
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(process_file, pending, [self.settings] * len(pending),
+                                            chunksize=16))
+        # forget files that are gone from the given directories, files elsewhere are kept
+        existing = set(paths)
+        prefixes = tuple(os.path.join(d, "") for d in directories)
+        with self.lock:
+            self.processed = {p: v for p, v in self.processed.items()
+                              if p in existing or not p.startswith(prefixes)}
+            for path in pending:
+                st = os.stat(path)
+                self.processed[path] = [st.st_mtime_ns, st.st_size]
+            content = json.dumps({"settings": self.settings_digest, "files": self.processed}).encode('utf-8')
+            os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+            temp_file = self.state_file + ".tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(content)
+            os.replace(temp_file, self.state_file)
+        if results:
+            size_in = sum(r[0] for r in results)
+            size_out = sum(r[1] for r in results)
+            lg.info(f"HTML post-processing done, {size_in} bytes -> {size_out} bytes")
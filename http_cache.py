@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+"""http_cache.py:
+A persistent cache of GET responses of the lablog API, so reads are fast, cheap and survive a flaky backend.
+
+    - responses younger than ttl seconds are used without any request
+    - older ones are revalidated with If-None-Match / If-Modified-Since,
+      a 304 Not Modified response renews them without downloading the body again
+    - if the backend cannot be reached or fails with a 5xx status, a cached response is used
+      up to stale_if_error seconds after it went stale, with a warning
+
+Every response is stored as two files in cache_directory, named by hash of the URL:
+<hash>.json with URL, validators and times, and <hash>.body with the response body.
+The cache itself does no networking: LablogAPI and AsyncLablogAPI send the requests
+(get() does it for a requests session), so both clients share the same cache.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+lg = logging.getLogger(__name__)
+
+# bump this when the layout of cache entries changes
+HTTP_CACHE_VERSION = 1
+
+
+class HttpCacheError(Exception):
+    pass
+
+
+class HttpCache:
+    def __init__(self, cache_directory: str, ttl: float = 300, stale_if_error: float = 604800) -> None:
+        """
+        ttl: seconds a response is used without revalidation
+        stale_if_error: seconds after going stale a response is still used when the backend fails
+        """
+        self.cache_directory = cache_directory
+        self.ttl = ttl
+        self.stale_if_error = stale_if_error
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def _entry(self, url: str) -> dict | None:
+        try:
+            with open(self._path(url) + ".json", 'rb') as f:
+                entry = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+        if entry.get("version") != HTTP_CACHE_VERSION or entry.get("url") != url:
+            return None
+        return entry
+
+    def _body(self, url: str) -> bytes | None:
+        try:
+            with open(self._path(url) + ".body", 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, path: str, data: bytes) -> None:
+        # responses of the same URL may be stored by several threads
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def _write_entry(self, url: str, entry: dict) -> None:
+        self._write(self._path(url) + ".json", json.dumps(entry).encode('utf-8'))
+
+    def fresh(self, url: str) -> bytes | None:
+        """
+        Returns the cached body of url if it is younger than ttl.
+        """
+        entry = self._entry(url)
+        if entry is None or time.time() - entry["validated_at"] > self.ttl:
+            return None
+        return self._body(url)
+
+    def request_headers(self, url: str) -> dict[str, str]:
+        """
+        Returns headers making a request for url conditional on the cached response.
+        """
+        entry = self._entry(url)
+        if entry is None or self._body(url) is None:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url: str, status: int, headers, body: bytes) -> bytes:
+        """
+        Handles a successful (200 or 304) response to a request for url, returns the current body.
+        headers: response headers, a case insensitive mapping
+        """
+        now = time.time()
+        if status == 304:
+            entry, cached = self._entry(url), self._body(url)
+            if entry is None or cached is None:
+                raise HttpCacheError(f"Got 304 Not Modified for {url}, but it is not cached")
+            entry["validated_at"] = now
+            self._write_entry(url, entry)
+            lg.debug(f"Cached response of {url} is still valid")
+            return cached
+        if "no-store" in headers.get("Cache-Control", ""):
+            return body
+        self._write(self._path(url) + ".body", body)
+        self._write_entry(url, {
+            "version": HTTP_CACHE_VERSION, "url": url, "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"), "stored_at": now, "validated_at": now})
+        return body
+
+    def fallback(self, url: str, error: Exception) -> bytes:
+        """
+        Returns the cached body of url after a failed request, if it is not too stale, otherwise raises error.
+        """
+        entry, cached = self._entry(url), self._body(url)
+        if entry is None or cached is None:
+            raise error
+        stale_for = time.time() - entry["validated_at"] - self.ttl
+        if stale_for > self.stale_if_error:
+            lg.error(f"Request for {url} failed and cached response is stale for {stale_for:.0f}s, "
+                     "too long to be used.")
+            raise error
+        lg.warning(f"Request for {url} failed, using cached response stale for {max(stale_for, 0):.0f}s: {error}")
+        return cached
+
+    def get(self, session, url: str, timeout: float, headers: dict | None = None) -> bytes:
+        """
+        Returns the body of url, from cache or requested with a requests session.
+        """
+        # only this helper needs requests, AsyncLablogAPI uses aiohttp
+        import requests
+        cached = self.fresh(url)
+        if cached is not None:
+            return cached
+        request_headers = dict(headers or {})
+        request_headers.update(self.request_headers(url))
+        try:
+            response = session.get(url, headers=request_headers, timeout=timeout)
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            return self.fallback(url, e)
+        if response.status_code not in (200, 304):
+            response.raise_for_status()
+            raise HttpCacheError(f"Unexpected status {response.status_code} for {url}")
+        return self.store(url, response.status_code, response.headers, response.content)
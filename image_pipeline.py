@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""image_pipeline.py:
+Generates resized WebP variants of images in static files of posts and pages,
+and annotates <img> tags of pandoc HTML fragments with srcset, sizes, width and height,
+so browsers download an image that fits the screen and reserve its space before it loads.
+
+Variants are written to the "_responsive" directory next to the original static files:
+    /static/<root>/figures/photo.jpg
+    /static/<root>/_responsive/figures/photo.480w.webp
+Every source image is processed once: variants are kept in a cache directory keyed by the
+hash of the source image and the settings, and only copied (or linked) to output afterwards.
+A cache directory is generated under a temporary name and renamed into place when complete,
+so it is never modified once it exists, and can be read by concurrent builds without locking.
+Requires the Pillow package.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import html
+import json
+import logging
+import shutil
+import posixpath
+import threading
+import importlib.util
+from urllib.parse import unquote
+from concurrent.futures import ThreadPoolExecutor
+# third-party libs
+# Pillow is imported where images are resized, so importing this module (and build.py) stays cheap
+# this package
+from build_manifest import hash_file
+from static_sync import is_unchanged, place_file
+
+lg = logging.getLogger(__name__)
+
+# bump this when variants generated for the same image and settings change
+IMAGE_PIPELINE_VERSION = 1
+# name of the directory holding variants, in static files output of every post and page
+DERIVATIVES_DIRECTORY = "_responsive"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+IMG_TAG_PATTERN = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+ATTRIBUTE_PATTERN = re.compile(r'\s([a-zA-Z-]+)="([^"]*)"')
+
+
+def is_available() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+
+class ImagePipeline:
+    def __init__(self, cache_directory: str, widths: list[int], quality: int = 80,
+                 workers: int = 4, link: str = "copy") -> None:
+        self.cache_directory = cache_directory
+        self.widths = sorted(set(widths))
+        self.quality = quality
+        self.workers = max(1, workers)
+        self.link = link
+        # posts sharing an image are built concurrently, each image is generated by one thread
+        self.locks: dict[str, threading.Lock] = {}
+        self.locks_lock = threading.Lock()
+
+    def settings(self) -> dict:
+        """
+        Settings affecting output, to be included in build fingerprints.
+        """
+        return {"version": IMAGE_PIPELINE_VERSION, "widths": self.widths, "quality": self.quality}
+
+    def _variant_widths(self, width: int) -> list[int]:
+        # never upscale, the largest variant is at most as wide as the original
+        widths = [w for w in self.widths if w < width]
+        widths.append(min(width, self.widths[-1]))
+        return sorted(set(widths))
+
+    def _cache_path(self, digest: str) -> str:
+        # variants of other widths are in other directories, never mixed up with these
+        widths = "-".join(str(w) for w in self.widths)
+        return os.path.join(self.cache_directory, f"{digest}-q{self.quality}-w{widths}")
+
+    def _lock(self, digest: str) -> threading.Lock:
+        with self.locks_lock:
+            return self.locks.setdefault(digest, threading.Lock())
+
+    def _generate(self, src: str, digest: str) -> dict:
+        """
+        Returns info of variants of src, generating them in cache if they are not there yet.
+        """
+        cache_path = self._cache_path(digest)
+        info_file = os.path.join(cache_path, "info.json")
+        with self._lock(digest):
+            if not os.path.exists(info_file):
+                temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.rmtree(temp_path, ignore_errors=True)
+                os.makedirs(temp_path)
+                try:
+                    self._generate_into(src, temp_path)
+                    os.rename(temp_path, cache_path)
+                except OSError:
+                    # generated by another build in the meantime, which is as good as ours
+                    if not os.path.exists(info_file):
+                        raise
+                finally:
+                    shutil.rmtree(temp_path, ignore_errors=True)
+        with open(info_file, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def _generate_into(self, src: str, cache_path: str) -> None:
+        """
+        Writes variants of src and their info.json, last, to cache_path.
+        """
+        from PIL import Image, ImageOps
+        with Image.open(src) as image:
+            # photos from cameras are often rotated by EXIF orientation only
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            width, height = image.size
+            variants = []
+            for w in self._variant_widths(width):
+                h = max(1, round(height * w / width))
+                file_name = f"{w}.webp"
+                resized = image if w == width else image.resize((w, h), Image.LANCZOS)
+                resized.save(os.path.join(cache_path, file_name), "WEBP", quality=self.quality, method=6)
+                variants.append({"width": w, "file": file_name})
+        info = {"widths": self.widths, "width": width, "height": height, "variants": variants}
+        with open(os.path.join(cache_path, "info.json"), 'wb') as f:
+            f.write(json.dumps(info).encode('utf-8'))
+
+    def _process_image(self, src_root: str, rel_path: str, dst_root: str, url_base: str) -> tuple[str, dict, list[str]]:
+        src = os.path.join(src_root, rel_path)
+        digest = hash_file(src)
+        info = self._generate(src, digest)
+        cache_path = self._cache_path(digest)
+        rel_stem = posixpath.splitext(rel_path.replace(os.sep, '/'))[0]
+        srcset = []
+        outputs = []
+        for variant in info["variants"]:
+            rel_out = f"{DERIVATIVES_DIRECTORY}/{rel_stem}.{variant['width']}w.webp"
+            dst = os.path.join(dst_root, rel_out)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            cached = os.path.join(cache_path, variant["file"])
+            if not is_unchanged(cached, dst, "mtime"):
+                place_file(cached, dst, self.link)
+            outputs.append(os.path.normpath(dst))
+            srcset.append(f"{url_base}{rel_out} {variant['width']}w")
+        url = url_base + rel_path.replace(os.sep, '/')
+        return url, {"width": info["width"], "height": info["height"], "srcset": srcset,
+                     "largest": info["variants"][-1]["width"]}, outputs
+
+    def process(self, src_root: str, directories: list[str], dst_root: str, url_base: str) -> dict[str, dict]:
+        """
+        Generates variants of all images in src_root/<directory> into dst_root/_responsive.
+        Variants of images that are gone are deleted.
+        Returns a mapping from URLs of original images (url_base + relative path) to their info.
+        """
+        rel_paths = []
+        for directory in directories:
+            for dirpath, _, filenames in os.walk(os.path.join(src_root, directory)):
+                for filename in filenames:
+                    if filename.lower().endswith(IMAGE_EXTENSIONS):
+                        rel_paths.append(os.path.relpath(os.path.join(dirpath, filename), src_root))
+        images = {}
+        expected = set()
+        if len(rel_paths) > 0:
+            lg.info(f"Processing {len(rel_paths)} images from {src_root}")
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image") as executor:
+                results = list(executor.map(
+                    lambda rel_path: self._process_image(src_root, rel_path, dst_root, url_base),
+                    sorted(rel_paths)))
+            for url, info, outputs in results:
+                images[url] = info
+                expected.update(outputs)
+        derivatives_root = os.path.join(dst_root, DERIVATIVES_DIRECTORY)
+        for dirpath, _, filenames in os.walk(derivatives_root, topdown=False):
+            for filename in filenames:
+                path = os.path.normpath(os.path.join(dirpath, filename))
+                if path not in expected:
+                    os.remove(path)
+            if len(os.listdir(dirpath)) == 0:
+                os.rmdir(dirpath)
+        return images
+
+
+def annotate_images(fragment: str, images: dict[str, dict], sizes: str) -> str:
+    """
+    Adds srcset, sizes, width and height to <img> tags whose src is a processed image.
+    Attributes already present in a tag are kept.
+    """
+    def annotate(match: re.Match) -> str:
+        tag = match.group(0)
+        attributes = {k.lower(): v for k, v in ATTRIBUTE_PATTERN.findall(tag)}
+        if "src" not in attributes:
+            return tag
+        info = images.get(posixpath.normpath(unquote(html.unescape(attributes["src"]))))
+        if info is None:
+            return tag
+        added = {
+            "srcset": ", ".join(info["srcset"]),
+            "sizes": sizes.format(width=info["largest"]),
+            "width": str(info["width"]),
+            "height": str(info["height"]),
+        }
+        extra = "".join(f' {k}="{html.escape(v)}"' for k, v in added.items() if k not in attributes)
+        if tag.endswith("/>"):
+            return tag[:-2].rstrip() + extra + " />"
+        return tag[:-1].rstrip() + extra + ">"
+
+    return IMG_TAG_PATTERN.sub(annotate, fragment)
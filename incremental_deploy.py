@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+"""incremental_deploy.py:
+Deploys the frontend build output by uploading only files that changed since the last deploy.
+
+The target keeps every deployed tree as a release next to the web root:
+    /var/www/html.releases/<release id>/
+and the web root itself is a symlink to the current release:
+    /var/www/html -> html.releases/<release id>
+A new release is a hardlinked copy of the current one, with stale files removed and
+an archive of added/changed files extracted into it. The symlink is then replaced in one
+rename, so visitors never see a half-deployed site.
+
+A manifest of deployed file hashes is kept locally, to work out what to upload next time.
+The target can be a local directory, which is handy for testing, or "user@host:/path"
+which is reached with ssh and scp.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import shlex
+import shutil
+import logging
+import tarfile
+import tempfile
+import subprocess
+from datetime import datetime
+# this package
+from build_manifest import hash_file
+
+lg = logging.getLogger(__name__)
+
+RELEASES_SUFFIX = ".releases"
+
+
+def scan_tree(root: str) -> dict[str, str]:
+    """
+    Returns a mapping from relative paths (with forward slashes) of all files under root to their hashes.
+    """
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, root).replace(os.sep, '/')] = hash_file(path)
+    return files
+
+
+def diff_trees(old: dict[str, str], new: dict[str, str]) -> tuple[list[str], list[str]]:
+    """
+    Returns (changed, removed), changed contains added and modified files.
+    """
+    changed = sorted(p for p, h in new.items() if old.get(p) != h)
+    removed = sorted(p for p in old if p not in new)
+    return changed, removed
+
+
+def create_archive(root: str, files: list[str], archive_path: str) -> None:
+    """
+    Packs files (relative to root) into a gzipped tarball.
+    Ownership is not taken from the archive, tar only restores it when running as root,
+    targets chown extracted files instead.
+    """
+    with tarfile.open(archive_path, "w:gz") as tar:
+        for rel_path in files:
+            tar.add(os.path.join(root, rel_path), arcname=rel_path)
+
+
+class LocalDeployTarget:
+    def __init__(self, target_path: str) -> None:
+        self.target_path = target_path.rstrip("/\\")
+        self.releases_path = self.target_path + RELEASES_SUFFIX
+
+    def current_release(self) -> str | None:
+        if not os.path.islink(self.target_path):
+            return None
+        return os.path.basename(os.readlink(self.target_path).rstrip("/\\"))
+
+    def deploy(self, release_id: str, base_release: str | None, archive_path: str,
+               removed: list[str], replaced: list[str], keep_releases: int, owner: str | None = None) -> None:
+        """
+        owner: "user:group" given to the release and extracted files, None keeps the deploying user
+        """
+        os.makedirs(self.releases_path, exist_ok=True)
+        release_path = os.path.join(self.releases_path, release_id)
+        if base_release is not None:
+            # hardlinked copy, costs no file data
+            shutil.copytree(os.path.join(self.releases_path, base_release), release_path,
+                            symlinks=True, copy_function=os.link)
+        else:
+            os.makedirs(release_path)
+        # replaced files are unlinked before extraction, so the base release is left intact
+        for rel_path in removed + replaced:
+            path = os.path.join(release_path, rel_path)
+            if os.path.lexists(path):
+                os.remove(path)
+        with tarfile.open(archive_path, "r:gz") as tar:
+            if hasattr(tarfile, "data_filter"):
+                tar.extractall(release_path, filter="data")
+            else:
+                tar.extractall(release_path)
+            extracted = set(tar.getnames())
+        if owner:
+            # files taken from the base release were given to owner when it was deployed
+            user, _, group = owner.partition(":")
+            for name in list(extracted):
+                while "/" in name:
+                    name = name.rsplit("/", 1)[0]
+                    extracted.add(name)
+            for rel_path in [release_path] + [os.path.join(release_path, name) for name in sorted(extracted)]:
+                shutil.chown(rel_path, user, group or None)
+        self._remove_empty_directories(release_path)
+        if os.path.exists(self.target_path) and not os.path.islink(self.target_path):
+            backup = self.target_path + ".pre-deploy"
+            lg.warning(f"{self.target_path} is a directory, moving it to {backup} "
+                       "so that it can be replaced by a symlink.")
+            os.rename(self.target_path, backup)
+        temp_link = self.target_path + ".new"
+        if os.path.lexists(temp_link):
+            os.remove(temp_link)
+        os.symlink(os.path.join(os.path.basename(self.releases_path), release_id),
+                   temp_link, target_is_directory=True)
+        os.replace(temp_link, self.target_path)
+        self._prune_releases(keep_releases, release_id)
+
+    def _remove_empty_directories(self, root: str) -> None:
+        for dirpath, _, _ in os.walk(root, topdown=False):
+            if dirpath != root and len(os.listdir(dirpath)) == 0:
+                os.rmdir(dirpath)
+
+    def _prune_releases(self, keep_releases: int, current: str) -> None:
+        releases = sorted(os.listdir(self.releases_path))
+        for release in releases[:max(0, len(releases) - keep_releases)]:
+            if release != current:
+                lg.info(f"Removing old release {release}")
+                shutil.rmtree(os.path.join(self.releases_path, release))
+
+
+class SshDeployTarget:
+    def __init__(self, host: str, target_path: str) -> None:
+        self.host = host
+        self.target_path = target_path.rstrip("/")
+        self.releases_path = self.target_path + RELEASES_SUFFIX
+
+    def _run_script(self, script: str) -> subprocess.CompletedProcess:
+        """
+        Runs a shell script on the remote host, raises if ssh or the script fails.
+        """
+        result = subprocess.run(['ssh', self.host, 'sh', '-s'],
+                                input=script.encode('utf-8'), capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Remote script failed on {self.host} with exit code {result.returncode}: "
+                               f"{result.stderr.decode(errors='replace').strip()}")
+        return result
+
+    def current_release(self) -> str | None:
+        # not a symlink yet is no error, an unreachable host is
+        result = self._run_script(f"readlink {shlex.quote(self.target_path)} || true\n")
+        link = result.stdout.decode().strip()
+        if link == "":
+            return None
+        return os.path.basename(link.rstrip("/"))
+
+    def deploy(self, release_id: str, base_release: str | None, archive_path: str,
+               removed: list[str], replaced: list[str], keep_releases: int, owner: str | None = None) -> None:
+        """
+        owner: "user:group" given to the release with chown, which needs the ssh user to be root
+        unless owner is the ssh user. If it fails, the deploy fails before the release is switched to.
+        None keeps the ssh user.
+        """
+        q = shlex.quote
+        remote_archive = f"{self.releases_path}/{release_id}.tar.gz"
+        self._run_script(f"mkdir -p {q(self.releases_path)}\n")
+        lg.info(f"Uploading {archive_path} to {self.host}:{remote_archive}")
+        result = subprocess.run(['scp', archive_path, f"{self.host}:{remote_archive}"])
+        if result.returncode != 0:
+            raise RuntimeError(f"scp failed with exit code {result.returncode}")
+        release_path = f"{self.releases_path}/{release_id}"
+        lines = ["set -e", f"cd {q(self.releases_path)}"]
+        if base_release is not None:
+            lines.append(f"cp -al {q(base_release)} {q(release_id)}")
+        else:
+            lines.append(f"mkdir {q(release_id)}")
+        lines.append(f"cd {q(release_path)}")
+        # replaced files are unlinked before extraction, so the base release is left intact
+        for rel_path in removed + replaced:
+            lines.append(f"rm -f -- {q(rel_path)}")
+        lines += [
+            f"tar -xzf {q(remote_archive)}",
+            f"rm -f {q(remote_archive)}",
+            "find . -mindepth 1 -type d -empty -delete",
+        ]
+        if owner:
+            # files hardlinked from the base release share their inodes, chown does not copy them
+            lines.append(f"chown -R {q(owner)} .")
+        lines += [
+            f"cd {q(self.releases_path)}",
+            f"if [ -d {q(self.target_path)} ] && [ ! -L {q(self.target_path)} ]; then "
+            f"mv {q(self.target_path)} {q(self.target_path + '.pre-deploy')}; fi",
+            f"ln -sfn {q(os.path.basename(self.releases_path) + '/' + release_id)} "
+            f"{q(self.target_path + '.new')}",
+            f"mv -T {q(self.target_path + '.new')} {q(self.target_path)}",
+            f"ls -1 | grep -v '\\.tar\\.gz$' | sort | head -n -{keep_releases} "
+            f"| grep -vx {q(release_id)} | xargs -r rm -rf --",
+        ]
+        self._run_script("\n".join(lines) + "\n")
+
+
+def create_deploy_target(location: str):
+    """
+    location: "user@host:/path" for a remote target, anything else is a local directory.
+    """
+    host, sep, path = location.partition(":")
+    # "C:/..." is a local windows path, not a host
+    if sep and len(host) > 1 and "/" not in host and "\\" not in host:
+        return SshDeployTarget(host, path)
+    return LocalDeployTarget(location)
+
+
+class IncrementalDeployer:
+    def __init__(self, dist_directory: str, target, manifest_path: str,
+                 keep_releases: int = 3, owner: str | None = None) -> None:
+        self.dist_directory = dist_directory
+        self.target = target
+        self.manifest_path = manifest_path
+        self.keep_releases = max(1, keep_releases)
+        self.owner = owner
+
+    def load_manifest(self) -> dict:
+        if not os.path.exists(self.manifest_path):
+            return {"release": None, "files": {}}
+        with open(self.manifest_path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+
+    def save_manifest(self, manifest: dict) -> None:
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        os.replace(temp_path, self.manifest_path)
+
+    def deploy(self) -> None:
+        manifest = self.load_manifest()
+        files = scan_tree(self.dist_directory)
+        base_release = self.target.current_release()
+        if base_release is None or base_release != manifest["release"]:
+            # target was changed by someone else, or never deployed to, upload everything
+            lg.warning("Deployed release does not match local deploy manifest, deploying all files.")
+            base_files = {}
+        else:
+            base_files = manifest["files"]
+        changed, removed = diff_trees(base_files, files)
+        if len(changed) == 0 and len(removed) == 0:
+            lg.warning("Deployed files are up to date, nothing to deploy.")
+            return
+        lg.warning(f"Deploying {len(changed)} added/changed files, removing {len(removed)} files.")
+        replaced = [p for p in changed if p in base_files]
+        # sortable by time, so that old releases can be pruned by name
+        release_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path = os.path.join(temp_dir, f"{release_id}.tar.gz")
+            create_archive(self.dist_directory, changed, archive_path)
+            self.target.deploy(release_id, base_release if base_files else None,
+                               archive_path, removed, replaced, self.keep_releases, owner=self.owner)
+        self.save_manifest({"release": release_id, "files": files})
+        lg.warning(f"Release {release_id} deployed.")
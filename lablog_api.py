@@ -12,36 +12,48 @@ __version__ = "20240528"
 import logging
 import json
 import datetime
+import threading
+from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # third-party libs
 import requests
+from requests.adapters import HTTPAdapter
 import jwt
 # this package
-from config import load_config_from_file, dump_config_to_file
+from config import load_config_from_file, dump_config_to_file, CONFIG_PATH, BuildConfig
+from http_cache import HttpCache
 
 lg = logging.getLogger(__name__)
 
+# size of the connection pool shared by the API sessions
+CONNECTION_POOL_SIZE = 16
 
-class LablogAPI():
-    def __init__(self, config_path: str | None = None) -> None:
-        lg.info("Reading config file.")
-        if config_path is None:
-            self.config = load_config_from_file()
-        else:
-            self.config = load_config_from_file(config_path=config_path)
+
+class LablogAPIBase():
+    """
+    Config, endpoint and JWT handling shared by the blocking and the asyncio API clients.
+    Subclasses do the actual network requests.
+    """
+
+    def __init__(self, config_path: str | None = None, config: BuildConfig | None = None) -> None:
+        """
+        config: already loaded config, if not given it is read from config_path.
+        Tokens obtained by authentication are written back to config_path either way.
+        """
+        self.config_path = CONFIG_PATH if config_path is None else config_path
+        if config is None:
+            lg.info("Reading config file.")
+            config = load_config_from_file(config_path=self.config_path)
+        self.config = config
         # load connection info
         cfg = self.config.api.restful
         self.restful_endpoint = "{protocol}{host}:{port}{endpoint}".format(
             protocol=cfg.protocol, host=cfg.host, port=cfg.port, endpoint=cfg.endpoint)
         self.auth_header = self.config.api.authentication.token_type + \
             " " + self.config.api.authentication.access_token
-        # authentication
-        lg.info("Checking authentication status")
-        self.pending_reauthentication = self.check_reauthentication_required()
-        lg.info("Reauthentication needed: {}".format(
-            self.pending_reauthentication))
-        if self.pending_reauthentication:
-            lg.info("Authenticating client...")
-            self.handle_reauthenticate()
+        # responses of GET endpoints, revalidated with the backend when stale
+        self.cache = HttpCache(self.config.paths.http_cache_directory, ttl=self.config.build.api_cache_ttl,
+                               stale_if_error=self.config.build.api_cache_stale_if_error)
 
     def check_reauthentication_required(self) -> bool:
         """
@@ -80,6 +92,66 @@ class LablogAPI():
             return True
         return False
 
+    def authentication_request(self) -> tuple[dict, dict]:
+        """
+        Returns headers and form data of the token request, built from credentials provided in config.
+        """
+        headers = {
+            "accept": "application/json",
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        data = {
+            "username": self.config.api.authentication.username,
+            "password": self.config.api.authentication.password
+        }
+        return headers, data
+
+    def apply_authentication_result(self, result: dict) -> None:
+        """
+        Stores the token returned by the token request, both in memory and in config file.
+        """
+        assert "access_token" in result
+        lg.info("Successfully logged in, token type: {}".format(
+            result["token_type"]))
+        self.config.api.authentication.access_token = result["access_token"]
+        self.config.api.authentication.token_type = result["token_type"]
+        self.auth_header = result["token_type"] + " " + result["access_token"]
+        dump_config_to_file(self.config, config_path=self.config_path)
+
+    def register_post_headers(self) -> dict:
+        return {
+            "accept": "application/json",
+            "Authorization": self.auth_header
+        }
+
+
+class LablogAPI(LablogAPIBase):
+    def __init__(self, config_path: str | None = None, config: BuildConfig | None = None) -> None:
+        super().__init__(config_path=config_path, config=config)
+        # total seconds a request may take, requests without timeout can stall a build forever
+        self.timeout = self.config.build.api_timeout
+        # all requests go through one connection pool, so connections (and TLS sessions) are kept alive
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=CONNECTION_POOL_SIZE)
+        # requests.Session is not guaranteed to be thread safe, use one per thread,
+        # the connection pool of the adapter is
+        self.local = threading.local()
+        # authentication
+        lg.info("Checking authentication status")
+        self.pending_reauthentication = self.check_reauthentication_required()
+        lg.info("Reauthentication needed: {}".format(
+            self.pending_reauthentication))
+        if self.pending_reauthentication:
+            lg.info("Authenticating client...")
+            self.handle_reauthenticate()
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            self.local.session = session
+        return self.local.session
+
     def handle_reauthenticate(self) -> None:
         """
         Tries to authenticate this client, callback for the .authenticate method.
@@ -102,37 +174,51 @@ class LablogAPI():
         Tries to authenticate this client using credentials provided in config.
         """
         lg.info("Authenticating client.")
-        headers = {
-            "accept": "application/json",
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        data = {
-            "username": self.config.api.authentication.username,
-            "password": self.config.api.authentication.password
-        }
-        response = requests.post(self.restful_endpoint + "token",
-                                 headers=headers,
-                                 data=data)
+        headers, data = self.authentication_request()
+        response = self._session().post(self.restful_endpoint + "token",
+                                     headers=headers,
+                                     data=data,
+                                     timeout=self.timeout)
         result = json.loads(response.content.decode())
-        assert "access_token" in result
-        lg.info("Successfully logged in, token type: {}".format(
-            result["token_type"]))
-        self.config.api.authentication.access_token = result["access_token"]
-        self.config.api.authentication.token_type = result["token_type"]
-        self.auth_header = result["token_type"] + " " + result["access_token"]
-        dump_config_to_file(self.config)
+        self.apply_authentication_result(result)
 
     def get_posts(self):
-        response = requests.get(self.restful_endpoint + "posts")
-        result = json.loads(response.content.decode())
+        """
+        Returns all posts registered at backend, through the response cache.
+        """
+        content = self.cache.get(self._session(), self.restful_endpoint + "posts", timeout=self.timeout)
+        result = json.loads(content.decode())
         return result
 
     def register_post(self, data: dict):
-        headers = {
-            "accept": "application/json",
-            "Authorization": self.auth_header
-        }
-        response = requests.post(
-            self.restful_endpoint + "posts", headers=headers, json=data)
+        response = self._session().post(
+            self.restful_endpoint + "posts", headers=self.register_post_headers(), json=data,
+            timeout=self.timeout)
+        # an error body has no post_id, never mistake it for a result
+        response.raise_for_status()
         result = json.loads(response.content.decode())
         return result
+
+    def register_posts(self, data_list: list[dict],
+                       max_concurrency: int = 4) -> Iterator[tuple[int, dict | Exception]]:
+        """
+        Registers many posts, at most max_concurrency requests are in flight at the same time.
+        Yields (index in data_list, result) as soon as every request completes, result is the exception
+        raised by the request if it failed. A failed request does not stop the others,
+        so post_ids assigned by backend can be saved before anything else goes wrong.
+        """
+        max_concurrency = max(1, min(max_concurrency, CONNECTION_POOL_SIZE))
+        if max_concurrency == 1 or len(data_list) <= 1:
+            for i, data in enumerate(data_list):
+                try:
+                    yield i, self.register_post(data=data)
+                except Exception as e:
+                    yield i, e
+            return
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="api") as executor:
+            futures = {executor.submit(self.register_post, data=data): i for i, data in enumerate(data_list)}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
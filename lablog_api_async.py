@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""lablog_api_async.py:
+asyncio flavour of the python API for lablog backend.
+Authentication and JWT handling are shared with LablogAPI, see LablogAPIBase.
+
+USAGE:
+    async with AsyncLablogAPI(max_concurrency=8, timeout=30) as api:
+        posts = await api.get_posts()
+        results = await api.register_posts([data_0, data_1])
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import asyncio
+import logging
+import json
+# third-party libs
+import aiohttp
+# this package
+from lablog_api import LablogAPIBase
+from http_cache import HttpCacheError
+from config import BuildConfig
+
+lg = logging.getLogger(__name__)
+
+
+class AsyncLablogAPI(LablogAPIBase):
+    def __init__(self, config_path: str | None = None,
+                 max_concurrency: int = 4, timeout: float = 30, config: BuildConfig | None = None) -> None:
+        """
+        max_concurrency: maximum number of requests in flight at the same time
+        timeout: default total timeout of a single request in seconds, can be overridden per request
+        """
+        super().__init__(config_path=config_path, config=config)
+        self.max_concurrency = max(1, max_concurrency)
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "AsyncLablogAPI":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def open(self) -> None:
+        """
+        Creates the HTTP session and authenticates this client if needed.
+        """
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        lg.info("Checking authentication status")
+        self.pending_reauthentication = self.check_reauthentication_required()
+        lg.info("Reauthentication needed: {}".format(
+            self.pending_reauthentication))
+        if self.pending_reauthentication:
+            lg.info("Authenticating client...")
+            await self.handle_reauthenticate()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _timeout(self, timeout: float | None) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=self.timeout if timeout is None else timeout)
+
+    async def handle_reauthenticate(self) -> None:
+        """
+        Tries to authenticate this client, callback for the .authenticate method.
+        This callback catches exceptions, so a outer loop is required for automatic retry.
+        """
+        try:
+            await self.authenticate()
+        except AssertionError:
+            lg.error(
+                "Authentication failed, check the credentials provided in config.")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            lg.error(
+                "Cannot access authentication service, check the connection status: {}".format(e))
+        except Exception as e:
+            lg.error(
+                "Unexpected error occured during re-authentication. Error is {}".format(e))
+
+    async def authenticate(self, timeout: float | None = None) -> None:
+        """
+        Tries to authenticate this client using credentials provided in config.
+        """
+        lg.info("Authenticating client.")
+        headers, data = self.authentication_request()
+        async with self.semaphore:
+            async with self.session.post(self.restful_endpoint + "token",
+                                         headers=headers,
+                                         data=data,
+                                         timeout=self._timeout(timeout)) as response:
+                result = json.loads((await response.read()).decode())
+        self.apply_authentication_result(result)
+
+    async def get_posts(self, timeout: float | None = None):
+        """
+        Returns all posts registered at backend, through the response cache shared with LablogAPI.
+        """
+        url = self.restful_endpoint + "posts"
+        content = self.cache.fresh(url)
+        if content is None:
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url, headers=self.cache.request_headers(url),
+                                                timeout=self._timeout(timeout)) as response:
+                        body = await response.read()
+                        if response.status >= 500:
+                            response.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                content = self.cache.fallback(url, e)
+            else:
+                if response.status not in (200, 304):
+                    response.raise_for_status()
+                    raise HttpCacheError(f"Unexpected status {response.status} for {url}")
+                content = self.cache.store(url, response.status, response.headers, body)
+        result = json.loads(content.decode())
+        return result
+
+    async def register_post(self, data: dict, timeout: float | None = None):
+        async with self.semaphore:
+            async with self.session.post(self.restful_endpoint + "posts",
+                                         headers=self.register_post_headers(),
+                                         json=data,
+                                         timeout=self._timeout(timeout)) as response:
+                # an error body has no post_id, never mistake it for a result
+                response.raise_for_status()
+                result = json.loads((await response.read()).decode())
+        return result
+
+    async def register_posts(self, data_list: list[dict], timeout: float | None = None) -> list:
+        """
+        Registers many posts concurrently, bounded by max_concurrency.
+        Results are returned in the same order as data_list, the result of a failed request
+        is the exception it raised, so one failure does not lose the results of the others.
+        """
+        return await asyncio.gather(
+            *[self.register_post(data=data, timeout=timeout) for data in data_list], return_exceptions=True)
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""pandoc_backend.py:
+Backends used to convert markdown documents to HTML fragments with pandoc.
+
+PandocSubprocessBackend starts a pandoc process for every document and applies
+the lua filters (post_filter.lua, page_filter.lua) to rewrite image and link paths.
+
+PandocServerBackend keeps a long-lived `pandoc server` running and talks to it over HTTP,
+so process start-up is paid only once per build. pandoc server does not run lua filters,
+so the same path rewriting is done in python on the pandoc JSON AST between two requests
+(markdown -> JSON AST, JSON AST -> HTML). It falls back to the subprocess backend
+when the server cannot be reached.
+
+PandocAstBackend parses every markdown document to a JSON AST once and caches it by content hash
+(see ast_cache.py). Path rewriting is done in python on the cached AST, and only rendering
+AST -> HTML is done on every build, for many documents in one request to pandoc server
+(or with one pandoc process per document if no server is available).
+Backends with batched = True convert documents with convert_many(), others with convert().
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import time
+import atexit
+import socket
+import logging
+import threading
+import subprocess
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+# this package
+from ast_cache import AstCache
+from build_manifest import get_pandoc_version
+
+# requests is imported where pandoc server is used, so builds with the subprocess backend do not load it
+if TYPE_CHECKING:
+    import requests
+
+lg = logging.getLogger(__name__)
+
+
+def rewrite_link_targets(node, image_base_path: str, link_base_path: str) -> None:
+    """
+    Prepends base paths to targets of all Image and Link elements of a pandoc JSON AST node,
+    in place. This does the same as the lua filters used by the subprocess backend.
+    """
+    if isinstance(node, list):
+        for child in node:
+            rewrite_link_targets(child, image_base_path, link_base_path)
+    elif isinstance(node, dict):
+        if node.get("t") == "Image":
+            # Image: [attr, [inline], [src, title]]
+            node["c"][2][0] = image_base_path + node["c"][2][0]
+        elif node.get("t") == "Link":
+            # Link: [attr, [inline], [target, title]]
+            node["c"][2][0] = link_base_path + node["c"][2][0]
+        if "c" in node:
+            rewrite_link_targets(node["c"], image_base_path, link_base_path)
+
+
+class PandocSubprocessBackend:
+    """
+    Runs one pandoc process per document with a lua filter.
+    The lua filters print debug messages to stdout, so pandoc writes its result to temp_file.
+    """
+    name = "subprocess"
+    batched = False
+
+    def __init__(self, pandoc_executable: str) -> None:
+        self.pandoc_executable = pandoc_executable
+
+    def convert(self, file_in: str, filter_file: str,
+                image_base_path: str, link_base_path: str, temp_file: str) -> str:
+        args = [self.pandoc_executable, file_in,
+                '--lua-filter', filter_file,
+                '-M', f'image-base-path={image_base_path}',
+                '-M', f'link-base-path={link_base_path}',
+                '-o', temp_file]
+        # a failed run must not leave the output of a previous build to be read
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        pandoc_result = subprocess.run(args, capture_output=True)
+        # debug messages of the lua filters, kept out of the regular build log
+        if pandoc_result.stdout:
+            lg.debug(f"pandoc output for {file_in}:\n{pandoc_result.stdout.decode(errors='replace').rstrip()}")
+        if pandoc_result.returncode != 0:
+            raise RuntimeError(f"pandoc failed for {file_in} with exit code {pandoc_result.returncode}: "
+                               f"{pandoc_result.stderr.decode(errors='replace').strip()}")
+        if pandoc_result.stderr:
+            lg.warning(f"pandoc warnings for {file_in}:\n{pandoc_result.stderr.decode(errors='replace').rstrip()}")
+        with open(temp_file, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def close(self) -> None:
+        pass
+
+
+class PandocServerBackend:
+    """
+    Converts documents with a long-lived `pandoc server`.
+    If server_url is None, a server is started from pandoc_executable on a free local port
+    when the first document is converted, and stopped by close() or at interpreter exit.
+    """
+    name = "server"
+    batched = False
+
+    def __init__(self, pandoc_executable: str, server_url: str | None = None,
+                 request_timeout: float = 60) -> None:
+        self.pandoc_executable = pandoc_executable
+        self.server_url = server_url
+        self.request_timeout = request_timeout
+        self.fallback = PandocSubprocessBackend(pandoc_executable)
+        self.server_process: subprocess.Popen | None = None
+        # None: not tried yet, True: server is usable, False: use fallback
+        self.available: bool | None = None
+        self.lock = threading.Lock()
+        # requests.Session is not guaranteed to be thread safe, use one per thread
+        self.local = threading.local()
+
+    def _session(self) -> "requests.Session":
+        import requests
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _start_server(self) -> None:
+        # find a free port, there is a small window for a race here, which is acceptable
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        lg.info(f"Starting pandoc server on port {port}")
+        self.server_process = subprocess.Popen(
+            [self.pandoc_executable, 'server', '--port', str(port),
+             '--timeout', str(int(self.request_timeout))],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        atexit.register(self.close)
+        self.server_url = f"http://127.0.0.1:{port}/"
+
+    def _wait_for_server(self, timeout: float = 10) -> bool:
+        import requests
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.server_process is not None and self.server_process.poll() is not None:
+                lg.warning("pandoc server exited during start-up.")
+                return False
+            try:
+                response = self._session().get(self.server_url + "version", timeout=1)
+                if response.ok:
+                    lg.info(f"pandoc server {response.text.strip()} ready at {self.server_url}")
+                    return True
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.1)
+        lg.warning(f"pandoc server at {self.server_url} did not respond in {timeout} seconds.")
+        return False
+
+    def ensure_available(self) -> bool:
+        with self.lock:
+            if self.available is None:
+                try:
+                    if self.server_url is None:
+                        self._start_server()
+                    self.available = self._wait_for_server()
+                except OSError as e:
+                    lg.warning(f"Cannot start pandoc server: {e}")
+                    self.available = False
+                if not self.available:
+                    lg.warning("pandoc server is not available, falling back to subprocess.")
+            return self.available
+
+    def _request(self, text: str, from_format: str, to_format: str) -> str:
+        response = self._session().post(
+            self.server_url,
+            json={"text": text, "from": from_format, "to": to_format},
+            headers={"Accept": "application/json"},
+            timeout=self.request_timeout)
+        response.raise_for_status()
+        result = response.json()
+        for message in result.get("messages", []):
+            lg.info(f"pandoc server: {message}")
+        return result["output"]
+
+    def request_batch(self, texts: list[str], from_format: str, to_format: str) -> list[str]:
+        """
+        Converts many texts with a single request to the /batch endpoint of pandoc server.
+        """
+        response = self._session().post(
+            self.server_url + "batch",
+            json=[{"text": text, "from": from_format, "to": to_format} for text in texts],
+            headers={"Accept": "application/json"},
+            timeout=self.request_timeout * max(1, len(texts) // 10))
+        response.raise_for_status()
+        outputs = []
+        for result in response.json():
+            # results are plain strings or objects with output and messages
+            if isinstance(result, str):
+                outputs.append(result)
+                continue
+            for message in result.get("messages", []):
+                lg.info(f"pandoc server: {message}")
+            outputs.append(result["output"])
+        if len(outputs) != len(texts):
+            raise ValueError(f"pandoc server returned {len(outputs)} results for {len(texts)} documents")
+        return outputs
+
+    def convert(self, file_in: str, filter_file: str,
+                image_base_path: str, link_base_path: str, temp_file: str) -> str:
+        import requests
+        if not self.ensure_available():
+            return self.fallback.convert(
+                file_in, filter_file, image_base_path, link_base_path, temp_file)
+        with open(file_in, 'rb') as f:
+            markdown = f.read().decode('utf-8')
+        try:
+            ast = json.loads(self._request(markdown, "markdown", "json"))
+            rewrite_link_targets(ast["blocks"], image_base_path, link_base_path)
+            return self._request(json.dumps(ast), "json", "html")
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            lg.warning(f"pandoc server failed to convert {file_in}, falling back to subprocess: {e}")
+            return self.fallback.convert(
+                file_in, filter_file, image_base_path, link_base_path, temp_file)
+
+    def close(self) -> None:
+        if self.server_process is not None and self.server_process.poll() is None:
+            lg.info("Stopping pandoc server")
+            self.server_process.terminate()
+            try:
+                self.server_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.server_process.kill()
+        self.server_process = None
+
+
+class PandocAstBackend:
+    """
+    Converts documents from cached JSON ASTs, see the module docstring.
+    A pandoc server is used if server_url is given or one can be started, pandoc processes otherwise.
+    """
+    name = "ast"
+    batched = True
+
+    def __init__(self, pandoc_executable: str, cache_directory: str, server_url: str | None = None,
+                 batch_size: int = 50, workers: int = 4) -> None:
+        """
+        batch_size: documents rendered in one request to pandoc server
+        workers: pandoc processes run at the same time when no server is available
+        """
+        self.pandoc_executable = pandoc_executable
+        self.cache = AstCache(cache_directory, get_pandoc_version(pandoc_executable))
+        self.server = PandocServerBackend(pandoc_executable, server_url=server_url)
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+
+    def _run_pandoc(self, args: list[str], data: bytes) -> str:
+        result = subprocess.run([self.pandoc_executable] + args, input=data, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"pandoc failed: {result.stderr.decode(errors='replace').strip()}")
+        if result.stderr:
+            lg.warning(f"pandoc warnings:\n{result.stderr.decode(errors='replace').rstrip()}")
+        return result.stdout.decode('utf-8')
+
+    def _map(self, texts: list[str], from_format: str, to_format: str) -> list[str]:
+        """
+        Converts texts with pandoc server in batches, or with pandoc processes.
+        """
+        import requests
+        if self.server.ensure_available():
+            try:
+                outputs = []
+                for i in range(0, len(texts), self.batch_size):
+                    outputs += self.server.request_batch(texts[i:i + self.batch_size], from_format, to_format)
+                return outputs
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                lg.warning(f"pandoc server failed to convert a batch, falling back to pandoc processes: {e}")
+        args = ['-f', from_format, '-t', to_format]
+        if len(texts) == 1 or self.workers == 1:
+            return [self._run_pandoc(args, text.encode('utf-8')) for text in texts]
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pandoc") as executor:
+            return list(executor.map(lambda text: self._run_pandoc(args, text.encode('utf-8')), texts))
+
+    def parse_many(self, files_in: list[str]) -> list[dict]:
+        """
+        Returns JSON ASTs of markdown files, parsing only those not in cache.
+        """
+        keys, asts = [], []
+        missing = {}
+        for file_in in files_in:
+            with open(file_in, 'rb') as f:
+                markdown = f.read()
+            key = self.cache.key(markdown)
+            ast = self.cache.get(key)
+            keys.append(key)
+            asts.append(ast)
+            if ast is None:
+                missing.setdefault(key, markdown.decode('utf-8'))
+        if missing:
+            lg.info(f"Parsing {len(missing)} markdown documents with pandoc")
+            parsed = self._map(list(missing.values()), "markdown", "json")
+            for key, output in zip(missing.keys(), parsed):
+                self.cache.put(key, json.loads(output))
+            asts = [ast if ast is not None else self.cache.get(key) for key, ast in zip(keys, asts)]
+        return asts
+
+    def transform(self, ast: dict, image_base_path: str, link_base_path: str) -> dict:
+        """
+        Transforms applied in python to the AST of a document on every build, in place.
+        """
+        rewrite_link_targets(ast["blocks"], image_base_path, link_base_path)
+        return ast
+
+    def convert_many(self, jobs: list[dict]) -> list[str]:
+        """
+        jobs: arguments of convert() for every document, filter_file and temp_file are not used
+        """
+        if len(jobs) == 0:
+            return []
+        asts = self.parse_many([job["file_in"] for job in jobs])
+        texts = [json.dumps(self.transform(ast, job["image_base_path"], job["link_base_path"]))
+                 for ast, job in zip(asts, jobs)]
+        lg.info(f"Rendering {len(texts)} documents to HTML")
+        return self._map(texts, "json", "html")
+
+    def convert(self, file_in: str, filter_file: str,
+                image_base_path: str, link_base_path: str, temp_file: str) -> str:
+        return self.convert_many([dict(file_in=file_in, filter_file=filter_file, image_base_path=image_base_path,
+                                       link_base_path=link_base_path, temp_file=temp_file)])[0]
+
+    def close(self) -> None:
+        self.server.close()
+        self.cache.prune()
+
+
+def create_pandoc_backend(backend: str, pandoc_executable: str, server_url: str | None = None,
+                          ast_cache_directory: str = "./cache/ast/", workers: int = 4):
+    if backend == "server":
+        return PandocServerBackend(pandoc_executable, server_url=server_url)
+    if backend == "ast":
+        return PandocAstBackend(pandoc_executable, ast_cache_directory, server_url=server_url, workers=workers)
+    if backend != "subprocess":
+        lg.warning(f"Unknown pandoc backend {backend}, using subprocess.")
+    return PandocSubprocessBackend(pandoc_executable)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""post_db.py:
+A persistent SQLite index of posts, keyed by post folder, holding for every post:
+    - parsed meta.json, with its mtime, size and hash, so unchanged metadata is not parsed again
+    - post_id assigned by backend and the payload last registered at backend,
+      so posts are registered again only when their payload changed
+    - fingerprint and output files of the last build
+Catagory, tags and dates are kept in indexed columns, so posts can be queried without
+scanning the posts folder:
+    $ python3 post_db.py --tag fpga --since 2024-01-01
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+# this package
+from data_model import PostMetadata
+from config import load_config_from_file, CONFIG_PATH
+
+lg = logging.getLogger(__name__)
+
+# bump this when the schema changes, the database is recreated
+POST_DB_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    path TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    meta_mtime_ns INTEGER NOT NULL,
+    meta_size INTEGER NOT NULL,
+    meta_hash TEXT NOT NULL,
+    markdown_mtime_ns INTEGER,
+    title TEXT NOT NULL,
+    catagory TEXT,
+    created_timestamp REAL,
+    post_id TEXT,
+    registered_payload TEXT,
+    registered_at REAL,
+    built_fingerprint TEXT,
+    built_outputs TEXT,
+    built_at REAL
+);
+CREATE INDEX IF NOT EXISTS posts_root ON posts (root);
+CREATE INDEX IF NOT EXISTS posts_catagory ON posts (catagory);
+CREATE INDEX IF NOT EXISTS posts_created ON posts (created_timestamp);
+CREATE TABLE IF NOT EXISTS post_tags (
+    path TEXT NOT NULL REFERENCES posts (path) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (path, tag)
+);
+CREATE INDEX IF NOT EXISTS post_tags_tag ON post_tags (tag);
+"""
+
+
+def canonical_payload(payload: dict) -> str:
+    return json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+
+
+def _created_timestamp(post_meta: PostMetadata) -> float | None:
+    if post_meta.datetime is not None:
+        return datetime.strptime(post_meta.datetime, "%Y-%m-%d %H:%M:%S").timestamp()
+    return post_meta.timestamp
+
+
+class PostDatabase:
+    def __init__(self, db_file: str) -> None:
+        os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+        # posts are loaded and built by several threads, one connection is shared behind a lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != POST_DB_VERSION:
+            if version != 0:
+                lg.warning(f"Post database at {db_file} has version {version}, recreating it.")
+            self.connection.executescript("DROP TABLE IF EXISTS post_tags; DROP TABLE IF EXISTS posts;")
+            self.connection.execute(f"PRAGMA user_version={POST_DB_VERSION}")
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def cached_metadata(self, post_path: str) -> PostMetadata | None:
+        """
+        Returns metadata of the post parsed in an earlier build, if meta.json did not change since.
+        """
+        try:
+            st = os.stat(f"{post_path}/meta.json")
+        except OSError:
+            return None
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT meta, meta_mtime_ns, meta_size FROM posts WHERE path = ?", (post_path,)).fetchone()
+        if row is None or row["meta_mtime_ns"] != st.st_mtime_ns or row["meta_size"] != st.st_size:
+            return None
+        return PostMetadata(**json.loads(row["meta"]))
+
+    def update_metadata(self, post_path: str, post_meta: PostMetadata) -> None:
+        """
+        Records metadata as parsed from the current meta.json of the post.
+        """
+        meta_file = f"{post_path}/meta.json"
+        st = os.stat(meta_file)
+        with open(meta_file, 'rb') as f:
+            meta_hash = hashlib.sha256(f.read()).hexdigest()
+        try:
+            markdown_mtime_ns = os.stat(f"{post_path}/post.md").st_mtime_ns
+        except OSError:
+            markdown_mtime_ns = None
+        with self.lock:
+            self.connection.execute(
+                """
+                INSERT INTO posts (path, root, meta, meta_mtime_ns, meta_size, meta_hash, markdown_mtime_ns,
+                                   title, catagory, created_timestamp, post_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (path) DO UPDATE SET
+                    root = excluded.root, meta = excluded.meta, meta_mtime_ns = excluded.meta_mtime_ns,
+                    meta_size = excluded.meta_size, meta_hash = excluded.meta_hash,
+                    markdown_mtime_ns = excluded.markdown_mtime_ns, title = excluded.title,
+                    catagory = excluded.catagory, created_timestamp = excluded.created_timestamp,
+                    post_id = COALESCE(excluded.post_id, posts.post_id)
+                """,
+                (post_path, post_meta.root, post_meta.model_dump_json(), st.st_mtime_ns, st.st_size, meta_hash,
+                 markdown_mtime_ns, post_meta.title, post_meta.catagory, _created_timestamp(post_meta),
+                 post_meta.post_id))
+            self.connection.execute("DELETE FROM post_tags WHERE path = ?", (post_path,))
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO post_tags (path, tag) VALUES (?, ?)",
+                [(post_path, tag) for tag in post_meta.tags or []])
+
+    def known_post_id(self, post_path: str) -> str | None:
+        with self.lock:
+            row = self.connection.execute("SELECT post_id FROM posts WHERE path = ?", (post_path,)).fetchone()
+        return None if row is None else row["post_id"]
+
+    def needs_registration(self, post_path: str, payload: dict) -> bool:
+        """
+        Whether payload differs from the one last registered for the post.
+        Payloads without post_id always need registration.
+        """
+        if not payload.get("post_id"):
+            return True
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT registered_payload FROM posts WHERE path = ?", (post_path,)).fetchone()
+        return row is None or row["registered_payload"] != canonical_payload(payload)
+
+    def record_registration(self, post_path: str, post_id: str, payload: dict) -> None:
+        with self.lock:
+            self.connection.execute(
+                "UPDATE posts SET post_id = ?, registered_payload = ?, registered_at = ? WHERE path = ?",
+                (post_id, canonical_payload(payload), time.time(), post_path))
+
+    def record_build(self, post_path: str, fingerprint: str, outputs: list[str]) -> None:
+        with self.lock:
+            self.connection.execute(
+                "UPDATE posts SET built_fingerprint = ?, built_outputs = ?, built_at = ? WHERE path = ?",
+                (fingerprint, json.dumps(outputs), time.time(), post_path))
+
+    def prune(self, post_paths: list[str]) -> None:
+        """
+        Forgets posts not in post_paths.
+        """
+        with self.lock:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS current_paths (path TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM current_paths")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO current_paths (path) VALUES (?)", [(p,) for p in post_paths])
+            removed = self.connection.execute(
+                "DELETE FROM posts WHERE path NOT IN (SELECT path FROM current_paths)").rowcount
+            self.connection.commit()
+        if removed:
+            lg.info(f"Removed {removed} posts that are gone from post database.")
+
+    def find_posts(self, tag: str | None = None, catagory: str | None = None,
+                   since: float | None = None, until: float | None = None) -> list[dict]:
+        """
+        Returns posts matching all given conditions, newest first.
+        since, until: unix timestamps, inclusive
+        """
+        query = "SELECT path, root, title, catagory, created_timestamp, post_id FROM posts WHERE 1 = 1"
+        params = []
+        if tag is not None:
+            query += " AND path IN (SELECT path FROM post_tags WHERE tag = ?)"
+            params.append(tag)
+        if catagory is not None:
+            query += " AND catagory = ?"
+            params.append(catagory)
+        if since is not None:
+            query += " AND created_timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND created_timestamp <= ?"
+            params.append(until)
+        query += " ORDER BY created_timestamp DESC, path"
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+            posts = [dict(row) for row in rows]
+            for post in posts:
+                post["tags"] = [r["tag"] for r in self.connection.execute(
+                    "SELECT tag FROM post_tags WHERE path = ? ORDER BY tag", (post["path"],))]
+        return posts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query the post database written by builds.")
+    parser.add_argument("--config", default=CONFIG_PATH)
+    parser.add_argument("--tag")
+    parser.add_argument("--catagory")
+    parser.add_argument("--since", help="YYYY-MM-DD")
+    parser.add_argument("--until", help="YYYY-MM-DD")
+    args = parser.parse_args()
+    config = load_config_from_file(args.config)
+    db = PostDatabase(config.paths.post_database_file)
+
+    def day(value: str | None, end: bool) -> float | None:
+        if value is None:
+            return None
+        return datetime.strptime(value, "%Y-%m-%d").timestamp() + (86399 if end else 0)
+
+    for post in db.find_posts(tag=args.tag, catagory=args.catagory,
+                              since=day(args.since, False), until=day(args.until, True)):
+        date = datetime.fromtimestamp(post["created_timestamp"]).strftime("%Y-%m-%d") \
+            if post["created_timestamp"] is not None else "----------"
+        print(f"{date}  {post['root']:<32} [{post['catagory']}] {', '.join(post['tags'])}  {post['title']}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""posts_index.py:
+Generates the buffered post list (posts.json) from post metadata known to the builder,
+instead of downloading it from the backend, and shards it for the frontend:
+    <index dir>/index.json              totals, page count, catagory and tag lookup tables
+    <index dir>/pages/<n>.json          posts in page n (newest first)
+    <index dir>/catagory/<slug>.json    posts in a catagory, compact fields only
+    <index dir>/tags/<slug>.json        posts with a tag, compact fields only
+Files are rewritten only when their content changes, so their mtimes stay stable.
+Stale shards are only looked for in pages/, catagory/ and tags/, so the index directory may be shared
+with other files, even be the site root.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import json
+import hashlib
+import logging
+
+lg = logging.getLogger(__name__)
+
+# fields kept in catagory and tag indices
+COMPACT_FIELDS = ("post_id", "title", "link", "created_timestamp")
+
+
+def dumps(content) -> bytes:
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """
+    Writes data to path unless path already has exactly this content. Returns whether it was written.
+    """
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return True
+
+
+def replace_if_changed(temp_path: str, path: str) -> bool:
+    """
+    Moves the file at temp_path to path unless path already has exactly the same content,
+    then temp_path is deleted. Returns whether path was replaced. For files written in a stream.
+    """
+    if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(temp_path):
+        with open(temp_path, 'rb') as f_new, open(path, 'rb') as f_old:
+            while True:
+                chunk = f_new.read(1024 * 1024)
+                if chunk != f_old.read(1024 * 1024):
+                    break
+                if not chunk:
+                    os.remove(temp_path)
+                    return False
+    os.replace(temp_path, path)
+    return True
+
+
+def remove_stale_files(directories: list[str], expected: set[str]) -> int:
+    """
+    Removes JSON files below directories that are not in expected (normalized paths),
+    returns how many were removed. Other files are never touched.
+    """
+    removed = 0
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(directory):
+            for filename in filenames:
+                path = os.path.normpath(os.path.join(dirpath, filename))
+                if filename.endswith(".json") and path not in expected:
+                    os.remove(path)
+                    removed += 1
+    return removed
+
+
+def slugify(name: str) -> str:
+    """
+    File name for a catagory or tag. The hash suffix keeps names unique
+    when different names have the same slug, e.g. "C" and "C++".
+    """
+    slug = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return f"{slug}-{digest}" if slug else digest
+
+
+def sort_entries(entries: list[dict]) -> list[dict]:
+    # newest first, post_id breaks ties so that order is stable
+    return sorted(entries, key=lambda e: (-e["created_timestamp"], e["post_id"] or ""))
+
+
+def compact(entry: dict) -> dict:
+    return {k: entry[k] for k in COMPACT_FIELDS}
+
+
+def write_posts_index(entries: list[dict], posts_json_file: str, index_directory: str, page_size: int) -> None:
+    """
+    entries: one dict per post with post_id, title, abstract, link, created_timestamp, catagory and tags
+    """
+    entries = sort_entries(entries)
+    written = 0
+    expected = set()
+
+    def emit(path: str, content) -> None:
+        nonlocal written
+        expected.add(os.path.normpath(path))
+        written += write_if_changed(path, dumps(content))
+
+    emit(posts_json_file, entries)
+
+    page_size = max(1, page_size)
+    page_count = max(1, (len(entries) + page_size - 1) // page_size)
+    for page in range(page_count):
+        emit(os.path.join(index_directory, "pages", f"{page + 1}.json"), {
+            "page": page + 1,
+            "pages": page_count,
+            "posts": entries[page * page_size:(page + 1) * page_size],
+        })
+
+    groups = {"catagory": {}, "tags": {}}
+    for entry in entries:
+        groups["catagory"].setdefault(entry["catagory"], []).append(compact(entry))
+        for tag in entry["tags"]:
+            groups["tags"].setdefault(tag, []).append(compact(entry))
+    lookup = {}
+    for group, members in groups.items():
+        lookup[group] = {}
+        for name in sorted(members):
+            file_name = f"{group}/{slugify(name)}.json"
+            emit(os.path.join(index_directory, file_name), members[name])
+            lookup[group][name] = {"file": file_name, "count": len(members[name])}
+
+    emit(os.path.join(index_directory, "index.json"), {
+        "total": len(entries),
+        "page_size": page_size,
+        "pages": page_count,
+        "catagories": lookup["catagory"],
+        "tags": lookup["tags"],
+    })
+
+    # shards of catagories, tags and pages that are gone, the rest of index_directory is not ours
+    removed = remove_stale_files([os.path.join(index_directory, group) for group in ("pages", "catagory", "tags")],
+                                 expected)
+    lg.info(f"Posts index written, {written} files changed, {removed} stale files removed.")
+
+
+def reconcile_with_backend(entries: list[dict], backend_posts) -> None:
+    """
+    Logs differences between the locally generated post list and the one held by backend.
+    """
+    if not isinstance(backend_posts, list):
+        lg.warning(f"Unexpected post list from backend, cannot reconcile: {str(backend_posts)[:200]}")
+        return
+    local = {e["post_id"]: e for e in entries}
+    remote = {p.get("post_id"): p for p in backend_posts if isinstance(p, dict)}
+    for post_id in sorted(set(remote) - set(local), key=str):
+        lg.warning(f"Post {post_id} ({remote[post_id].get('title')}) is registered at backend "
+                   "but not found locally.")
+    for post_id in sorted(set(local) - set(remote), key=str):
+        lg.warning(f"Post {post_id} ({local[post_id]['title']}) is not registered at backend.")
+    for post_id in sorted(set(local) & set(remote), key=str):
+        different = [k for k, v in local[post_id].items()
+                     if k in remote[post_id] and remote[post_id][k] != v]
+        if different:
+            lg.warning(f"Post {post_id} differs from backend in: {', '.join(different)}")
+    lg.info("Reconciliation with backend done.")
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""precompress.py:
+Generates precompressed siblings (.gz, and .br if the brotli package is installed)
+of text assets in the frontend build output, so nginx can serve them with gzip_static/brotli_static
+without compressing on every request.
+
+Compressed results are cached by hash of the original file, so files that did not change
+are not compressed again, even if npm build recreated the output directory.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import gzip
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+# third-party libs
+try:
+    import brotli
+except ImportError:
+    brotli = None
+# this package
+from build_manifest import hash_file
+
+lg = logging.getLogger(__name__)
+
+# files with these extensions are precompressed
+COMPRESSIBLE_EXTENSIONS = (".html", ".css", ".js", ".mjs", ".json", ".txt", ".xml", ".svg")
+# smaller files do not benefit from compression
+MIN_SIZE = 256
+
+
+def _compress_gzip(data: bytes) -> bytes:
+    # mtime=0 keeps output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+
+def precompress_file(path: str, cache_directory: str, use_brotli: bool) -> tuple[int, int, list[str]]:
+    """
+    Writes compressed siblings of the file at path, taking them from cache if possible.
+    Returns number of (compressed, cached) outputs and names of the cache files used.
+    """
+    compressors = [(".gz", _compress_gzip)]
+    if use_brotli and brotli is not None:
+        compressors.append((".br", _compress_brotli))
+    digest = hash_file(path)
+    data = None
+    compressed, cached = 0, 0
+    used = []
+    for extension, compress in compressors:
+        used.append(digest + extension)
+        cache_file = os.path.join(cache_directory, digest + extension)
+        if os.path.exists(cache_file):
+            cached += 1
+        else:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            temp_file = cache_file + ".tmp"
+            with open(temp_file, 'wb') as f:
+                f.write(compress(data))
+            os.replace(temp_file, cache_file)
+            compressed += 1
+        shutil.copyfile(cache_file, path + extension)
+        # nginx and deploy tools compare mtimes, keep them in line with the original
+        shutil.copystat(path, path + extension)
+    return compressed, cached, used
+
+
+def precompress_directory(root: str, cache_directory: str, use_brotli: bool = True, workers: int = 4) -> None:
+    """
+    Precompresses all compressible files under root in parallel.
+    zlib and brotli release the GIL while compressing, so threads are used.
+    """
+    if use_brotli and brotli is None:
+        lg.warning("brotli package not found, only gzip files are generated.")
+    os.makedirs(cache_directory, exist_ok=True)
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith(COMPRESSIBLE_EXTENSIONS) and os.path.getsize(path) >= MIN_SIZE:
+                paths.append(path)
+    lg.info(f"Precompressing {len(paths)} files in {root}")
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="compress") as executor:
+        results = list(executor.map(
+            lambda path: precompress_file(path, cache_directory, use_brotli), paths))
+    compressed = sum(r[0] for r in results)
+    cached = sum(r[1] for r in results)
+    lg.info(f"Precompression done, {compressed} outputs compressed, {cached} taken from cache.")
+    # forget compressed versions of files that are gone
+    used = set(name for r in results for name in r[2])
+    for name in os.listdir(cache_directory):
+        if name not in used:
+            os.remove(os.path.join(cache_directory, name))
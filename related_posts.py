@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+"""related_posts.py:
+Finds the most similar posts of every post, so related posts can be rendered into post pages at build time.
+
+Every post is a TF-IDF vector of terms from its title, abstract, tags, catagory and markdown,
+tokenized like the search index. Only the max_terms highest weighted terms of a post are kept,
+which drops common words and keeps the matrix of all posts very sparse.
+Cosine similarities of a block of posts with all posts are computed at once with numpy,
+as a sparse matrix product over the inverted (term -> posts) form of the matrix,
+and the top `count` posts of every row are kept.
+
+Updates are incremental: IDF weights are frozen after they are computed over the whole corpus,
+so when a few posts change, only their rows and the rows that listed them are computed again,
+and changed posts are merged into the lists of other posts they now beat.
+IDF weights are recomputed over the whole corpus once the posts added, changed or removed
+since then exceed REFRESH_FRACTION of all posts.
+Requires numpy.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import json
+import math
+import logging
+import importlib.util
+from itertools import chain
+from typing import Callable
+# third-party libs
+# numpy is imported by the methods using it, so importing this module (and build.py) stays cheap
+# this package
+from posts_index import dumps, write_if_changed
+from search_index import tokenize, FIELD_WEIGHTS
+
+lg = logging.getLogger(__name__)
+
+# bump this when terms or similarities change for the same posts
+RELATED_POSTS_VERSION = 1
+# IDF is recomputed when this fraction of posts changed since it was last computed
+REFRESH_FRACTION = 0.1
+# rows of the similarity matrix computed at once, bounds memory to BLOCK_ROWS * number of posts floats
+BLOCK_ROWS = 256
+# tags and catagory are also matched as a whole, with this weight
+LABEL_WEIGHT = 3
+
+URL_PATTERN = re.compile(r"\]\([^)]*\)|https?://\S+")
+
+
+def is_available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+def post_terms(title: str, abstract: str, tags: list[str], catagory: str, markdown: str) -> dict[str, int]:
+    """
+    Returns weighted term frequencies of a post. Link targets in markdown are not terms.
+    """
+    weights = {}
+    fields = {
+        "title": title,
+        "abstract": abstract,
+        "tags": " ".join(tags),
+        "content": URL_PATTERN.sub(" ", markdown),
+    }
+    for field, text in fields.items():
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + FIELD_WEIGHTS[field]
+    # labels contain ":", which tokenize never produces
+    for tag in tags:
+        weights[f"tag:{tag.lower()}"] = LABEL_WEIGHT
+    if catagory:
+        weights[f"catagory:{catagory.lower()}"] = LABEL_WEIGHT
+    return weights
+
+
+class RelatedPosts:
+    """
+    Related posts of every post, persisted in cache_file between builds with the vectors of all posts.
+    Posts are identified by keys, e.g. their path, and carry a stamp that changes when the post changes.
+    """
+
+    def __init__(self, cache_file: str, count: int = 5, max_terms: int = 64) -> None:
+        self.cache_file = cache_file
+        self.settings = {"version": RELATED_POSTS_VERSION, "count": count, "max_terms": max_terms}
+        self.count = count
+        self.max_terms = max_terms
+        # key -> {"stamp": stamp, "vector": {term: weight}}
+        self.documents: dict[str, dict] = {}
+        # IDF of terms in at least two posts, when it was last computed over the whole corpus
+        self.idf: dict[str, float] = {}
+        self.idf_documents = 0
+        # posts added, changed or removed since IDF was computed
+        self.changes_since_refresh = 0
+        # key -> [[related key, similarity], ...], most similar first
+        self.related: dict[str, list] = {}
+        if not os.path.exists(cache_file):
+            return
+        try:
+            with open(cache_file, 'rb') as f:
+                content = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            lg.warning(f"Cannot read related posts cache at {cache_file}, ignoring it: {e}")
+            return
+        if content.get("settings") == self.settings:
+            self.documents = content["documents"]
+            self.idf = content["idf"]
+            self.idf_documents = content["idf_documents"]
+            self.changes_since_refresh = content["changes_since_refresh"]
+            self.related = content["related"]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        write_if_changed(self.cache_file, dumps({
+            "settings": self.settings, "documents": self.documents, "idf": self.idf,
+            "idf_documents": self.idf_documents, "changes_since_refresh": self.changes_since_refresh,
+            "related": self.related}))
+
+    def related_keys(self, key: str) -> list[str]:
+        return [k for k, _ in self.related.get(key, [])]
+
+    def _default_idf(self) -> float:
+        # IDF of a term found in a single post
+        return math.log((1 + self.idf_documents) / 2) + 1
+
+    def _vectors(self, terms: dict[str, dict[str, int]], refresh_idf: bool = False) -> dict[str, dict[str, float]]:
+        """
+        Returns the L2 normalized TF-IDF vectors of the max_terms highest weighted terms of every post.
+        refresh_idf: compute IDF from the given posts first, they must be the whole corpus
+        """
+        import numpy as np
+        keys = list(terms)
+        lengths = np.fromiter(map(len, terms.values()), dtype=np.int64, count=len(keys))
+        # map and chain keep these loops over millions of terms out of the interpreter
+        names = list(dict.fromkeys(chain.from_iterable(terms.values())))
+        vocabulary = {t: i for i, t in enumerate(names)}
+        term_ids = np.fromiter(map(vocabulary.__getitem__, chain.from_iterable(terms.values())),
+                               dtype=np.int64, count=int(lengths.sum()))
+        frequencies = np.fromiter(chain.from_iterable(t.values() for t in terms.values()),
+                                  dtype=np.float64, count=len(term_ids))
+        if refresh_idf:
+            document_frequencies = np.bincount(term_ids, minlength=len(names))
+            idf = np.round(np.log((1 + len(keys)) / (1 + document_frequencies)) + 1, 6)
+            self.idf = {names[t]: float(idf[t]) for t in np.nonzero(document_frequencies > 1)[0]}
+            self.idf_documents = len(keys)
+            self.changes_since_refresh = 0
+        else:
+            default_idf = self._default_idf()
+            idf = np.fromiter((self.idf.get(t, default_idf) for t in names), dtype=np.float64, count=len(names))
+        values = (1 + np.log(frequencies)) * idf[term_ids]
+        rows = np.repeat(np.arange(len(keys)), lengths)
+        # entries of every row, highest weight first, keep the first max_terms of them
+        order = np.lexsort((-values, rows))
+        starts = np.cumsum(lengths) - lengths
+        keep = order[np.arange(len(order)) - np.repeat(starts, lengths) < self.max_terms]
+        rows, term_ids, values = rows[keep], term_ids[keep], values[keep]
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=len(keys)))
+        values = np.round(values / np.where(norms > 0, norms, 1)[rows], 6)
+        vectors = {}
+        position = 0
+        term_ids, values = term_ids.tolist(), values.tolist()
+        for key, length in zip(keys, np.minimum(lengths, self.max_terms).tolist()):
+            vectors[key] = {names[t]: v for t, v in zip(term_ids[position:position + length],
+                                                         values[position:position + length])}
+            position += length
+        return vectors
+
+    def update(self, documents: dict[str, tuple[object, Callable[[], dict[str, int]]]]) -> set[str]:
+        """
+        Updates related posts to the current posts.
+        documents: key -> (stamp, function returning post_terms() of the post),
+                   terms are only computed for posts whose stamp changed, or for all posts when IDF is refreshed
+        Returns keys of posts whose list of related posts changed.
+        """
+        removed = [k for k in self.documents if k not in documents]
+        changed = [k for k, (stamp, _) in documents.items()
+                   if k not in self.documents or self.documents[k]["stamp"] != stamp]
+        missing = [k for k in documents if k not in self.related]
+        if not removed and not changed and not missing:
+            return set()
+        previous = {k: self.related_keys(k) for k in documents}
+        for key in removed:
+            del self.documents[key]
+            self.related.pop(key, None)
+        self.changes_since_refresh += len(removed) + len(changed)
+        if self.changes_since_refresh > REFRESH_FRACTION * max(self.idf_documents, 1):
+            lg.info(f"Computing related posts of all {len(documents)} posts")
+            terms = {k: terms_function() for k, (_, terms_function) in documents.items()}
+            vectors = self._vectors(terms, refresh_idf=True)
+            self.documents = {k: {"stamp": documents[k][0], "vector": vectors[k]} for k in documents}
+            self._compute(rows=sorted(documents), changed=[])
+        else:
+            lg.info(f"Updating related posts, {len(changed)} posts changed, {len(removed)} removed")
+            vectors = self._vectors({k: documents[k][1]() for k in changed})
+            for key in changed:
+                self.documents[key] = {"stamp": documents[key][0], "vector": vectors[key]}
+            gone = set(changed) | set(removed)
+            # lists that contained a changed or removed post are computed again,
+            # changed posts may have become less similar
+            affected = [k for k in documents if k in gone or k not in self.related
+                        or any(r in gone for r in self.related_keys(k))]
+            self._compute(rows=sorted(affected), changed=sorted(changed))
+        return {k for k in documents if self.related_keys(k) != previous.get(k)}
+
+    def _compute(self, rows: list[str], changed: list[str]) -> None:
+        """
+        Computes related posts of rows from scratch, and merges changed posts into the lists
+        of all other posts, if they are more similar than the posts listed.
+        """
+        import numpy as np
+        keys = sorted(self.documents)
+        index = {k: i for i, k in enumerate(keys)}
+        n = len(keys)
+        # sparse matrix of all posts, row i is the vector of keys[i], in compressed sparse row form
+        vocabulary = {}
+        row_lengths = np.zeros(n, dtype=np.int64)
+        term_ids = []
+        weights = []
+        for i, key in enumerate(keys):
+            vector = self.documents[key]["vector"]
+            row_lengths[i] = len(vector)
+            term_ids += [vocabulary.setdefault(t, len(vocabulary)) for t in vector]
+            weights += vector.values()
+        term_ids = np.array(term_ids, dtype=np.int64)
+        weights = np.array(weights, dtype=np.float32)
+        entry_rows = np.repeat(np.arange(n), row_lengths)
+        row_pointers = np.concatenate(([0], np.cumsum(row_lengths)))
+        # same matrix in compressed sparse column form, the inverted index: term -> posts
+        order = np.argsort(term_ids, kind="stable")
+        column_rows = entry_rows[order]
+        column_weights = weights[order]
+        column_pointers = np.concatenate(([0], np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)))))
+
+        def similarities(block: np.ndarray) -> np.ndarray:
+            """
+            Returns cosine similarities of the posts at indices block with all posts, len(block) x n.
+            """
+            # nonzero entries of the block rows
+            starts, ends = row_pointers[block], row_pointers[block + 1]
+            lengths = ends - starts
+            entries = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + \
+                np.arange(lengths.sum())
+            local_rows = np.repeat(np.arange(len(block)), lengths)
+            terms, values = term_ids[entries], weights[entries]
+            # every entry meets all posts having the same term
+            counts = column_pointers[terms + 1] - column_pointers[terms]
+            postings = np.repeat(column_pointers[terms] - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + \
+                np.arange(counts.sum())
+            products = np.repeat(values, counts) * column_weights[postings]
+            cells = np.repeat(local_rows, counts) * n + column_rows[postings]
+            scores = np.bincount(cells, weights=products, minlength=len(block) * n).reshape(len(block), n)
+            # a post is not related to itself
+            scores[np.arange(len(block)), block] = 0
+            return scores
+
+        def top(scores: np.ndarray) -> list:
+            k = min(self.count, n - 1)
+            if k <= 0:
+                return []
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+            return [[keys[j], round(float(scores[j]), 6)] for j in candidates if scores[j] > 0]
+
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = np.array([index[k] for k in rows[start:start + BLOCK_ROWS]], dtype=np.int64)
+            scores = similarities(block)
+            for local, i in enumerate(block):
+                self.related[keys[i]] = top(scores[local])
+
+        recomputed = set(rows)
+        # similarity is symmetric, rows of changed posts are the columns of changed posts
+        for start in range(0, len(changed), BLOCK_ROWS):
+            block_keys = changed[start:start + BLOCK_ROWS]
+            block = np.array([index[k] for k in block_keys], dtype=np.int64)
+            scores = similarities(block)
+            for local, changed_key in enumerate(block_keys):
+                for j in np.nonzero(scores[local] > 0)[0]:
+                    key = keys[j]
+                    if key in recomputed:
+                        continue
+                    listed = self.related[key]
+                    score = round(float(scores[local, j]), 6)
+                    if len(listed) < self.count or score > listed[-1][1]:
+                        listed.append([changed_key, score])
+                        listed.sort(key=lambda item: (-item[1], item[0]))
+                        del listed[self.count:]
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""search_index.py:
+Builds a static full-text search index of posts for the frontend, so searching needs no backend.
+
+Terms are taken from titles, abstracts, tags and the HTML fragments produced by pandoc.
+Latin text is split into words, CJK text into overlapping character bigrams.
+Terms of every post are cached between builds, so only posts that were rebuilt are tokenized again.
+
+Output, in the search index directory:
+    meta.json           {"version", "documents", "shards": [shard names]}
+    docs.json           [[title, link, abstract], ...], position in this list is the document number,
+                        null for numbers of deleted posts
+    shards/<name>.json  {term: [doc delta, weight, doc delta, weight, ...]}
+Posting lists are sorted by document number and store the difference to the previous
+document number. A term belongs to the shard named by shard_name(term): its first two
+characters for latin terms, "u" + hex code point of its first character otherwise,
+so the frontend only fetches the shards of the terms it looks up.
+Stale shards are removed from shards/, other files in the search index directory are left alone.
+Document numbers are kept between builds, so a changed post only changes the shards of its terms.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import json
+import logging
+import threading
+from html.parser import HTMLParser
+# this package
+from posts_index import dumps, write_if_changed, remove_stale_files
+
+lg = logging.getLogger(__name__)
+
+# bump this when tokenization or output layout changes
+SEARCH_INDEX_VERSION = 1
+# terms in these fields count more than terms in post content
+FIELD_WEIGHTS = {"title": 5, "tags": 3, "abstract": 2, "content": 1}
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+CJK_PATTERN = re.compile(
+    r"([぀-ヿ㐀-䶿一-鿿가-힯豈-﫿]+)")
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip_depth > 0:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.skip_depth == 0:
+            self.parts.append(data)
+
+
+def extract_text(html: str) -> str:
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return " ".join(parser.parts)
+
+
+def tokenize(text: str) -> list[str]:
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        for i, part in enumerate(CJK_PATTERN.split(word)):
+            if part == "":
+                continue
+            if i % 2 == 0:
+                # latin, digits, etc., single letters are too common to be useful
+                if len(part) > 1 or part.isdigit():
+                    terms.append(part)
+            elif len(part) == 1:
+                terms.append(part)
+            else:
+                terms.extend(part[j:j + 2] for j in range(len(part) - 1))
+    return terms
+
+
+def document_terms(title: str, abstract: str, tags: list[str], html: str) -> dict[str, int]:
+    """
+    Returns weighted term frequencies of a post.
+    """
+    weights = {}
+    fields = {
+        "title": title,
+        "abstract": abstract,
+        "tags": " ".join(tags),
+        "content": extract_text(html),
+    }
+    for field, text in fields.items():
+        for term in tokenize(text):
+            weights[term] = weights.get(term, 0) + FIELD_WEIGHTS[field]
+    return weights
+
+
+def shard_name(term: str) -> str:
+    if term[:2].isascii():
+        return term[:2]
+    return f"u{ord(term[0]):x}"
+
+
+class SearchIndex:
+    """
+    Holds terms of every indexed post, persisted in cache_file between builds.
+    Documents are keyed by post path and tagged with the fingerprint of the post they were taken from.
+    """
+
+    def __init__(self, cache_file: str) -> None:
+        self.cache_file = cache_file
+        self.documents: dict[str, dict] = {}
+        # document numbers used in output, kept stable between builds
+        self.numbers: dict[str, int] = {}
+        self.lock = threading.Lock()
+        if not os.path.exists(cache_file):
+            return
+        try:
+            with open(cache_file, 'rb') as f:
+                content = json.loads(f.read().decode('utf-8'))
+        except (OSError, ValueError) as e:
+            lg.warning(f"Cannot read search index cache at {cache_file}, ignoring it: {e}")
+            return
+        if content.get("version") == SEARCH_INDEX_VERSION:
+            self.documents = content["documents"]
+            self.numbers = content["numbers"]
+
+    def has_document(self, key: str, fingerprint: str) -> bool:
+        document = self.documents.get(key)
+        return document is not None and document["fingerprint"] == fingerprint
+
+    def update_document(self, key: str, fingerprint: str, title: str, link: str, abstract: str,
+                        tags: list[str], html: str) -> None:
+        terms = document_terms(title, abstract, tags, html)
+        with self.lock:
+            self.documents[key] = {
+                "fingerprint": fingerprint,
+                "doc": [title, link, abstract],
+                "terms": terms,
+            }
+
+    def prune(self, keys: list[str]) -> None:
+        keep = set(keys)
+        with self.lock:
+            for key in [k for k in self.documents if k not in keep]:
+                del self.documents[key]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        with self.lock:
+            data = dumps({"version": SEARCH_INDEX_VERSION,
+                          "documents": self.documents, "numbers": self.numbers})
+        write_if_changed(self.cache_file, data)
+
+    def assign_numbers(self) -> None:
+        """
+        Numbers new documents after existing ones and frees numbers of deleted documents.
+        Everything is renumbered when more than half of the numbers are unused.
+        """
+        self.numbers = {k: n for k, n in self.numbers.items() if k in self.documents}
+        size = max(self.numbers.values(), default=-1) + 1
+        if size > 2 * len(self.numbers):
+            self.numbers = {}
+            size = 0
+        for key in sorted(k for k in self.documents if k not in self.numbers):
+            self.numbers[key] = size
+            size += 1
+
+    def write(self, output_directory: str) -> None:
+        """
+        Writes the inverted index for the frontend, unchanged shards are not rewritten.
+        """
+        self.assign_numbers()
+        size = max(self.numbers.values(), default=-1) + 1
+        docs = [None] * size
+        postings: dict[str, list[tuple[int, int]]] = {}
+        for key, number in sorted(self.numbers.items(), key=lambda item: item[1]):
+            docs[number] = self.documents[key]["doc"]
+            for term, weight in self.documents[key]["terms"].items():
+                postings.setdefault(term, []).append((number, weight))
+        shards: dict[str, dict[str, list[int]]] = {}
+        for term in sorted(postings):
+            encoded = []
+            previous = 0
+            # documents were added in increasing order of number
+            for number, weight in postings[term]:
+                encoded += [number - previous, weight]
+                previous = number
+            shards.setdefault(shard_name(term), {})[term] = encoded
+
+        expected = set()
+        written = 0
+
+        def emit(path: str, content) -> None:
+            nonlocal written
+            expected.add(os.path.normpath(path))
+            written += write_if_changed(path, dumps(content))
+
+        emit(os.path.join(output_directory, "docs.json"), docs)
+        for name, terms in shards.items():
+            emit(os.path.join(output_directory, "shards", f"{name}.json"), terms)
+        emit(os.path.join(output_directory, "meta.json"), {
+            "version": SEARCH_INDEX_VERSION,
+            "documents": len(self.numbers),
+            "shards": sorted(shards),
+        })
+        # docs.json and meta.json are always written, only shards can be stale,
+        # the rest of output_directory is not ours
+        removed = remove_stale_files([os.path.join(output_directory, "shards")], expected)
+        lg.info(f"Search index written, {len(self.numbers)} documents, {len(postings)} terms, "
+                f"{written} files changed, {removed} stale files removed.")
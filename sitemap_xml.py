@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""sitemap_xml.py:
+Writes sitemap.xml (https://www.sitemaps.org/protocol.html) for all posts and pages.
+
+URLs are streamed into gzipped sitemap files of at most 50,000 URLs and 50 MB each,
+    <output dir>/sitemap-1.xml.gz, sitemap-2.xml.gz, ...
+and <output dir>/sitemap.xml is a sitemap index listing them, so the URL given to crawlers
+never changes however many posts there are. Sitemap files are written with a fixed gzip header,
+and every file is only replaced when its content changed, so its mtime (and ETag) stays stable.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import re
+import gzip
+import logging
+from datetime import datetime, timezone
+from typing import Iterable
+from xml.sax.saxutils import escape
+# this package
+from posts_index import write_if_changed, replace_if_changed
+
+lg = logging.getLogger(__name__)
+
+# limits of a single sitemap file set by the protocol
+MAX_URLS = 50000
+MAX_BYTES = 50 * 1024 * 1024
+
+SITEMAP_NAMESPACE = "http://www.sitemaps.org/schemas/sitemap/0.9"
+URLSET_HEADER = f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NAMESPACE}">\n'.encode('utf-8')
+URLSET_FOOTER = b'</urlset>\n'
+
+
+def w3c_datetime(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+00:00")
+
+
+class _SitemapWriter:
+    """
+    Streams URLs into one gzipped sitemap file.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.urls = 0
+        self.size = len(URLSET_HEADER) + len(URLSET_FOOTER)
+        self.modified: float | None = None
+        self.raw = open(self.temp_path, 'wb')
+        # no file name and a fixed mtime in the gzip header, so the same URLs give the same bytes
+        self.file = gzip.GzipFile(filename="", mode='wb', fileobj=self.raw, compresslevel=9, mtime=0)
+        self.file.write(URLSET_HEADER)
+
+    def fits(self, entry: bytes) -> bool:
+        return self.urls < MAX_URLS and self.size + len(entry) <= MAX_BYTES
+
+    def add(self, entry: bytes, modified: float | None) -> None:
+        self.file.write(entry)
+        self.urls += 1
+        self.size += len(entry)
+        if modified is not None and (self.modified is None or modified > self.modified):
+            self.modified = modified
+
+    def close(self) -> bool:
+        """
+        Finishes the file, returns whether it changed.
+        """
+        self.file.write(URLSET_FOOTER)
+        self.file.close()
+        self.raw.close()
+        return replace_if_changed(self.temp_path, self.path)
+
+
+def write_sitemap(urls: Iterable[tuple[str, float | None]], output_directory: str, web_root: str) -> None:
+    """
+    urls: (absolute URL, unix timestamp of last modification or None), consumed once
+    web_root: URL at which output_directory is served, for locations of sitemap files in the index
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    shards: list[tuple[str, float | None]] = []
+    changed = 0
+    writer = None
+
+    def finish() -> None:
+        nonlocal changed
+        changed += writer.close()
+        shards.append((os.path.basename(writer.path), writer.modified))
+
+    total = 0
+    for url, modified in urls:
+        entry = f"<url><loc>{escape(url)}</loc>"
+        if modified is not None:
+            entry += f"<lastmod>{w3c_datetime(modified)}</lastmod>"
+        entry = (entry + "</url>\n").encode('utf-8')
+        if writer is None or not writer.fits(entry):
+            if writer is not None:
+                finish()
+            writer = _SitemapWriter(os.path.join(output_directory, f"sitemap-{len(shards) + 1}.xml.gz"))
+        writer.add(entry, modified)
+        total += 1
+    if writer is None:
+        # an empty sitemap, rather than an index without sitemaps
+        writer = _SitemapWriter(os.path.join(output_directory, "sitemap-1.xml.gz"))
+    finish()
+
+    index = [f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NAMESPACE}">\n']
+    for name, modified in shards:
+        index.append(f"<sitemap><loc>{escape(web_root + name)}</loc>")
+        if modified is not None:
+            index.append(f"<lastmod>{w3c_datetime(modified)}</lastmod>")
+        index.append("</sitemap>\n")
+    index.append("</sitemapindex>\n")
+    changed += write_if_changed(os.path.join(output_directory, "sitemap.xml"), "".join(index).encode('utf-8'))
+
+    # sitemap files beyond the current number of shards
+    removed = 0
+    for name in os.listdir(output_directory):
+        match = re.fullmatch(r"sitemap-(\d+)\.xml\.gz", name)
+        if match and int(match.group(1)) > len(shards):
+            os.remove(os.path.join(output_directory, name))
+            removed += 1
+    lg.info(f"sitemap.xml written, {total} URLs in {len(shards)} sitemap files, "
+            f"{changed} files changed, {removed} stale files removed.")
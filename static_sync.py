@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""static_sync.py:
+Synchronizes static files (images, attachments, etc.) of a post or page to the output directory.
+Only files that changed are copied and only files that are gone from the source are deleted,
+so unchanged files keep their mtimes for the later npm build and deploy steps.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import shutil
+import logging
+from dataclasses import dataclass
+# this package
+from build_manifest import hash_file
+
+lg = logging.getLogger(__name__)
+
+# ioctl request number of FICLONE on linux, clones a file sharing its data blocks (btrfs, xfs, etc.)
+FICLONE = 0x40049409
+
+
+@dataclass
+class SyncStats:
+    copied: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+
+
+def is_unchanged(src: str, dst: str, compare: str) -> bool:
+    """
+    compare: "mtime" treats files with the same size and mtime as unchanged,
+    "hash" compares content of files with the same size.
+    """
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.stat(src)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if compare == "hash":
+        return hash_file(src) == hash_file(dst)
+    # mtime resolution differs between filesystems, whole seconds are compared
+    return int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+
+def _reflink(src: str, dst: str) -> None:
+    import fcntl  # not available on windows, callers fall back to copying
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+    shutil.copystat(src, dst)
+
+
+def place_file(src: str, dst: str, link: str) -> None:
+    """
+    Puts a copy of src at dst.
+    link: "copy", "hardlink" or "reflink", the latter two fall back to copying when
+    not supported, e.g. when src and dst are on different filesystems.
+    """
+    # dst may be a hardlink to src from a previous build, writing into it would modify src
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if link == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError as e:
+            lg.debug(f"Cannot hardlink {src}, copying instead: {e}")
+    elif link == "reflink":
+        try:
+            _reflink(src, dst)
+            return
+        except (OSError, ImportError) as e:
+            lg.debug(f"Cannot reflink {src}, copying instead: {e}")
+            if os.path.lexists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+
+
+def sync_directories(src_root: str, directories: list[str], dst_root: str,
+                     compare: str = "mtime", link: str = "copy",
+                     preserve: tuple[str, ...] = ()) -> SyncStats:
+    """
+    Makes dst_root/<directory> a copy of src_root/<directory> for every directory in directories.
+    Everything else in dst_root is deleted, except for top-level entries named in preserve.
+    """
+    stats = SyncStats()
+    expected = set()
+    os.makedirs(dst_root, exist_ok=True)
+    for directory in directories:
+        for dirpath, _, filenames in os.walk(os.path.join(src_root, directory)):
+            rel_dir = os.path.relpath(dirpath, src_root)
+            os.makedirs(os.path.join(dst_root, rel_dir), exist_ok=True)
+            expected.add(os.path.normpath(rel_dir))
+            for filename in filenames:
+                rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+                expected.add(rel_path)
+                src = os.path.join(src_root, rel_path)
+                dst = os.path.join(dst_root, rel_path)
+                if is_unchanged(src, dst, compare):
+                    stats.unchanged += 1
+                    continue
+                lg.debug(f"Copying {src} to {dst}")
+                place_file(src, dst, link)
+                stats.copied += 1
+    # delete what is gone from source, bottom up so that emptied directories can be removed
+    for dirpath, dirnames, filenames in os.walk(dst_root, topdown=False):
+        rel_dir = os.path.relpath(dirpath, dst_root)
+        if rel_dir.split(os.sep)[0] in preserve:
+            continue
+        for filename in filenames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+            if rel_path.split(os.sep)[0] in preserve or rel_path in expected:
+                continue
+            lg.debug(f"Deleting {rel_path} from {dst_root}")
+            os.remove(os.path.join(dst_root, rel_path))
+            stats.deleted += 1
+        for dirname in dirnames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, dirname))
+            if rel_path.split(os.sep)[0] in preserve or rel_path in expected:
+                continue
+            path = os.path.join(dst_root, rel_path)
+            if os.path.islink(path):
+                os.remove(path)
+            elif os.path.isdir(path) and len(os.listdir(path)) == 0:
+                os.rmdir(path)
+    return stats
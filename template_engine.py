@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+"""template_engine.py:
+A minimal template engine for post_template.html and page_template.html.
+
+Placeholders look like {BLOG_POST_TITLE}: an upper case name in curly braces.
+Any other curly brace is copied to output as is, so CSS and JS in templates need no escaping.
+A template is parsed once into pre-encoded literal chunks and placeholder slots, and
+rendering only joins bytes. Every field is escaped according to its declared escaping:
+    "html": HTML special characters are escaped, for text and attribute values
+    "url": value is percent-encoded and then HTML escaped, for query parameters in links
+    "raw": value is inserted as is, for HTML fragments produced by pandoc
+Unknown placeholders and missing required placeholders are reported when compiling.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import re
+import html
+import logging
+from urllib.parse import quote
+
+lg = logging.getLogger(__name__)
+
+# bump this when rendering output changes for the same template and values
+TEMPLATE_ENGINE_VERSION = 1
+
+PLACEHOLDER_PATTERN = re.compile(r"\{([A-Z][A-Z0-9_]*)\}")
+
+ESCAPERS = {
+    "html": lambda value: html.escape(value, quote=True),
+    "url": lambda value: html.escape(quote(value, safe=""), quote=True),
+    "raw": lambda value: value,
+}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    def __init__(self, name: str, chunks: list[bytes], slots: list[str], fields: dict[str, str]) -> None:
+        """
+        chunks has one more element than slots, output is
+        chunks[0] + slots[0] + chunks[1] + ... + slots[-1] + chunks[-1]
+        """
+        self.name = name
+        self.chunks = chunks
+        self.slots = slots
+        self.escapers = {field: ESCAPERS[escaping] for field, escaping in fields.items()}
+
+    @classmethod
+    def compile(cls, text: str, fields: dict[str, str], required: tuple[str, ...] = (),
+                name: str = "template") -> "CompiledTemplate":
+        """
+        fields: mapping from placeholder names to their escaping, "html", "url" or "raw"
+        required: placeholders that must appear in the template
+        """
+        for field, escaping in fields.items():
+            if escaping not in ESCAPERS:
+                raise TemplateError(f"Unknown escaping {escaping} for field {field}")
+        chunks, slots = [], []
+        unknown = []
+        position = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            field = match.group(1)
+            if field not in fields:
+                line = text.count("\n", 0, match.start()) + 1
+                unknown.append(f"{{{field}}} at line {line}")
+                continue
+            chunks.append(text[position:match.start()].encode('utf-8'))
+            slots.append(field)
+            position = match.end()
+        chunks.append(text[position:].encode('utf-8'))
+        if unknown:
+            raise TemplateError(f"Unknown placeholders in {name}: {', '.join(unknown)}")
+        missing = [field for field in required if field not in slots]
+        if missing:
+            raise TemplateError(f"Missing placeholders in {name}: {', '.join(missing)}")
+        for field in fields:
+            if field not in slots:
+                lg.debug(f"Placeholder {{{field}}} is not used in {name}")
+        return cls(name, chunks, slots, fields)
+
+    def _encode_values(self, values: dict) -> dict[str, bytes]:
+        encoded = {}
+        for field in set(self.slots):
+            if field not in values:
+                raise TemplateError(f"No value given for placeholder {{{field}}} of {self.name}")
+            value = values[field]
+            encoded[field] = self.escapers[field]("" if value is None else str(value)).encode('utf-8')
+        return encoded
+
+    def _render_parts(self, encoded: dict[str, bytes]):
+        yield self.chunks[0]
+        for field, chunk in zip(self.slots, self.chunks[1:]):
+            yield encoded[field]
+            yield chunk
+
+    def render(self, values: dict) -> bytes:
+        return b"".join(self._render_parts(self._encode_values(values)))
+
+    def render_to_file(self, values: dict, file_out: str) -> None:
+        # values are checked and encoded before the output file is touched
+        encoded = self._encode_values(values)
+        with open(file_out, 'wb') as f:
+            for part in self._render_parts(encoded):
+                f.write(part)
+
+
+def load_template(template_file: str, fields: dict[str, str], required: tuple[str, ...] = ()) -> CompiledTemplate:
+    with open(template_file, 'rb') as f:
+        text = f.read().decode('utf-8')
+    return CompiledTemplate.compile(text, fields, required=required, name=template_file)
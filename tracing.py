@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+"""tracing.py:
+Records how long build stages and items take.
+
+Spans are recorded with a context manager:
+    with tracer.span("pandoc", item=post_path):
+        ...
+and written as a Chrome trace (open in chrome://tracing or https://ui.perfetto.dev),
+with every builder thread on its own track. A summary of total time per stage and
+of the slowest items is logged at the end of the build. Totals count self-time: time spent in
+a span nested in another one, e.g. pandoc inside build posts, is only counted for the inner span.
+Spans opened in a function run by a thread pool are nested in the span that submitted it,
+if the function is wrapped with Tracer.wrap().
+Recording a span costs two clock reads and a list append, so tracing can stay on.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import time
+import json
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+lg = logging.getLogger(__name__)
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.origin = time.perf_counter_ns()
+        # (name, item, thread name, start ns, duration ns, id, id of parent span or None),
+        # appending to a list is atomic
+        self.spans: list[tuple[str, str | None, str, int, int, int, int | None]] = []
+        self.ids = itertools.count()
+        # id of the innermost open span of every thread
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, name: str, item: str | None = None):
+        """
+        Records the time spent in the with block as stage name, optionally for a single item.
+        Spans are recorded even if the block raises.
+        """
+        if not self.enabled:
+            yield
+            return
+        span_id = next(self.ids)
+        parent = getattr(self.local, "current", None)
+        self.local.current = span_id
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.spans.append((name, item, threading.current_thread().name,
+                               start - self.origin, time.perf_counter_ns() - start, span_id, parent))
+            self.local.current = parent
+
+    def wrap(self, function):
+        """
+        Returns function, with spans it opens nested in the span open now, in whatever thread it runs.
+        """
+        parent = getattr(self.local, "current", None)
+
+        def wrapped(*args, **kwargs):
+            current = getattr(self.local, "current", None)
+            self.local.current = parent
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.local.current = current
+        return wrapped
+
+    def write_chrome_trace(self, path: str) -> None:
+        if not self.enabled:
+            return
+        threads = {}
+        events = []
+        for name, item, thread, start, duration, _, _ in self.spans:
+            tid = threads.setdefault(thread, len(threads))
+            event = {"name": name, "cat": "build", "ph": "X", "pid": 0, "tid": tid,
+                     "ts": start / 1000, "dur": duration / 1000}
+            if item is not None:
+                event["args"] = {"item": item}
+            events.append(event)
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": thread}})
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}).encode('utf-8'))
+        lg.info(f"Build trace with {len(self.spans)} spans written to {path}")
+
+    def self_times(self) -> list[tuple[str, str | None, int]]:
+        """
+        Returns (name, item, self-time ns) of every span: its duration minus the time
+        during which at least one span directly nested in it was open, on any thread.
+        Children running in parallel are counted once, so self-time is never negative.
+        """
+        children = {}
+        for _, _, _, start, duration, _, parent in self.spans:
+            if parent is not None:
+                children.setdefault(parent, []).append((start, start + duration))
+        result = []
+        for name, item, _, start, duration, span_id, _ in self.spans:
+            end = start + duration
+            # length of the union of child intervals, clipped to this span
+            covered = 0
+            covered_until = start
+            for child_start, child_end in sorted(children.get(span_id, [])):
+                child_start, child_end = max(child_start, covered_until), min(child_end, end)
+                if child_end > child_start:
+                    covered += child_end - child_start
+                    covered_until = child_end
+            result.append((name, item, duration - covered))
+        return result
+
+    def stage_totals(self) -> dict[str, tuple[int, float]]:
+        """
+        Returns number of spans and total self-time in seconds of every stage, slowest first.
+        Stages of parallel items overlap, so totals can exceed wall clock time.
+        """
+        totals = {}
+        for name, _, duration in self.self_times():
+            count, total = totals.get(name, (0, 0))
+            totals[name] = (count + 1, total + duration)
+        return {name: (count, total / 1e9)
+                for name, (count, total) in sorted(totals.items(), key=lambda item: -item[1][1])}
+
+    def slowest_items(self, top: int) -> list[tuple[str, float]]:
+        """
+        Returns items with most time spent in their spans, slowest first.
+        """
+        totals = {}
+        for _, item, duration in self.self_times():
+            if item is not None:
+                totals[item] = totals.get(item, 0) + duration
+        slowest = sorted(totals.items(), key=lambda item: -item[1])[:top]
+        return [(item, total / 1e9) for item, total in slowest]
+
+    def log_summary(self, top: int = 10) -> None:
+        if not self.enabled or len(self.spans) == 0:
+            return
+        lg.warning(f"Build took {(time.perf_counter_ns() - self.origin) / 1e9:.2f}s, time per stage:")
+        for name, (count, total) in self.stage_totals().items():
+            lg.warning(f"  {name:<16} {total:8.2f}s  {count:5d} spans")
+        slowest = self.slowest_items(top)
+        if slowest:
+            lg.warning(f"Slowest {len(slowest)} items:")
+            for item, total in slowest:
+                lg.warning(f"  {total:8.2f}s  {item}")
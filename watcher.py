@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""watcher.py:
+Watches files and directories for changes and reports them in batches.
+
+Uses the watchdog package (inotify on Linux, FSEvents/ReadDirectoryChangesW elsewhere) if it is installed,
+otherwise falls back to polling modification times.
+Editors usually write a file in several steps (temporary file, rename, chmod),
+so events are collected until nothing changed for a short while before they are reported.
+"""
+
+__author__ = "Zhi Zi"
+__email__ = "x@zzi.io"
+__version__ = "20261017"
+
+# std libs
+import os
+import time
+import queue
+import logging
+# third-party libs
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+lg = logging.getLogger(__name__)
+
+# seconds without events before a batch of changes is reported
+DEFAULT_DEBOUNCE = 0.3
+# seconds between scans when polling
+DEFAULT_POLL_INTERVAL = 1.0
+# editor swap and backup files, never reported
+IGNORED_SUFFIXES = (".swp", ".swx", ".tmp", "~")
+
+
+def _is_ignored(path: str) -> bool:
+    name = os.path.basename(path)
+    return name.startswith(".#") or name.endswith(IGNORED_SUFFIXES)
+
+
+class _QueueHandler(FileSystemEventHandler):
+    def __init__(self, events: queue.Queue) -> None:
+        super().__init__()
+        self.events = events
+
+    def on_any_event(self, event):
+        if event.event_type in ("opened", "closed_no_write"):
+            return
+        self.events.put(event.src_path)
+        dest_path = getattr(event, "dest_path", "")
+        if dest_path:
+            self.events.put(dest_path)
+
+
+def _snapshot(paths: list[str]) -> dict[str, tuple[float, int]]:
+    state = {}
+    for path in paths:
+        if os.path.isfile(path):
+            walked = [(os.path.dirname(path), [], [os.path.basename(path)])]
+        else:
+            walked = os.walk(path)
+        for dirpath, _, filenames in walked:
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    continue
+                state[file_path] = (st.st_mtime, st.st_size)
+    return state
+
+
+class ChangeWatcher:
+    """
+    paths: files and directories to watch, directories are watched recursively
+    """
+
+    def __init__(self, paths: list[str], debounce: float = DEFAULT_DEBOUNCE,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL) -> None:
+        self.paths = [os.path.normpath(p) for p in paths]
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.events = queue.Queue()
+        self.observer = None
+
+    def start(self) -> None:
+        if Observer is None:
+            lg.warning("watchdog package not found, polling for changes instead.")
+            self.state = _snapshot(self.paths)
+            return
+        self.observer = Observer()
+        handler = _QueueHandler(self.events)
+        # files are watched through their directories
+        watched = set()
+        for path in self.paths:
+            directory = path if os.path.isdir(path) else os.path.dirname(path) or "."
+            if directory not in watched:
+                self.observer.schedule(handler, directory, recursive=os.path.isdir(path))
+                watched.add(directory)
+        self.observer.start()
+
+    def stop(self) -> None:
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def _is_watched(self, path: str) -> bool:
+        path = os.path.normpath(path)
+        return any(path == p or path.startswith(p + os.sep) for p in self.paths)
+
+    def _poll(self) -> set[str]:
+        while True:
+            time.sleep(self.poll_interval)
+            state = _snapshot(self.paths)
+            changed = {p for p in state.keys() | self.state.keys() if state.get(p) != self.state.get(p)}
+            self.state = state
+            if changed:
+                return changed
+
+    def wait(self) -> set[str]:
+        """
+        Blocks until something changed, returns the changed paths.
+        """
+        if self.observer is None:
+            changed = self._poll()
+        else:
+            changed = {self.events.get()}
+            while True:
+                try:
+                    changed.add(self.events.get(timeout=self.debounce))
+                except queue.Empty:
+                    break
+        return {os.path.normpath(p) for p in changed if self._is_watched(p) and not _is_ignored(p)}